@@ -125,7 +125,12 @@ local db = import 'db.libsonnet';
                         name: fullyQualifiedName,
                         namespace: namespace.metadata.name,
                         labels: podLabels,
-                        annotations: annotations
+                        // Let Prometheus know where to scrape the metrics each pod exports.
+                        annotations: annotations + {
+                            'prometheus.io/scrape': 'true',
+                            'prometheus.io/port': std.toString(apiPort),
+                            'prometheus.io/path': '/metrics'
+                        }
                     },
                     spec: {
                         # This block tells the cluster that we'd like to make sure
@@ -155,24 +160,24 @@ local db = import 'db.libsonnet';
                                 name: fullyQualifiedName,
                                 image: image,
                                 # Stop serving traffic if the container is busy doing something
-                                # else.
+                                # else, or is still loading and warming up its model.
                                 readinessProbe: {
                                     httpGet: {
                                         port: apiPort,
                                         scheme: 'HTTP',
-                                        path: '/?check=readiness_probe'
+                                        path: '/ready'
                                     },
                                     periodSeconds: 10,
                                     failureThreshold: 1,
                                 },
 
                                 # Restart the container if the container doesn't respond for a
-                                # a full minute.
+                                # a full minute, or if its model failed to load.
                                 livenessProbe: {
                                     httpGet: {
                                         port: apiPort,
                                         scheme: 'HTTP',
-                                        path: '/?check=liveness_probe'
+                                        path: '/live'
                                     },
                                     periodSeconds: 10,
                                     failureThreshold: 6,
@@ -0,0 +1,281 @@
+import heapq
+import logging
+import os
+import tempfile
+import threading
+from copy import deepcopy
+from typing import List, Optional, Tuple
+
+import numpy
+import torch
+from allennlp.common.util import JsonDict
+from allennlp.data import Instance, Token
+from allennlp.data.fields import TextField
+from allennlp.interpret.attackers import Hotflip, InputReduction
+from allennlp.interpret.attackers import utils as attacker_utils
+from allennlp.interpret.attackers.hotflip import DEFAULT_IGNORE_TOKENS
+from allennlp.interpret.attackers.input_reduction import _get_ner_tags_and_mask, _remove_one_token
+from allennlp.modules.token_embedders import Embedding
+from allennlp.nn import util
+from allennlp.predictors.predictor import Predictor
+
+from allennlp_demo.common import progress
+from allennlp_demo.common.budget import current_budget
+
+
+logger = logging.getLogger(__name__)
+
+
+class LazyHotflip(Hotflip):
+    """
+    A `Hotflip` attacker that's initialized by the first attack, rather than when it's loaded,
+    and that stops when the current budget (see `allennlp_demo.common.budget`) is exhausted.
+
+    Initializing Hotflip means finding a vector for each token in the vocabulary. When the model
+    embeds tokens with a single embedding matrix that's the matrix itself, which is cheap. For
+    other models (i.e. ones with character-level encoders or ELMo) up to `max_tokens` tokens
+    are run through the model's embedder, which is slow and uses a lot of memory. If a
+    `cache_dir` is given, the resulting matrix is written to it and memory-mapped by later
+    processes, rather than being computed again. The `cache_dir` should be specific to the
+    version of the model, see `allennlp_demo.common.snapshot.snapshot_path()`.
+    """
+
+    def __init__(
+        self,
+        predictor: Predictor,
+        vocab_namespace: str = "tokens",
+        max_tokens: int = 5000,
+        cache_dir: Optional[str] = None,
+    ) -> None:
+        super().__init__(predictor, vocab_namespace, max_tokens)
+        self.cache_dir = cache_dir
+        self._initialize_lock = threading.Lock()
+
+    def initialize(self) -> None:
+        # Concurrent attacks wait for the first one to initialize things, rather than all of
+        # them doing so.
+        with self._initialize_lock:
+            if self.embedding_matrix is None:
+                self.embedding_matrix = self._construct_embedding_matrix()
+
+    def _cache_path(self) -> Optional[str]:
+        if self.cache_dir is None:
+            return None
+        return os.path.join(
+            self.cache_dir, f"hotflip-{self.namespace}-{self.max_tokens}-embeddings.npy"
+        )
+
+    def _construct_embedding_matrix(self) -> torch.Tensor:
+        embedding_layer = self.predictor.get_interpretable_layer()
+        path = self._cache_path()
+        if path is None or isinstance(embedding_layer, (Embedding, torch.nn.Embedding)):
+            with torch.no_grad():
+                return super()._construct_embedding_matrix()
+
+        if os.path.isfile(path):
+            logger.info(f"Loading the Hotflip embedding matrix from {path}")
+            self.embedding_layer = embedding_layer
+            # Only the first `max_tokens` tokens are candidates, as when the matrix was built.
+            all_tokens = list(self.vocab._token_to_index[self.namespace])[: self.max_tokens]
+            max_index = self.vocab.get_token_index(all_tokens[-1], self.namespace)
+            self.invalid_replacement_indices = [
+                i for i in self.invalid_replacement_indices if i < max_index
+            ]
+            return torch.from_numpy(numpy.load(path, mmap_mode="c"))
+
+        # The matrix is only ever read, so there's no need to keep what autograd would need to
+        # compute gradients of it.
+        with torch.no_grad():
+            embedding_matrix = super()._construct_embedding_matrix()
+        tmp = None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write to a temporary file first, so that other processes never read a partial one.
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".npy")
+            with os.fdopen(fd, "wb") as fh:
+                numpy.save(fh, embedding_matrix.cpu().numpy())
+            os.replace(tmp, path)
+            tmp = None
+        except OSError:
+            logger.exception(f"Unable to save the Hotflip embedding matrix to {path}")
+        finally:
+            # Don't leave a partial file behind if the write failed.
+            if tmp is not None:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+        return embedding_matrix
+
+    def attack_instance(
+        self,
+        instance: Instance,
+        inputs: JsonDict,
+        input_field_to_attack: str = "tokens",
+        grad_input_field: str = "grad_input_1",
+        ignore_tokens: List[str] = None,
+        target: JsonDict = None,
+    ) -> Tuple[List[Token], JsonDict]:
+        """
+        This is `Hotflip.attack_instance()`, except that it stops flipping tokens when the
+        current budget is exhausted, and returns the tokens flipped so far. Each flip is reported
+        as a step (see `allennlp_demo.common.progress`).
+        """
+        if self.embedding_matrix is None:
+            self.initialize()
+        budget = current_budget()
+
+        ignore_tokens = DEFAULT_IGNORE_TOKENS if ignore_tokens is None else ignore_tokens
+        sign = -1 if target is None else 1
+        fields_to_compare = attacker_utils.get_fields_to_compare(
+            inputs, instance, input_field_to_attack
+        )
+        text_field: TextField = instance[input_field_to_attack]  # type: ignore
+
+        grads, outputs = self.predictor.get_gradients([instance])
+        budget.spend()
+
+        flipped: List[int] = []
+        for index, token in enumerate(text_field.tokens):
+            if token.text in ignore_tokens:
+                flipped.append(index)
+        if "clusters" in outputs:
+            # Coref needs a special case, so that words in the same predicted cluster aren't
+            # flipped.
+            for cluster in outputs["clusters"]:
+                for mention in cluster:
+                    for index in range(mention[0], mention[1] + 1):
+                        flipped.append(index)
+
+        while True:
+            grad = grads[grad_input_field][0]
+            grads_magnitude = [g.dot(g) for g in grad]
+            for index in flipped:
+                grads_magnitude[index] = -1
+
+            index_of_token_to_flip = numpy.argmax(grads_magnitude)
+            if grads_magnitude[index_of_token_to_flip] == -1:
+                # We've already flipped all of the tokens.
+                break
+            if budget.stop():
+                break
+            flipped.append(index_of_token_to_flip)
+
+            text_field_tensors = text_field.as_tensor(text_field.get_padding_lengths())
+            input_tokens = util.get_token_ids_from_text_field_tensors(text_field_tensors)
+            original_id_of_token_to_flip = input_tokens[index_of_token_to_flip]
+
+            new_id = self._first_order_taylor(
+                grad[index_of_token_to_flip], original_id_of_token_to_flip, sign
+            )
+            new_token = Token(self.vocab._index_to_token[self.namespace][new_id])  # type: ignore
+            text_field.tokens[index_of_token_to_flip] = new_token
+            instance.indexed = False
+
+            grads, outputs = self.predictor.get_gradients([instance])
+            budget.spend()
+            for key, output in outputs.items():
+                if isinstance(output, torch.Tensor):
+                    outputs[key] = output.detach().cpu().numpy().squeeze()
+                elif isinstance(output, list):
+                    outputs[key] = output[0]
+            progress.report_step(text_field.tokens, outputs)
+
+            labeled_instance = self.predictor.predictions_to_labeled_instances(instance, outputs)[0]
+            has_changed = attacker_utils.instance_has_changed(labeled_instance, fields_to_compare)
+            if target is None and has_changed:
+                break
+            if target is not None and not has_changed:
+                break
+        return text_field.tokens, outputs
+
+
+class BudgetedInputReduction(InputReduction):
+    """
+    An `InputReduction` attacker that stops removing tokens when the current budget (see
+    `allennlp_demo.common.budget`) is exhausted, and returns the smallest input it found so far
+    that doesn't change the model's prediction. Each smaller input that doesn't change the
+    prediction is reported as a step (see `allennlp_demo.common.progress`).
+    """
+
+    def _attack_instance(
+        self,
+        inputs: JsonDict,
+        instance: Instance,
+        input_field_to_attack: str,
+        grad_input_field: str,
+        ignore_tokens: List[str],
+    ):
+        budget = current_budget()
+        fields_to_compare = attacker_utils.get_fields_to_compare(
+            inputs, instance, input_field_to_attack
+        )
+
+        # We keep at least one token for classification, entailment, etc. For NER we keep the
+        # tagged tokens and ignore the rest.
+        if "tags" not in instance:
+            num_ignore_tokens = 1
+            tag_mask = None
+        else:
+            num_ignore_tokens, tag_mask, original_tags = _get_ner_tags_and_mask(
+                instance, input_field_to_attack, ignore_tokens
+            )
+
+        text_field: TextField = instance[input_field_to_attack]  # type: ignore
+        current_tokens = deepcopy(text_field.tokens)
+        candidates = [(instance, -1, tag_mask)]
+
+        def get_length(input_instance: Instance):
+            input_text_field: TextField = input_instance[input_field_to_attack]  # type: ignore
+            return len(input_text_field.tokens)
+
+        while len(current_tokens) > num_ignore_tokens and candidates:
+            candidates = heapq.nsmallest(self.beam_size, candidates, key=lambda x: get_length(x[0]))
+            beam_candidates = deepcopy(candidates)
+            candidates = []
+            for beam_instance, smallest_idx, tag_mask in beam_candidates:
+                if budget.stop():
+                    return current_tokens
+
+                beam_tag_mask = deepcopy(tag_mask)
+                grads, outputs = self.predictor.get_gradients([beam_instance])
+                budget.spend()
+                for output in outputs:
+                    if isinstance(outputs[output], torch.Tensor):
+                        outputs[output] = outputs[output].detach().cpu().numpy().squeeze().squeeze()
+                    elif isinstance(outputs[output], list):
+                        outputs[output] = outputs[output][0]
+
+                # Skip candidates that change the prediction.
+                if "tags" not in instance:
+                    beam_instance = self.predictor.predictions_to_labeled_instances(
+                        beam_instance, outputs
+                    )[0]
+                    if attacker_utils.instance_has_changed(beam_instance, fields_to_compare):
+                        continue
+                else:
+                    if smallest_idx != -1:
+                        del beam_tag_mask[smallest_idx]  # type: ignore
+                    cur_tags = [
+                        outputs["tags"][x]
+                        for x in range(len(outputs["tags"]))
+                        if beam_tag_mask[x]  # type: ignore
+                    ]
+                    if cur_tags != original_tags:
+                        continue
+
+                text_field: TextField = beam_instance[input_field_to_attack]  # type: ignore
+                current_tokens = deepcopy(text_field.tokens)
+                if smallest_idx != -1:
+                    progress.report_step(current_tokens, outputs)
+                candidates.extend(
+                    _remove_one_token(
+                        beam_instance,
+                        input_field_to_attack,
+                        grads[grad_input_field][0],
+                        ignore_tokens,
+                        self.beam_size,
+                        beam_tag_mask,  # type: ignore
+                    )
+                )
+        return current_tokens
@@ -0,0 +1,131 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Tuple
+
+from allennlp_demo.common import timing
+
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Groups items that are submitted concurrently (i.e. by different request threads) and
+    processes them with a single call to `fn`.
+
+    The first item that arrives opens a batch. The batch is closed and processed once it contains
+    `max_batch_size` items or `max_wait_ms` milliseconds have passed, whichever happens first.
+    Items are processed by a single background thread, so `fn` is never called concurrently.
+
+    `fn` must accept a list of items and return a list of results of the same length, in the
+    same order. The spans that `fn` runs (see `allennlp_demo.common.timing`) are added to the
+    timings of each request whose item was in the batch, since each of them waited for all of it.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[List[Any]], List[Any]],
+        max_batch_size: int,
+        max_wait_ms: float,
+        name: str = "micro-batcher",
+    ):
+        assert max_batch_size >= 1, "max_batch_size must be at least 1"
+        assert max_wait_ms >= 0, "max_wait_ms can't be negative"
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.name = name
+        self._start_lock = threading.Lock()
+        self._start()
+
+    def _start(self) -> None:
+        self._queue: "queue.Queue[Tuple[Any, Future]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        self._pid = os.getpid()
+
+    def submit(self, item: Any) -> Any:
+        """
+        Adds the item to the next batch and blocks until its result is available. Exceptions
+        raised while processing the item are re-raised in the calling thread.
+        """
+        if self._pid != os.getpid():
+            # Threads don't survive a fork, so forked worker processes start their own.
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._start()
+        future: Future = Future()
+        self._queue.put((item, future))
+        result, timings = future.result()
+        timing.add(timings)
+        return result
+
+    def close(self) -> None:
+        """
+        Stops the background thread, once the items that are already queued are processed.
+        """
+        if self._pid == os.getpid():
+            self._queue.put((None, None))
+
+    def __len__(self) -> int:
+        """
+        Returns the number of items waiting to be processed.
+        """
+        return self._queue.qsize() if self._pid == os.getpid() else 0
+
+    def _next_batch(self) -> List[Tuple[Any, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout <= 0:
+                    # Don't wait any longer, but take whatever is already queued up.
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            # `close()` queues an item without a future.
+            closed = any(f is None for _, f in batch)
+            batch = [
+                (item, f) for item, f in batch if f is not None and f.set_running_or_notify_cancel()
+            ]
+            if batch:
+                self._process(batch)
+            if closed:
+                return
+
+    def _process(self, batch: List[Tuple[Any, Future]]) -> None:
+        items = [item for item, _ in batch]
+        try:
+            with timing.collect() as timings:
+                results = self.fn(items)
+            if len(results) != len(items):
+                raise RuntimeError(f"Expected {len(items)} results, got {len(results)}")
+        except Exception as err:
+            if len(batch) == 1:
+                batch[0][1].set_exception(err)
+                return
+            # A single bad input shouldn't fail every request it happened to be batched with,
+            # so we retry the items one by one. Only the bad ones will fail the second time.
+            logger.warning(f"Batch of {len(batch)} failed, retrying items individually: {err}")
+            for item, f in batch:
+                try:
+                    with timing.collect() as item_timings:
+                        result = self.fn([item])[0]
+                    f.set_result((result, item_timings))
+                except Exception as item_err:
+                    f.set_exception(item_err)
+            return
+        for (_, f), result in zip(batch, results):
+            f.set_result((result, timings))
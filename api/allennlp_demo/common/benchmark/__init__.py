@@ -0,0 +1,18 @@
+"""
+Measures the throughput and latency of model endpoints, to size replicas and to catch
+regressions.
+
+A benchmark sends a `Workload`, a weighted mix of predictions, interpretations and attacks, to a
+`Target`: either an endpoint's Flask app in the same process, or an endpoint that's served over
+HTTP. Requests are sent by a fixed number of threads, either as fast as the endpoint responds or
+at a fixed rate. The results are split into requests that were served from the cache and those
+that weren't, and can be written to a JSON file and compared with those of an earlier run. To
+benchmark the `bidaf` demo with 4 concurrent clients for a minute, run:
+
+    python -m allennlp_demo.common.benchmark bidaf --concurrency 4 --duration-s 60 \\
+        --attack-field question --grad-field grad_input_2 --output bidaf.json
+"""
+from allennlp_demo.common.benchmark.report import regressions, summarize
+from allennlp_demo.common.benchmark.runner import Run, Sample, run, send_requests, warm_up
+from allennlp_demo.common.benchmark.targets import HttpTarget, InProcessTarget, Target
+from allennlp_demo.common.benchmark.workload import Operation, Workload
@@ -0,0 +1,152 @@
+import argparse
+import datetime
+import json
+import logging
+import sys
+from typing import Dict, List, Optional
+
+from allennlp_demo.common.benchmark.report import format_summary, regressions, summarize, write
+from allennlp_demo.common.benchmark.runner import run, warm_up
+from allennlp_demo.common.benchmark.targets import HttpTarget, InProcessTarget, Target
+from allennlp_demo.common.benchmark.workload import Workload
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in ("predict", "interpret", "attack"):
+            raise argparse.ArgumentTypeError(f"unknown operation {kind}")
+        mix[kind] = float(weight)
+    return mix
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m allennlp_demo.common.benchmark",
+        description="Measures the throughput and latency of a model endpoint.",
+    )
+    parser.add_argument(
+        "demo",
+        nargs="?",
+        help="the demo whose test inputs make up the workload, and whose endpoint is benchmarked "
+        "unless --url is given, i.e. bidaf",
+    )
+    parser.add_argument("--url", help="benchmark the endpoint served at this URL instead")
+    parser.add_argument("--workload", help="a JSON file with the operations to send")
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        help="the weights of the demo's operations, i.e. predict=8,interpret=1,attack=1",
+    )
+    parser.add_argument("--attack-field", help="the input field attacks change, i.e. question")
+    parser.add_argument("--grad-field", help="the gradient attacks follow, i.e. grad_input_2")
+    parser.add_argument(
+        "--cold-fraction",
+        type=float,
+        default=None,
+        help="the fraction of requests that bypass the cache (0.5 by default)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=1, help="how many clients to run")
+    parser.add_argument("--rps", type=float, help="send requests at this rate")
+    parser.add_argument("--requests", type=int, help="stop after this many requests")
+    parser.add_argument("--duration-s", type=float, help="stop after this many seconds")
+    parser.add_argument(
+        "--no-warm-up",
+        action="store_true",
+        help="don't send each operation once before the requests that are measured",
+    )
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument(
+        "--baseline", help="compare the results with those of an earlier run, in this JSON file"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="how much slower than the baseline a run may be, i.e. 0.1 for 10%%",
+    )
+    parsed = parser.parse_args(args)
+    if parsed.requests is None and parsed.duration_s is None:
+        parser.error("either --requests or --duration-s is required")
+    if parsed.workload is None and parsed.demo is None:
+        parser.error("either a demo or --workload is required")
+    if parsed.url is None and parsed.demo is None:
+        parser.error("a demo is required unless --url is given")
+
+    logging.basicConfig(level=logging.INFO)
+
+    if parsed.workload is not None:
+        workload = Workload.from_file(parsed.workload)
+        if parsed.cold_fraction is not None:
+            workload = Workload(workload.operations, parsed.cold_fraction, parsed.seed)
+    else:
+        workload = Workload.for_demo(
+            parsed.demo,
+            mix=parsed.mix,
+            attack_field=parsed.attack_field,
+            grad_field=parsed.grad_field,
+            cold_fraction=0.5 if parsed.cold_fraction is None else parsed.cold_fraction,
+            seed=parsed.seed,
+        )
+
+    target: Target
+    if parsed.url is not None:
+        target = HttpTarget(parsed.url)
+    else:
+        from allennlp_demo.common.host import endpoint_class
+
+        endpoint = endpoint_class(parsed.demo)()  # type: ignore
+        endpoint.wait_until_ready()
+        target = InProcessTarget(endpoint.app)
+
+    if not parsed.no_warm_up:
+        warm_up(target, workload)
+    result = run(
+        target,
+        workload,
+        requests=parsed.requests,
+        duration_s=parsed.duration_s,
+        concurrency=parsed.concurrency,
+        rps=parsed.rps,
+    )
+    summary = summarize(result)
+    print(format_summary(summary))
+    settings = {
+        "concurrency": parsed.concurrency,
+        "rps": parsed.rps,
+        "requests": parsed.requests,
+        "duration_s": parsed.duration_s,
+        "warm_up": not parsed.no_warm_up,
+    }
+
+    if parsed.output is not None:
+        write(
+            parsed.output,
+            {
+                "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "target": target.describe(),
+                "demo": parsed.demo,
+                "settings": settings,
+                "workload": workload.to_json(),
+                "elapsed_s": result.elapsed_s,
+                "summary": summary,
+            },
+        )
+
+    if parsed.baseline is not None:
+        with open(parsed.baseline) as fh:
+            baseline = json.load(fh)
+        if baseline.get("settings") != settings or baseline.get("workload") != workload.to_json():
+            print("The baseline was run with different settings or workload", file=sys.stderr)
+        found = regressions(baseline["summary"], summary, parsed.tolerance)
+        for regression in found:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if found:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import json
+import math
+from typing import Any, Dict, List
+
+from allennlp_demo.common.benchmark.runner import COLD, WARM, Run, Sample
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Returns the `q`th percentile of the values, using the nearest rank.
+    """
+    if not values:
+        return math.nan
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def stats(samples: List[Sample], elapsed_s: float) -> Dict[str, Any]:
+    """
+    Summarizes the samples: how many requests there were, how many failed, the rate at which
+    they succeeded and the latency of those that did.
+    """
+    latencies = [s.latency_ms for s in samples if s.ok]
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(latencies),
+        "throughput_rps": len(latencies) / elapsed_s if elapsed_s > 0 else 0.0,
+        "mean_ms": sum(latencies) / len(latencies) if latencies else math.nan,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": max(latencies, default=math.nan),
+    }
+
+
+def summarize(run: Run) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Returns the stats of all of the requests, and of those of each operation, split into those
+    that were served from the cache (`warm`) and those that weren't (`cold`). For example
+    `summary["predict"]["cold"]["p95_ms"]`.
+    """
+    groups: Dict[str, List[Sample]] = {"all": run.samples}
+    for s in run.samples:
+        groups.setdefault(s.operation, []).append(s)
+    return {
+        name: {
+            "all": stats(samples, run.elapsed_s),
+            COLD: stats([s for s in samples if s.cache == COLD], run.elapsed_s),
+            WARM: stats([s for s in samples if s.cache == WARM], run.elapsed_s),
+        }
+        for name, samples in groups.items()
+    }
+
+
+def _json_safe(value: Any) -> Any:
+    # JSON has no NaN, so stats of empty groups are written as null.
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, dict):
+        return {k: _json_safe(v) for k, v in value.items()}
+    return value
+
+
+def write(path: str, result: Dict[str, Any]) -> None:
+    with open(path, "w") as fh:
+        json.dump(_json_safe(result), fh, indent=2, sort_keys=True)
+
+
+def regressions(
+    baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float = 0.1
+) -> List[str]:
+    """
+    Compares the summary of a run with that of an earlier one, and describes each operation whose
+    p95 latency grew, or whose throughput fell, by more than `tolerance` (i.e. 10%). Groups that
+    only one of the runs has, or that had too few requests for a p95, aren't compared.
+    """
+    found = []
+    for name, groups in current.items():
+        for cache, now in groups.items():
+            before = baseline.get(name, {}).get(cache)
+            if before is None or now["requests"] < 20 or before["requests"] < 20:
+                continue
+            if (
+                before["p95_ms"]
+                and now["p95_ms"]
+                and now["p95_ms"] > before["p95_ms"] * (1 + tolerance)
+            ):
+                found.append(
+                    f"{name} ({cache}): p95 went from {before['p95_ms']:.1f}ms to "
+                    f"{now['p95_ms']:.1f}ms"
+                )
+            if now["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+                found.append(
+                    f"{name} ({cache}): throughput went from {before['throughput_rps']:.1f} to "
+                    f"{now['throughput_rps']:.1f} requests per second"
+                )
+    return found
+
+
+def format_summary(summary: Dict[str, Dict[str, Dict[str, Any]]]) -> str:
+    """
+    Returns the summary as a table, for people to read.
+    """
+    columns = ["requests", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms"]
+    lines = ["\t".join(["operation", "cache"] + columns)]
+    for name, groups in summary.items():
+        for cache, s in groups.items():
+            if s["requests"] == 0:
+                continue
+            values = [
+                str(s[c]) if isinstance(s[c], int) else f"{s[c]:.1f}" if s[c] is not None else "-"
+                for c in columns
+            ]
+            lines.append("\t".join([name, cache] + values))
+    return "\n".join(lines)
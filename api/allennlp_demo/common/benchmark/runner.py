@@ -0,0 +1,178 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+from allennlp_demo.common.benchmark.targets import Target
+from allennlp_demo.common.benchmark.workload import Operation, Workload
+
+
+logger = logging.getLogger(__name__)
+
+COLD = "cold"
+WARM = "warm"
+
+
+@dataclass(frozen=True)
+class Sample:
+    """
+    The outcome of one request.
+    """
+
+    operation: str
+    start_s: float
+    """
+    When the request was due to be sent, in seconds since the run started.
+    """
+    latency_ms: float
+    status: int
+    """
+    The response's status code, or 0 if there wasn't a response.
+    """
+    cache: str
+    """
+    `warm` if the response was served from the cache, `cold` otherwise.
+    """
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+
+@dataclass(frozen=True)
+class Run:
+    samples: List[Sample]
+    elapsed_s: float
+
+
+class _Schedule:
+    """
+    Hands out the requests of a run to the threads that send them. Without a rate, each thread
+    sends its next request as soon as it has a response to the last one. With one, requests are
+    due at fixed intervals, whether or not the earlier ones are done.
+    """
+
+    def __init__(
+        self,
+        workload: Workload,
+        requests: Optional[int],
+        duration_s: Optional[float],
+        rps: Optional[float],
+    ):
+        self.workload = workload
+        self.requests = requests
+        self.duration_s = duration_s
+        self.rps = rps
+        self.sent = 0
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def next(self) -> Optional[Tuple[Operation, bool, float]]:
+        """
+        Returns the next request, whether to bypass the cache and when it's due, or `None` if
+        the run is over.
+        """
+        with self._lock:
+            if self.requests is not None and self.sent >= self.requests:
+                return None
+            if self.rps is not None:
+                offset = self.sent / self.rps
+            else:
+                offset = time.perf_counter() - self.start
+            if self.duration_s is not None and offset >= self.duration_s:
+                return None
+            self.sent += 1
+            op, no_cache = self.workload.next()
+        return op, no_cache, self.start + offset
+
+
+def run(
+    target: Target,
+    workload: Workload,
+    requests: Optional[int] = None,
+    duration_s: Optional[float] = None,
+    concurrency: int = 1,
+    rps: Optional[float] = None,
+) -> Run:
+    """
+    Sends the workload's requests to the target from `concurrency` threads, until `requests` have
+    been sent or `duration_s` seconds have passed.
+
+    Without `rps` each thread waits for a response before sending its next request, which
+    measures how many requests the target can handle at that concurrency. With `rps` requests are
+    sent at that rate, as long as a thread is free to send them. The latency of each request is
+    measured from when it was due rather than from when it was sent, so that the time requests
+    spend waiting for a thread when the target can't keep up counts towards their latency.
+    """
+    assert requests is not None or duration_s is not None, "requests or duration_s must be set"
+    assert concurrency >= 1, "concurrency must be at least 1"
+    assert rps is None or rps > 0, "rps must be positive"
+
+    schedule = _Schedule(workload, requests, duration_s, rps)
+    return send_requests(target, schedule.next, concurrency, schedule.start)
+
+
+def send_requests(
+    target: Target,
+    next_request: Callable[[], Optional[Tuple[Operation, bool, float]]],
+    concurrency: int,
+    start: float,
+) -> Run:
+    """
+    Sends requests to the target from `concurrency` threads. Each thread calls `next_request`
+    for the next operation to send, whether to bypass the cache and when it's due (a
+    `time.perf_counter()` value), until it returns `None`. Latencies are measured from when each
+    request was due, and start times from `start`.
+    """
+    samples: List[Sample] = []
+    samples_lock = threading.Lock()
+
+    def send() -> None:
+        while True:
+            request = next_request()
+            if request is None:
+                return
+            op, no_cache, due = request
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                status, hit = target.send(op.route, op.body, no_cache, op.query)
+            except Exception:
+                logger.exception(f"Request to {op.route} failed")
+                status, hit = 0, False
+            sample = Sample(
+                op.name,
+                due - start,
+                (time.perf_counter() - due) * 1000,
+                status,
+                WARM if hit else COLD,
+            )
+            with samples_lock:
+                samples.append(sample)
+
+    threads = [
+        threading.Thread(target=send, name=f"benchmark-{i}", daemon=True)
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return Run(sorted(samples, key=lambda s: s.start_s), time.perf_counter() - start)
+
+
+def warm_up(target: Target, workload: Workload) -> None:
+    """
+    Sends each of the workload's operations once, so that lazy initialization isn't measured.
+    The results are cached, like those of any other request.
+    """
+    for op in workload.operations:
+        try:
+            status, _ = target.send(op.route, op.body, query=op.query)
+        except Exception:
+            logger.exception(f"Warm-up request to {op.route} failed")
+            continue
+        if status >= 400:
+            logger.warning(f"Warm-up request to {op.route} returned {status}")
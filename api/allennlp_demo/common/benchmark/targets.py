@@ -0,0 +1,123 @@
+import http.client
+import json
+import threading
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+from flask import Flask
+
+
+def _query_string(no_cache: bool, query: Optional[Dict[str, str]]) -> Dict[str, str]:
+    args = dict(query or {})
+    if no_cache:
+        args["no_cache"] = "true"
+    return args
+
+
+class Target:
+    """
+    Sends the benchmark's requests somewhere, and reports the status of each response and
+    whether it was served from the cache. Targets are used by several threads at once.
+    """
+
+    def send(
+        self,
+        route: str,
+        body: Any,
+        no_cache: bool = False,
+        query: Optional[Dict[str, str]] = None,
+    ) -> Tuple[int, bool]:
+        raise NotImplementedError
+
+    def describe(self) -> str:
+        raise NotImplementedError
+
+
+class InProcessTarget(Target):
+    """
+    Sends requests straight to a Flask app, i.e. that of a `ModelEndpoint`, in the same process.
+    This measures the endpoint without the network or the WSGI server.
+    """
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self._local = threading.local()
+
+    def send(
+        self,
+        route: str,
+        body: Any,
+        no_cache: bool = False,
+        query: Optional[Dict[str, str]] = None,
+    ) -> Tuple[int, bool]:
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        resp = client.post(route, json=body, query_string=_query_string(no_cache, query))
+        # Streamed responses are only complete once they've been read.
+        resp.get_data()
+        return resp.status_code, resp.headers.get("X-Cache-Hit") == "1"
+
+    def describe(self) -> str:
+        return f"in-process:{self.app.name}"
+
+
+class HttpTarget(Target):
+    """
+    Sends requests to an endpoint over HTTP, i.e. `http://localhost:8000`, or to one that's
+    served by a host, i.e. `http://localhost:8000/bidaf`. Each thread keeps its connection open.
+    """
+
+    def __init__(
+        self, url: str, timeout_s: float = 120.0, headers: Optional[Dict[str, str]] = None
+    ):
+        parts = urlsplit(url)
+        assert parts.scheme in ("http", "https"), f"unsupported url {url}"
+        self.url = url
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip("/")
+        self.timeout_s = timeout_s
+        self.headers = {"Content-Type": "application/json", **(headers or {})}
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            cls = (
+                http.client.HTTPSConnection
+                if self.scheme == "https"
+                else http.client.HTTPConnection
+            )
+            conn = self._local.conn = cls(self.netloc, timeout=self.timeout_s)
+        return conn
+
+    def send(
+        self,
+        route: str,
+        body: Any,
+        no_cache: bool = False,
+        query: Optional[Dict[str, str]] = None,
+    ) -> Tuple[int, bool]:
+        path = self.prefix + route
+        query_string = _query_string(no_cache, query)
+        if query_string:
+            path += "?" + urlencode(query_string)
+        data = json.dumps(body).encode()
+        try:
+            return self._post(path, data)
+        except (http.client.HTTPException, ConnectionError):
+            # The server may have closed the connection while it was idle, so try a new one.
+            self._local.conn.close()
+            self._local.conn = None
+            return self._post(path, data)
+
+    def _post(self, path: str, data: bytes) -> Tuple[int, bool]:
+        conn = self._connection()
+        conn.request("POST", path, body=data, headers=self.headers)
+        resp = conn.getresponse()
+        resp.read()
+        return resp.status, resp.getheader("X-Cache-Hit") == "1"
+
+    def describe(self) -> str:
+        return self.url
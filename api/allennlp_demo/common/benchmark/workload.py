@@ -0,0 +1,142 @@
+import json
+import random
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class Operation:
+    """
+    A request that the benchmark sends, like a prediction or an attack with certain inputs.
+    """
+
+    name: str
+    """
+    What the operation is reported as. Operations with the same name, i.e. predictions with
+    different inputs, are reported together.
+    """
+
+    route: str
+    """
+    The route the request is sent to, i.e. `/predict` or `/interpret/simple_gradient`.
+    """
+
+    body: Any
+    """
+    The JSON body of the request.
+    """
+
+    weight: float = 1.0
+    """
+    How often the operation is sent, relative to the others.
+    """
+
+    query: Optional[Dict[str, str]] = None
+    """
+    Query string arguments to send with the request, i.e. `{"deadline_ms": "5000"}`.
+    """
+
+
+@dataclass
+class Workload:
+    """
+    The mix of operations the benchmark sends to an endpoint.
+    """
+
+    operations: List[Operation]
+
+    cold_fraction: float = 0.5
+    """
+    The fraction of requests that are sent with `no_cache`, so that they're computed rather than
+    served from the cache. With a small set of inputs almost every other request hits the cache,
+    so this is what decides how many cold requests are measured.
+    """
+
+    seed: int = 0
+    """
+    Seeds the choice of operations, so that runs with the same workload send the same requests
+    in the same order.
+    """
+
+    _rng: random.Random = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        assert self.operations, "a workload needs at least one operation"
+        assert 0 <= self.cold_fraction <= 1, "cold_fraction must be between 0 and 1"
+        self._rng = random.Random(self.seed)
+
+    def next(self) -> Tuple[Operation, bool]:
+        """
+        Returns the next operation to send, and whether to send it with `no_cache`. This isn't
+        thread safe.
+        """
+        op = self._rng.choices(self.operations, [op.weight for op in self.operations])[0]
+        return op, self._rng.random() < self.cold_fraction
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "operations": [asdict(op) for op in self.operations],
+            "cold_fraction": self.cold_fraction,
+            "seed": self.seed,
+        }
+
+    @classmethod
+    def from_file(cls, path: str) -> "Workload":
+        """
+        Reads a workload from a JSON file with the same structure that `to_json()` returns, i.e.:
+
+            {"operations": [{"name": "predict", "route": "/predict", "body": {...}}]}
+        """
+        with open(path) as fh:
+            raw = json.load(fh)
+        return cls(
+            [Operation(**op) for op in raw["operations"]],
+            cold_fraction=raw.get("cold_fraction", 0.5),
+            seed=raw.get("seed", 0),
+        )
+
+    @classmethod
+    def for_demo(
+        cls,
+        name: str,
+        mix: Optional[Dict[str, float]] = None,
+        attack_field: Optional[str] = None,
+        grad_field: Optional[str] = None,
+        cold_fraction: float = 0.5,
+        seed: int = 0,
+    ) -> "Workload":
+        """
+        Returns a workload made of the `warmup_inputs` of the demo with the given name (see
+        `allennlp_demo.common.host.demo_inputs()`). They're sent to `/predict`, to each of the
+        model's interpreters and, if `attack_field` is given, to each of its attackers.
+
+        `mix` sets the weight of the `predict`, `interpret` and `attack` operations, which is
+        shared by all of the interpreters (or attackers). By default there are 8 predictions for
+        every interpretation and attack.
+        """
+        from allennlp_demo.common.host import demo_inputs
+
+        weights = {"predict": 8.0, "interpret": 1.0, "attack": 1.0, **(mix or {})}
+        model, inputs = demo_inputs(name)
+        attack_body: Dict[str, Any] = {"input_field_to_attack": attack_field}
+        if grad_field is not None:
+            attack_body["grad_input_field"] = grad_field
+
+        operations: List[Operation] = []
+
+        def add(kind: str, route: str, bodies: List[Any], count: int) -> None:
+            if weights.get(kind, 0) <= 0 or count == 0:
+                return
+            for body in bodies:
+                operations.append(
+                    Operation(route.lstrip("/"), route, body, weights[kind] / count / len(bodies))
+                )
+
+        add("predict", "/predict", inputs, 1)
+        for interpreter in model.interpreters:
+            add("interpret", f"/interpret/{interpreter}", inputs, len(model.interpreters))
+        if attack_field is not None:
+            attacks = [{"inputs": i, **attack_body} for i in inputs]
+            for attacker in model.attackers:
+                add("attack", f"/attack/{attacker}", attacks, len(model.attackers))
+        return cls(operations, cold_fraction=cold_fraction, seed=seed)
@@ -0,0 +1,75 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+
+class Budget:
+    """
+    Limits how much work an attack or interpretation may do, by a deadline (in milliseconds from
+    when the budget is created) and/or a maximum number of passes through the model.
+
+    The attackers and interpreters in `allennlp_demo.common` check the budget that's active in
+    the current context (see `Budget.activate()` and `current_budget()`) between passes, and stop
+    early if it's exhausted. They return what they have so far and mark the budget as
+    `truncated`.
+    """
+
+    def __init__(self, deadline_ms: Optional[float] = None, max_passes: Optional[int] = None):
+        self.deadline_ms = deadline_ms
+        self.max_passes = max_passes
+        self.deadline = None if deadline_ms is None else time.monotonic() + deadline_ms / 1000
+        self.passes = 0
+        self.truncated = False
+        self.cancelled = False
+
+    def spend(self, passes: int = 1) -> None:
+        """
+        Records passes through the model.
+        """
+        self.passes += passes
+
+    def cancel(self) -> None:
+        """
+        Exhausts the budget, i.e. because nobody is waiting for the results anymore.
+        """
+        self.cancelled = True
+
+    def exhausted(self) -> bool:
+        if self.cancelled:
+            return True
+        if self.max_passes is not None and self.passes >= self.max_passes:
+            return True
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def stop(self) -> bool:
+        """
+        Returns whether the work should stop because the budget is exhausted, in which case the
+        results are marked as truncated.
+        """
+        if self.exhausted():
+            self.truncated = True
+            return True
+        return False
+
+    @contextmanager
+    def activate(self) -> Iterator["Budget"]:
+        """
+        Makes this the budget that's returned by `current_budget()` within the context.
+        """
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+
+_current: ContextVar[Optional[Budget]] = ContextVar("budget", default=None)
+
+
+def current_budget() -> Budget:
+    """
+    Returns the active budget, or an unlimited one if there isn't one.
+    """
+    budget = _current.get()
+    return budget if budget is not None else Budget()
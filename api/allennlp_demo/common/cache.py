@@ -0,0 +1,644 @@
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlparse, unquote
+
+from allennlp_demo.common.serialization import Serialized, dumps_json, loads_json
+
+
+logger = logging.getLogger(__name__)
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+class CacheBackend:
+    """
+    Stores serialized results by key. Each backend instance manages its own namespace, so that
+    several caches can share the same underlying storage without their entries clashing.
+
+    Backends should never raise when the underlying storage is unavailable. Instead they should
+    log the problem and behave as if the entry wasn't cached.
+    """
+
+    def __init__(self, namespace: str, maxsize: int):
+        self.namespace = namespace
+        self.maxsize = maxsize
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, cost: float = 0.0) -> None:
+        """
+        Stores the value. The `cost` is how long it took to compute it, in milliseconds, which
+        backends can use to decide what's worth keeping.
+        """
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        """
+        Removes all entries in this backend's namespace.
+        """
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        """
+        Returns the number of entries. This is reported with every scrape of `/metrics`, so it
+        must be cheap and mustn't raise, even when the storage is unavailable.
+        """
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns counters that describe the state of the backend, like the number of entries that
+        were evicted, if it keeps track of them.
+        """
+        return {}
+
+
+class FrequencySketch:
+    """
+    A count-min sketch that estimates how often each key was accessed recently, using a small,
+    fixed amount of memory. Counts are halved every `sample_size` increments, so that keys that
+    were popular a long time ago are eventually forgotten.
+    """
+
+    def __init__(self, width: int, depth: int = 4, sample_size: Optional[int] = None):
+        self.width = width
+        self.depth = depth
+        self.sample_size = sample_size if sample_size is not None else 10 * width
+        self._rows = [[0] * width for _ in range(depth)]
+        self._increments = 0
+
+    def _indices(self, key: str) -> List[int]:
+        return [hash((seed, key)) % self.width for seed in range(self.depth)]
+
+    def increment(self, key: str) -> None:
+        for row, idx in zip(self._rows, self._indices(key)):
+            row[idx] += 1
+        self._increments += 1
+        if self._increments >= self.sample_size:
+            self._rows = [[count // 2 for count in row] for row in self._rows]
+            self._increments //= 2
+
+    def estimate(self, key: str) -> int:
+        return min(row[idx] for row, idx in zip(self._rows, self._indices(key)))
+
+
+class _Entry(NamedTuple):
+    value: bytes
+    cost: float
+
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    Keeps results in the memory of the current process. The cache holds at most `maxsize`
+    entries and, if `max_bytes` is set, at most that many bytes of values.
+
+    When the cache is full the least recently used entries are evicted to make room, but only
+    if the new entry is worth more than those it would replace. An entry's worth is the number of
+    times its key was recently looked up (estimated with a `FrequencySketch`, as in TinyLFU)
+    times how long it took to compute, in milliseconds. This stops a stream of cheap, one-off
+    results from pushing out expensive ones that are requested again. When all entries cost
+    about the same and are used about as often, this behaves like an LRU cache.
+    """
+
+    def __init__(self, namespace: str, maxsize: int, max_bytes: Optional[int] = None):
+        super().__init__(namespace, maxsize)
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.evictions = 0
+        self.rejections = 0
+        """
+        The number of values that weren't cached because they weren't worth the space.
+        """
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._sketch = FrequencySketch(width=max(1024, 1 << (4 * maxsize - 1).bit_length()))
+        self._lock = threading.Lock()
+
+    def _is_full(self, num_entries: int, nbytes: int) -> bool:
+        if num_entries > self.maxsize:
+            return True
+        return self.max_bytes is not None and nbytes > self.max_bytes
+
+    def _worth(self, key: str, cost: float) -> float:
+        # Everything costs at least a millisecond, so that frequency matters for
+        # results that take no time at all.
+        return self._sketch.estimate(key) * max(cost, 1.0)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            self._sketch.increment(key)
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry.value
+
+    def set(self, key: str, value: bytes, cost: float = 0.0) -> None:
+        with self._lock:
+            # The entry this replaces, if any, is only removed once the new one is admitted.
+            old = self._entries.get(key)
+
+            if self.max_bytes is not None and len(value) > self.max_bytes:
+                self.rejections += 1
+                return
+
+            # Find the least recently used entries that would have to go to make room.
+            victims: List[str] = []
+            num_entries = len(self._entries) + (1 if old is None else 0)
+            nbytes = self.nbytes + len(value) - (len(old.value) if old is not None else 0)
+            for victim, victim_entry in self._entries.items():
+                if not self._is_full(num_entries, nbytes):
+                    break
+                if victim == key:
+                    continue
+                victims.append(victim)
+                num_entries -= 1
+                nbytes -= len(victim_entry.value)
+            if self._is_full(num_entries, nbytes):
+                # There's no room even with everything else evicted, i.e. if `maxsize` is 0.
+                self.rejections += 1
+                return
+
+            if victims:
+                victims_worth = sum(self._worth(v, self._entries[v].cost) for v in victims)
+                if self._worth(key, cost) < victims_worth:
+                    self.rejections += 1
+                    return
+                for victim in victims:
+                    self.nbytes -= len(self._entries.pop(victim).value)
+                    self.evictions += 1
+
+            if old is not None:
+                self.nbytes -= len(self._entries.pop(key).value)
+            self._entries[key] = _Entry(value, cost)
+            self.nbytes += len(value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        return {"bytes": self.nbytes, "evictions": self.evictions, "rejections": self.rejections}
+
+
+class CompressedCacheBackend(CacheBackend):
+    """
+    Wraps another backend, compressing values of at least `min_bytes` bytes before they're
+    stored. The `codec` is either `"zlib"` or `"zstd"`, the latter of which requires the
+    `zstandard` package.
+
+    Compressed values are recognized by the magic bytes that start zlib and zstd streams, which
+    can't start a JSON document. This means uncompressed entries written before compression was
+    turned on can still be read.
+    """
+
+    _ZLIB_MAGIC = b"\x78"
+    _ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+    def __init__(self, inner: CacheBackend, codec: str = "zlib", min_bytes: int = 16384):
+        super().__init__(inner.namespace, inner.maxsize)
+        if codec not in ("zlib", "zstd"):
+            raise ValueError(f"Unsupported compression codec '{codec}'")
+        self.inner = inner
+        self.codec = codec
+        self.min_bytes = min_bytes
+        self._zstd: Any = None
+        if codec == "zstd":
+            self._load_zstd()
+
+    def _load_zstd(self) -> Any:
+        if self._zstd is None:
+            import zstandard
+
+            self._zstd = zstandard
+        return self._zstd
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self.inner.get(key)
+        if value is None:
+            return None
+        if value.startswith(self._ZSTD_MAGIC):
+            return self._load_zstd().ZstdDecompressor().decompress(value)
+        if value.startswith(self._ZLIB_MAGIC):
+            return zlib.decompress(value)
+        return value
+
+    def set(self, key: str, value: bytes, cost: float = 0.0) -> None:
+        if len(value) >= self.min_bytes:
+            if self.codec == "zstd":
+                value = self._load_zstd().ZstdCompressor().compress(value)
+            else:
+                # The lowest compression level is a lot faster, and good enough for JSON.
+                value = zlib.compress(value, 1)
+        self.inner.set(key, value, cost)
+
+    def clear(self) -> None:
+        self.inner.clear()
+
+    def __len__(self) -> int:
+        return len(self.inner)
+
+    def stats(self) -> Dict[str, int]:
+        return self.inner.stats()
+
+
+class SqliteCacheBackend(CacheBackend):
+    """
+    Stores entries in a local SQLite database, so that they survive restarts and are shared
+    by every process on the same machine (or pod) that uses the same file. When a namespace
+    holds more than `maxsize` entries the least recently used ones are deleted.
+    """
+
+    def __init__(self, path: str, namespace: str, maxsize: int):
+        super().__init__(namespace, maxsize)
+        self.path = path
+        self._local = threading.local()
+        self._count = 0
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, "
+                "accessed REAL NOT NULL, PRIMARY KEY (namespace, key))"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS results_by_access ON results (namespace, accessed)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        # SQLite connections can't be shared between threads, or survive a fork.
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with self._connection() as conn:
+                row = conn.execute(
+                    "SELECT value FROM results WHERE namespace = ? AND key = ?",
+                    (self.namespace, key),
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute(
+                    "UPDATE results SET accessed = ? WHERE namespace = ? AND key = ?",
+                    (time.time(), self.namespace, key),
+                )
+                return row[0]
+        except sqlite3.Error as err:
+            logger.warning(f"Failed to read from the result cache at {self.path}: {err}")
+            return None
+
+    def set(self, key: str, value: bytes, cost: float = 0.0) -> None:
+        try:
+            with self._connection() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO results (namespace, key, value, accessed) "
+                    "VALUES (?, ?, ?, ?)",
+                    (self.namespace, key, value, time.time()),
+                )
+                conn.execute(
+                    "DELETE FROM results WHERE namespace = ? AND key IN ("
+                    "SELECT key FROM results WHERE namespace = ? "
+                    "ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.namespace, self.namespace, self.maxsize),
+                )
+        except sqlite3.Error as err:
+            logger.warning(f"Failed to write to the result cache at {self.path}: {err}")
+
+    def clear(self) -> None:
+        try:
+            with self._connection() as conn:
+                conn.execute("DELETE FROM results WHERE namespace = ?", (self.namespace,))
+        except sqlite3.Error as err:
+            logger.warning(f"Failed to clear the result cache at {self.path}: {err}")
+
+    def __len__(self) -> int:
+        try:
+            with self._connection() as conn:
+                (self._count,) = conn.execute(
+                    "SELECT COUNT(*) FROM results WHERE namespace = ?", (self.namespace,)
+                ).fetchone()
+        except sqlite3.Error as err:
+            # Report the last count rather than failing the scrape.
+            logger.warning(f"Failed to count the entries of the result cache at {self.path}: {err}")
+        return self._count
+
+
+class RedisError(RuntimeError):
+    pass
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Stores entries in a server that speaks the Redis protocol, so that they're shared by every
+    replica of an endpoint. Redis is expected to be configured with an eviction policy (like
+    `allkeys-lru`), which is what bounds the size of the cache. Entries also expire after
+    `ttl` seconds, if it's set.
+
+    Counting a namespace's entries means scanning every key on the server, so `len()` is the
+    number of entries this instance wrote since it was created or cleared instead. It doesn't
+    account for entries that expired or were evicted, or those written by other replicas.
+
+    This implements just enough of the protocol for our needs, which saves us a dependency.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        namespace: str,
+        maxsize: int,
+        db: int = 0,
+        password: Optional[str] = None,
+        ttl: Optional[int] = None,
+        timeout: float = 1.0,
+    ):
+        super().__init__(namespace, maxsize)
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.ttl = ttl
+        self.timeout = timeout
+        self._local = threading.local()
+        self._written = 0
+        self._written_lock = threading.Lock()
+
+    def _key(self, key: str) -> bytes:
+        return f"{self.namespace}:{key}".encode()
+
+    def _connect(self) -> None:
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._local.sock = sock
+        self._local.file = sock.makefile("rb")
+        self._local.pid = os.getpid()
+        if self.password is not None:
+            self._send("AUTH", self.password)
+        if self.db != 0:
+            self._send("SELECT", str(self.db))
+
+    def _send(self, *args: Any) -> Any:
+        parts = [a if isinstance(a, bytes) else str(a).encode() for a in args]
+        payload = b"*%d\r\n" % len(parts)
+        for p in parts:
+            payload += b"$%d\r\n%s\r\n" % (len(p), p)
+        self._local.sock.sendall(payload)
+        return self._read_reply()
+
+    def _read_reply(self) -> Any:
+        line = self._local.file.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection closed by the server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest
+        if kind == b"-":
+            raise RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            return None if length < 0 else self._local.file.read(length + 2)[:-2]
+        if kind == b"*":
+            length = int(rest)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+    def command(self, *args: Any) -> Any:
+        """
+        Sends a command to the server and returns the reply. Connections are per thread and
+        process, and are re-established if they break.
+        """
+        if getattr(self._local, "sock", None) is None or self._local.pid != os.getpid():
+            self._connect()
+        try:
+            return self._send(*args)
+        except (OSError, ConnectionError):
+            self._local.sock.close()
+            self._local.sock = None
+            raise
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self.command("GET", self._key(key))
+        except (OSError, RedisError) as err:
+            logger.warning(f"Failed to read from the result cache at {self.host}: {err}")
+            return None
+
+    def set(self, key: str, value: bytes, cost: float = 0.0) -> None:
+        try:
+            if self.ttl is not None:
+                self.command("SET", self._key(key), value, "EX", self.ttl)
+            else:
+                self.command("SET", self._key(key), value)
+        except (OSError, RedisError) as err:
+            logger.warning(f"Failed to write to the result cache at {self.host}: {err}")
+            return
+        with self._written_lock:
+            self._written += 1
+
+    def _scan(self) -> List[bytes]:
+        keys: List[bytes] = []
+        cursor = b"0"
+        while True:
+            cursor, batch = self.command("SCAN", cursor, "MATCH", self._key("*"), "COUNT", 1000)
+            keys.extend(batch)
+            if cursor == b"0":
+                return keys
+
+    def clear(self) -> None:
+        try:
+            keys = self._scan()
+            if keys:
+                self.command("DEL", *keys)
+        except (OSError, RedisError) as err:
+            logger.warning(f"Failed to clear the result cache at {self.host}: {err}")
+            return
+        with self._written_lock:
+            self._written = 0
+
+    def __len__(self) -> int:
+        return self._written
+
+
+DEFAULT_CACHE_URL = "memory://?max_bytes=67108864&compress=zlib"
+"""
+By default results are kept in memory, using at most 64 MiB per cache, and large results are
+compressed.
+"""
+
+
+def redact_url(url: Optional[str]) -> Optional[str]:
+    """
+    Returns the cache URL with the password, if it has one, replaced by `***`, so that it can be
+    shown to clients or logged.
+    """
+    if url is None:
+        return None
+    parsed = urlparse(url)
+    if parsed.password is None:
+        return url
+    netloc = parsed.netloc.rsplit("@", 1)[1]
+    user = f"{parsed.username}:" if parsed.username else ":"
+    return parsed._replace(netloc=f"{user}***@{netloc}").geturl()
+
+
+def backend_from_url(url: Optional[str], namespace: str, maxsize: int) -> CacheBackend:
+    """
+    Creates a cache backend from a URL. If no URL is given `DEFAULT_CACHE_URL` is used. The
+    supported forms are:
+
+    - `memory://[?max_bytes=N]`, which caches results in the memory of the current process,
+      optionally using no more than `max_bytes` bytes.
+    - `sqlite:///path/to/file.db`, which caches results in a local SQLite database.
+    - `redis://[:password@]host[:port][/db][?ttl=seconds]`, which caches results in Redis.
+
+    Any of them can add `compress=zlib` or `compress=zstd` to the query string to compress
+    values of at least `compress_min_bytes` bytes (16 KiB by default).
+    """
+    parsed = urlparse(url if url is not None else DEFAULT_CACHE_URL)
+    query = dict(p.split("=", 1) for p in parsed.query.split("&") if "=" in p)
+
+    backend: CacheBackend
+    if parsed.scheme == "memory":
+        max_bytes = int(query["max_bytes"]) if "max_bytes" in query else None
+        backend = MemoryCacheBackend(namespace, maxsize, max_bytes=max_bytes)
+    elif parsed.scheme == "sqlite":
+        path = parsed.netloc + parsed.path
+        if not path:
+            raise ValueError(f"No database path given in cache URL '{url}'")
+        backend = SqliteCacheBackend(path, namespace, maxsize)
+    elif parsed.scheme == "redis":
+        backend = RedisCacheBackend(
+            parsed.hostname or "localhost",
+            parsed.port or 6379,
+            namespace,
+            maxsize,
+            db=int(parsed.path.lstrip("/") or 0),
+            password=unquote(parsed.password) if parsed.password else None,
+            ttl=int(query["ttl"]) if "ttl" in query else None,
+        )
+    else:
+        raise ValueError(f"Unsupported cache URL '{url}'")
+
+    if "compress" in query:
+        min_bytes = int(query.get("compress_min_bytes", 16384))
+        backend = CompressedCacheBackend(backend, query["compress"], min_bytes)
+    return backend
+
+
+class ResultCache:
+    """
+    A thread-safe cache for the results of `fn`, which are stored as JSON in the given backend
+    (see `serialization.dumps_json()`).
+
+    Calling an instance works just like calling a function decorated with
+    `functools.lru_cache`, and `cache_info()` and `cache_clear()` behave the same way. Unlike
+    `lru_cache` it's also possible to look up results without computing them, via `peek()`, and
+    to add results that were computed elsewhere (for instance as part of a batch) via `put()`.
+
+    Arguments are converted to strings to build the key for each result, so they should have
+    a `__str__` implementation that uniquely identifies them. Results for which `cacheable`
+    returns `False` (i.e. partial ones) are returned but not stored.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[..., Any],
+        backend: Optional[CacheBackend] = None,
+        cacheable: Callable[[Any], bool] = lambda value: True,
+    ):
+        self.fn = fn
+        self.cacheable = cacheable
+        self.backend = backend if backend is not None else backend_from_url(None, "", 1024)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def key(args: Tuple[Hashable, ...]) -> str:
+        return ":".join(str(a) for a in args)
+
+    def __call__(self, *args: Hashable) -> Any:
+        return self.lookup(*args)[0]
+
+    def lookup(self, *args: Hashable) -> Tuple[Any, bool]:
+        """
+        Returns the result for the given arguments, computing and caching it if necessary, and
+        whether it came from the cache.
+        """
+        result, hit = self.lookup_serialized(*args)
+        return result.value, hit
+
+    def lookup_serialized(self, *args: Hashable) -> Tuple[Serialized, bool]:
+        """
+        Like `lookup()`, but returns the result along with its serialization. Cached results
+        aren't parsed unless their value is needed, and results that are computed are serialized
+        once, for both the cache and the response.
+        """
+        raw = self._get(args)
+        if raw is not None:
+            return Serialized(raw), True
+        start = time.perf_counter()
+        value = self.fn(*args)
+        result = Serialized.of(value)
+        if self.cacheable(value):
+            cost = (time.perf_counter() - start) * 1000
+            self.backend.set(self.key(args), result.raw, cost)
+        return result, False
+
+    def peek(self, *args: Hashable) -> Tuple[bool, Any]:
+        """
+        Returns a tuple of whether the result for the given arguments is cached and, if it is,
+        the cached result.
+        """
+        raw = self._get(args)
+        if raw is None:
+            return False, None
+        return True, loads_json(raw)
+
+    def _get(self, args: Tuple[Hashable, ...]) -> Optional[bytes]:
+        raw = self.backend.get(self.key(args))
+        with self._lock:
+            if raw is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        return raw
+
+    def put(self, args: Tuple[Hashable, ...], value: Any, cost: float = 0.0) -> None:
+        """
+        Stores the result of calling `fn` with the given arguments. The `cost` is how long it took
+        to compute the result, in milliseconds.
+        """
+        self.backend.set(self.key(args), dumps_json(value), cost)
+
+    def cache_info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(self._hits, self._misses, self.backend.maxsize, len(self.backend))
+
+    def cache_clear(self) -> None:
+        self.backend.clear()
+        with self._lock:
+            self._hits = 0
+            self._misses = 0
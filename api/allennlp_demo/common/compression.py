@@ -0,0 +1,153 @@
+import gzip
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from flask import Flask, Request, Response, g, request
+
+from allennlp_demo.common.cache import MemoryCacheBackend
+
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "application/msgpack", "image/svg+xml"}
+"""
+The types of responses that are compressed, along with any `text/*` type.
+"""
+
+_brotli: Any = None
+
+
+def _load_brotli() -> Any:
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli
+
+
+class Compressor:
+    """
+    Compresses response bodies of at least `min_bytes` bytes with gzip or, if the `brotli`
+    package is installed and the client accepts it, Brotli.
+
+    Compressing big results takes a while, so the compressed form of those that are cached is
+    cached too (see `cache_compressed()`), keyed by a digest of the body. At most `cache_bytes`
+    bytes of compressed bodies are kept in memory.
+    """
+
+    def __init__(
+        self,
+        min_bytes: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 5,
+        cache_bytes: int = 33554432,
+    ):
+        assert 1 <= gzip_level <= 9, "gzip_level must be between 1 and 9"
+        assert 0 <= brotli_quality <= 11, "brotli_quality must be between 0 and 11"
+        self.min_bytes = min_bytes
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.cache = MemoryCacheBackend("compressed", 1024, max_bytes=cache_bytes)
+        self._lock = threading.Lock()
+        self.responses: Dict[str, int] = {}
+        """
+        The number of responses that were compressed, by encoding.
+        """
+        self.saved_bytes = 0
+        """
+        How much smaller the compressed responses were than they would have been otherwise.
+        """
+
+    def encodings(self) -> List[str]:
+        return ["br", "gzip"] if _load_brotli() else ["gzip"]
+
+    def negotiate(self, req: Request) -> Optional[str]:
+        """
+        Returns the encoding the client prefers, or `None` if it doesn't accept any of those we
+        support.
+        """
+        return req.accept_encodings.best_match(self.encodings())
+
+    def compress(self, body: bytes, encoding: str, cache: bool = False) -> bytes:
+        key = f"{encoding}:{hashlib.blake2b(body, digest_size=16).hexdigest()}"
+        if cache:
+            compressed = self.cache.get(key)
+            if compressed is not None:
+                return compressed
+        start = time.perf_counter()
+        if encoding == "br":
+            compressed = _load_brotli().compress(body, quality=self.brotli_quality)
+        else:
+            # Without a timestamp the output is the same for the same body.
+            compressed = gzip.compress(body, self.gzip_level, mtime=0)
+        if cache:
+            self.cache.set(key, compressed, cost=(time.perf_counter() - start) * 1000)
+        return compressed
+
+    def compressible(self, resp: Response) -> bool:
+        if resp.is_streamed or resp.direct_passthrough or "Content-Encoding" in resp.headers:
+            return False
+        if resp.status_code < 200 or resp.status_code in (204, 304):
+            return False
+        if "no-transform" in resp.headers.get("Cache-Control", ""):
+            return False
+        mimetype = resp.mimetype or ""
+        if not (mimetype.startswith("text/") or mimetype in COMPRESSIBLE_MIMETYPES):
+            return False
+        return resp.content_length is None or resp.content_length >= self.min_bytes
+
+    def __call__(self, resp: Response) -> Response:
+        if not self.compressible(resp):
+            return resp
+        body = resp.get_data()
+        if len(body) < self.min_bytes:
+            return resp
+        resp.vary.add("Accept-Encoding")
+        encoding = self.negotiate(request)
+        if encoding is None:
+            return resp
+
+        compressed = self.compress(body, encoding, cache=g.get("cache_compressed", False))
+        resp.set_data(compressed)
+        resp.headers["Content-Encoding"] = encoding
+        # The compressed body is a different representation, so it can't share a strong ETag.
+        etag, weak = resp.get_etag()
+        if etag is not None and not weak:
+            resp.set_etag(etag, weak=True)
+        with self._lock:
+            self.responses[encoding] = self.responses.get(encoding, 0) + 1
+            self.saved_bytes += len(body) - len(compressed)
+        return resp
+
+
+def cache_compressed() -> None:
+    """
+    Marks the response to the current request as one that's likely to be sent again, like a
+    cached result, so that its compressed form is cached.
+    """
+    g.cache_compressed = True
+
+
+def configure_compression(app: Flask, compressor: Optional[Compressor] = None) -> Compressor:
+    """
+    Compresses the responses of the app, for clients that accept it. By default the compressor
+    is configured by the `COMPRESSION_MIN_BYTES`, `GZIP_LEVEL`, `BROTLI_QUALITY` and
+    `COMPRESSION_CACHE_BYTES` environment variables.
+
+    This should be called before the app's other `after_request` hooks are registered, so that
+    it runs after them, i.e. so that request logs have the uncompressed body.
+    """
+    if compressor is None:
+        compressor = Compressor(
+            min_bytes=int(os.getenv("COMPRESSION_MIN_BYTES", 1024)),
+            gzip_level=int(os.getenv("GZIP_LEVEL", 6)),
+            brotli_quality=int(os.getenv("BROTLI_QUALITY", 5)),
+            cache_bytes=int(os.getenv("COMPRESSION_CACHE_BYTES", 33554432)),
+        )
+    app.after_request(compressor)
+    return compressor
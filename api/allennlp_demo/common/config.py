@@ -1,12 +1,19 @@
+import hashlib
 import json
+import logging
+import os
 from dataclasses import dataclass, field
 from typing import Dict, Any, Optional, List
 
 from allennlp.predictors import Predictor
+from allennlp.version import VERSION
 
 
+logger = logging.getLogger(__name__)
+
 VALID_ATTACKERS = ["hotflip", "input_reduction"]
 VALID_INTERPRETERS = ["simple_gradient", "smooth_gradient", "integrated_gradient"]
+VALID_PRECISIONS = ["fp32", "int8-dynamic", "bf16"]
 
 
 @dataclass(frozen=True)
@@ -54,11 +61,150 @@ class Model:
     List of valid interpreters to use.
     """
 
+    interpreter_options: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    """
+    Options for each of the interpreters, keyed by the interpreter's id. The smooth gradient
+    interpreter accepts `num_samples` and `stdev`, and the integrated gradient interpreter accepts
+    `steps`. Both accept `max_batch_tokens`, which caps the number of tokens that are sent through
+    the model in a single batch. For example:
+
+        {"smooth_gradient": {"num_samples": 20}, "integrated_gradient": {"steps": 20}}
+    """
+
     use_old_load_method: bool = False
     """
     Some models that run on older versions need to be load differently.
     """
 
+    max_batch_size: int = 1
+    """
+    The maximum number of concurrent `/predict` requests that are grouped together and sent to
+    the predictor in a single call to `predict_batch_json`. Batching is disabled unless this is
+    greater than 1.
+    """
+
+    max_batch_wait_ms: float = 0
+    """
+    How long (in milliseconds) a `/predict` request may be held while waiting for other requests
+    to batch it with. This is only used when `max_batch_size` is greater than 1.
+    """
+
+    max_batch_items: int = 64
+    """
+    The maximum number of inputs a `/predict_batch` request may have. They're all sent through
+    the model at once, which keeps other requests waiting, so longer lists are rejected.
+    """
+
+    workers: int = 1
+    """
+    The number of worker processes that serve requests. When this is greater than 1 the model
+    is loaded once and then shared by workers that are forked from the main process. This can be
+    overridden with the `WORKERS` environment variable.
+    """
+
+    torch_threads: Optional[int] = None
+    """
+    The number of threads each worker uses for intra-op parallelism. By default the CPUs are
+    divided evenly between the workers. Overridden by the `TORCH_THREADS` environment variable.
+    """
+
+    torch_interop_threads: Optional[int] = None
+    """
+    The number of threads each worker uses for inter-op parallelism. By default torch decides.
+    Overridden by the `TORCH_INTEROP_THREADS` environment variable.
+    """
+
+    pin_workers: bool = False
+    """
+    Whether to pin each worker to its share of the CPUs, where the platform supports it.
+    Overridden by the `PIN_WORKERS` environment variable.
+    """
+
+    cache_url: Optional[str] = None
+    """
+    Where to cache results. By default they're kept in the memory of the process, with a budget
+    of 64 MiB per cache. See `allennlp_demo.common.cache.backend_from_url()` for the supported
+    values. This can be overridden with the `CACHE_URL` environment variable.
+    """
+
+    warmup_inputs: List[Dict[str, Any]] = field(default_factory=list)
+    """
+    Inputs that are sent through `/predict` once the model is loaded, before the endpoint reports
+    that it's ready. This moves the cost of lazy initialization and of the first, slow forward
+    passes out of the way of real requests.
+    """
+
+    snapshot_dir: Optional[str] = None
+    """
+    A directory of prepared snapshots of models, which load faster than their archives. If it
+    contains a snapshot of this version of the model, it's loaded instead of the archive. See
+    `allennlp_demo.common.snapshot`. This can be overridden with the `MODEL_SNAPSHOT_DIR`
+    environment variable.
+    """
+
+    deadline_ms: Optional[float] = 30000
+    """
+    How long (in milliseconds) an `/interpret` or `/attack` request may take. When it runs out the
+    interpreter or attacker stops, and the response has what was computed so far and is marked as
+    `truncated`. Requests may ask for a different deadline with the `deadline_ms` query string
+    argument. `None` means requests may take up to `max_deadline_ms`.
+    """
+
+    max_deadline_ms: float = 55000
+    """
+    The longest deadline a request may ask for. This should be less than the timeout of the
+    proxy in front of the endpoint, so that long requests get partial results rather than a 504.
+    """
+
+    max_passes: Optional[int] = None
+    """
+    The maximum number of passes through the model that an `/interpret` or `/attack` request may
+    make, after which it stops like it does when it runs out of time. Requests may ask for fewer
+    with the `max_passes` query string argument. `None` means there's no limit.
+    """
+
+    job_workers: int = 1
+    """
+    The number of threads that run the jobs submitted to `/jobs/...`, in each worker process.
+    """
+
+    max_queued_jobs: int = 32
+    """
+    The maximum number of jobs that may wait for a thread to run them. Further jobs are rejected
+    with a 503 until the queue drains.
+    """
+
+    job_ttl_s: float = 3600
+    """
+    How long (in seconds) the state and result of a job are kept after it's submitted or
+    finished.
+    """
+
+    job_deadline_ms: Optional[float] = 600000
+    """
+    Like `deadline_ms`, but for interpret and attack jobs, which aren't limited by the timeout of
+    the proxy in front of the endpoint. It's also the longest deadline a job may ask for. `None`
+    means jobs have no deadline.
+    """
+
+    share_weights: bool = False
+    """
+    Whether the model's parameters are shared with other models that are loaded in the same
+    process (i.e. by `allennlp_demo.common.host`) and have some of the same parameters, like
+    models that were fine-tuned from the same encoder without updating it. It can be enabled
+    for every model with the `SHARE_WEIGHTS` environment variable.
+    """
+
+    precision: str = "fp32"
+    """
+    The precision `/predict` runs the model at. `int8-dynamic` quantizes the weights of the
+    model's linear layers to 8 bit integers, and `bf16` does matrix multiplications in bfloat16,
+    both of which are a lot faster for transformers on CPUs, at the cost of slightly different
+    scores. The interpreters and attackers always use 32 bit floats. See
+    `allennlp_demo.common.precision`. This can be overridden with the `MODEL_PRECISION`
+    environment variable.
+    """
+
     @classmethod
     def from_file(cls, path: str) -> "Model":
         with open(path, "r") as fh:
@@ -76,12 +222,74 @@ class Model:
             assert attacker in VALID_ATTACKERS, f"invalid attacker {attacker}"
         for interpreter in out.interpreters:
             assert interpreter in VALID_INTERPRETERS, f"invalid interpreter {interpreter}"
+        for interpreter in out.interpreter_options:
+            assert interpreter in VALID_INTERPRETERS, f"invalid interpreter {interpreter}"
         if out.use_old_load_method:
             assert out.pretrained_model_id is None
+        assert out.max_batch_size >= 1, "max_batch_size must be at least 1"
+        assert out.max_batch_items >= 1, "max_batch_items must be at least 1"
+        assert out.max_batch_wait_ms >= 0, "max_batch_wait_ms can't be negative"
+        assert out.workers >= 1, "workers must be at least 1"
+        assert out.deadline_ms is None or out.deadline_ms > 0, "deadline_ms must be positive"
+        assert out.max_deadline_ms > 0, "max_deadline_ms must be positive"
+        assert out.max_passes is None or out.max_passes >= 1, "max_passes must be at least 1"
+        assert out.job_workers >= 1, "job_workers must be at least 1"
+        assert out.max_queued_jobs >= 1, "max_queued_jobs must be at least 1"
+        assert out.job_ttl_s > 0, "job_ttl_s must be positive"
+        assert (
+            out.job_deadline_ms is None or out.job_deadline_ms > 0
+        ), "job_deadline_ms must be positive"
+        assert out.precision in VALID_PRECISIONS, f"invalid precision {out.precision}"
 
         return out
 
+    def fingerprint(self) -> str:
+        """
+        Returns a hash that identifies the model and everything that affects its output: the
+        archive, the options used to load it and the version of AllenNLP. Results cached with one
+        fingerprint are never served for another.
+        """
+        archive: Dict[str, Any] = {"path": self.archive_file}
+        if self.archive_file is not None and os.path.isfile(self.archive_file):
+            # Hashing the contents of large archives would slow down startup, so we rely on
+            # the size and modification time to detect a local archive being replaced.
+            stat = os.stat(self.archive_file)
+            archive.update(size=stat.st_size, mtime=stat.st_mtime)
+        identity = {
+            "id": self.id,
+            "archive": archive,
+            "pretrained_model_id": self.pretrained_model_id,
+            "predictor_name": self.predictor_name,
+            "overrides": self.overrides,
+            "use_old_load_method": self.use_old_load_method,
+            "allennlp": VERSION,
+        }
+        return hashlib.sha256(json.dumps(identity, sort_keys=True).encode()).hexdigest()[:16]
+
+    def shares_weights(self) -> bool:
+        return self.share_weights or os.getenv("SHARE_WEIGHTS", "").lower() in ("1", "true", "yes")
+
+    def inference_precision(self) -> str:
+        precision = os.getenv("MODEL_PRECISION", self.precision)
+        assert precision in VALID_PRECISIONS, f"invalid precision {precision}"
+        return precision
+
     def load_predictor(self) -> Predictor:
+        predictor = self._load_predictor()
+        if self.shares_weights():
+            from allennlp_demo.common import weights
+
+            saved = weights.pool.deduplicate(predictor._model)
+            logger.info(f"{self.id} shares {saved / 2**20:.1f} MiB of parameters with other models")
+        return predictor
+
+    def _load_predictor(self) -> Predictor:
+        from allennlp_demo.common import snapshot
+
+        snapshot_path = snapshot.find_snapshot(self)
+        if snapshot_path is not None:
+            return snapshot.load_predictor(snapshot_path, self.predictor_name)
+
         if self.pretrained_model_id is not None:
             from allennlp_models.pretrained import load_predictor
 
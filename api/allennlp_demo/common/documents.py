@@ -0,0 +1,29 @@
+import hashlib
+from typing import Any
+
+from flask import Response, request
+
+from allennlp_demo.common import compression
+from allennlp_demo.common.serialization import JSON, dumps_json
+
+
+class Document:
+    """
+    A JSON document that doesn't change while the process runs, like the list of model cards.
+    It's serialized once, and served with an `ETag` so that clients that already have it get an
+    empty `304` response instead.
+    """
+
+    def __init__(self, value: Any, max_age: int = 300):
+        self.raw = dumps_json(value)
+        self.etag = hashlib.blake2b(self.raw, digest_size=16).hexdigest()
+        self.max_age = max_age
+
+    def response(self) -> Response:
+        resp = Response(self.raw, mimetype=JSON)
+        resp.set_etag(self.etag)
+        resp.cache_control.public = True
+        resp.cache_control.max_age = self.max_age
+        # The same body is sent over and over, so compress it once.
+        compression.cache_compressed()
+        return resp.make_conditional(request)
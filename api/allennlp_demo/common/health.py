@@ -0,0 +1,33 @@
+from typing import Callable
+
+from flask import Flask, jsonify
+
+
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+UNLOADED = "unloaded"
+"""
+The state of endpoints that load their model on demand, while it isn't loaded.
+"""
+
+
+def configure_health_checks(app: Flask, status: Callable[[], str] = lambda: READY) -> None:
+    """
+    Adds the routes Kubernetes uses to decide whether to send traffic to a container (`/ready`)
+    and whether to restart it (`/live`).
+
+    The `status` function should return `LOADING` while the app is starting, `READY` once it
+    can handle requests and `FAILED` if it'll never be able to, in which case restarting the
+    container is the best bet.
+    """
+
+    @app.route("/ready")
+    def ready():
+        s = status()
+        return jsonify({"status": s}), 200 if s == READY else 503
+
+    @app.route("/live")
+    def live():
+        s = status()
+        return jsonify({"status": s}), 500 if s == FAILED else 200
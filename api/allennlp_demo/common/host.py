@@ -0,0 +1,211 @@
+"""
+Serves several model endpoints from a single process, which is a lot cheaper than running a
+container for each of the demos that get little traffic. Models are loaded when they're first
+needed, and those that were used least recently are unloaded to stay within a memory budget.
+
+To serve the `bidaf` and `coref` demos on port 8000, using at most 4 GiB for their weights, run:
+
+    python -m allennlp_demo.common.host bidaf coref --memory-budget-mb 4096
+
+Each endpoint is served under its model's id, i.e. `/bidaf/predict`.
+"""
+import argparse
+import copy
+import importlib
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Type
+
+from flask import Flask, jsonify
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+from werkzeug.serving import run_simple
+from allennlp.predictors.predictor import JsonDict
+
+from allennlp_demo.common import config, health, weights
+from allennlp_demo.common.http import ModelEndpoint, lazy_loading
+from allennlp_demo.common.logs import configure_logging
+from allennlp_demo.common.metrics import configure_metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class ModelHost:
+    """
+    Mounts each of the `endpoints` under a path prefix of its model's id, and keeps the total
+    size of the loaded models' parameters and buffers under `memory_budget` bytes, if it's set.
+
+    The endpoints should be created in a `lazy_loading()` block, so that they don't load their
+    models until a request needs them. Whenever a model starts loading, and again once it's
+    loaded and its size is known, the least recently used models that aren't in use are unloaded
+    until the rest fit in the budget. The size of a model that's loading is assumed to be what it
+    was the last time it was loaded, if it was.
+
+    `GET /models` reports the state of each model, and which are loaded.
+    """
+
+    def __init__(self, endpoints: List[ModelEndpoint], memory_budget: Optional[int] = None):
+        self.endpoints: Dict[str, ModelEndpoint] = {e.model.id: e for e in endpoints}
+        self.memory_budget = memory_budget
+        self.unloads = 0
+        # Endpoints are unloaded by the thread that loads another one, or by a request thread that
+        # starts loading it, so this makes sure only one of them picks which to unload at a time.
+        self._lock = threading.RLock()
+        for endpoint in endpoints:
+            endpoint.load_listeners.append(self.fit_memory_budget)
+
+        self.app = Flask("model-host")
+        configure_logging(self.app)
+        self.configure_metrics()
+        health.configure_health_checks(self.app)
+
+        @self.app.route("/models")
+        def models():
+            return jsonify(
+                {
+                    "memory_budget": self.memory_budget,
+                    "resident_bytes": self.resident_bytes(),
+                    "deduplicated_bytes": weights.pool.deduplicated_bytes,
+                    "models": {
+                        id: {
+                            "status": e.status(),
+                            "bytes": e.model_bytes,
+                            "users": e.users,
+                            "last_used": e.last_used,
+                        }
+                        for id, e in self.endpoints.items()
+                    },
+                }
+            )
+
+        self.wsgi_app = DispatcherMiddleware(
+            self.app, {f"/{id}": e.app for id, e in self.endpoints.items()}
+        )
+
+    def resident(self) -> List[ModelEndpoint]:
+        """
+        Returns the endpoints whose models are loaded.
+        """
+        return [e for e in self.endpoints.values() if e.status() == health.READY]
+
+    def resident_bytes(self) -> int:
+        return sum(e.model_bytes for e in self.resident())
+
+    def fit_memory_budget(self, endpoint: ModelEndpoint) -> None:
+        """
+        Unloads the least recently used models, other than that of the given endpoint, until
+        the loaded models and the one the endpoint is loading fit in the memory budget.
+        """
+        if self.memory_budget is None or endpoint.status() not in (health.LOADING, health.READY):
+            return
+        with self._lock:
+            others = [e for e in self.resident() if e is not endpoint]
+            used = endpoint.model_bytes + sum(e.model_bytes for e in others)
+            for victim in sorted(others, key=lambda e: e.last_used):
+                if used <= self.memory_budget:
+                    break
+                if victim.unload():
+                    used -= victim.model_bytes
+                    self.unloads += 1
+            if used > self.memory_budget:
+                logger.warning(
+                    f"The loaded models use {used} bytes, more than the budget of "
+                    f"{self.memory_budget}, because the others are in use"
+                )
+
+    def configure_metrics(self) -> None:
+        self.metrics = configure_metrics(self.app)
+        self.metrics.gauge(
+            "allennlp_demo_host_models",
+            "The number of hosted models, by status.",
+            ["status"],
+            lambda: {
+                (s,): sum(1 for e in self.endpoints.values() if e.status() == s)
+                for s in (health.UNLOADED, health.LOADING, health.READY, health.FAILED)
+            },
+        )
+        self.metrics.gauge(
+            "allennlp_demo_host_model_bytes",
+            "The size of the parameters and buffers of each loaded model, in bytes.",
+            ["model"],
+            lambda: {(e.model.id,): e.model_bytes for e in self.resident()},
+        )
+        self.metrics.counter(
+            "allennlp_demo_host_deduplicated_bytes_total",
+            "Bytes of parameters that models share with others that were already loaded.",
+            callback=lambda: {(): weights.pool.deduplicated_bytes},
+        )
+        self.metrics.counter(
+            "allennlp_demo_host_unloads_total",
+            "Models that were unloaded to make room for others.",
+            callback=lambda: {(): self.unloads},
+        )
+
+    def run(self, port: int = 8000) -> None:
+        # Requests are handled in separate threads, like those of a single endpoint. The models
+        # aren't shared by forked workers, as each worker would load them again.
+        run_simple("0.0.0.0", port, self.wsgi_app, threaded=True)
+
+
+def endpoint_class(name: str) -> Type[ModelEndpoint]:
+    """
+    Returns the `ModelEndpoint` subclass defined by the demo with the given name, i.e. `bidaf`.
+    """
+    module = importlib.import_module(f"allennlp_demo.{name}.api")
+    for value in vars(module).values():
+        if (
+            isinstance(value, type)
+            and issubclass(value, ModelEndpoint)
+            and value.__module__ == module.__name__
+        ):
+            return value
+    raise ValueError(f"allennlp_demo.{name}.api doesn't define a ModelEndpoint")
+
+
+def demo_inputs(name: str) -> Tuple[config.Model, List[JsonDict]]:
+    """
+    Returns the model of the demo with the given name, i.e. `bidaf`, and its `warmup_inputs`,
+    normalized like the inputs of a request.
+    """
+    # The inputs are read without loading the model.
+    with lazy_loading():
+        endpoint = endpoint_class(name)()
+    if not endpoint.model.warmup_inputs:
+        raise ValueError(f"The model.json of {name} doesn't define any warmup_inputs")
+    return endpoint.model, [
+        endpoint.normalize_inputs(copy.deepcopy(i)) for i in endpoint.model.warmup_inputs
+    ]
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Serves several models from one process.")
+    parser.add_argument("demos", nargs="+", help="the names of the demos to serve, i.e. bidaf")
+    parser.add_argument(
+        "--memory-budget-mb",
+        type=int,
+        default=int(os.getenv("MEMORY_BUDGET_MB", 0)) or None,
+        help="the most memory the models' weights may use, in MiB (by default there's no limit)",
+    )
+    parser.add_argument(
+        "--load-wait-s",
+        type=float,
+        default=30.0,
+        help="how long a request waits for the model it needs to load, before getting a 503",
+    )
+    parser.add_argument("--port", type=int, default=8000)
+    parsed = parser.parse_args(args)
+
+    classes = [endpoint_class(name) for name in parsed.demos]
+    start = time.perf_counter()
+    with lazy_loading(parsed.load_wait_s):
+        endpoints = [cls() for cls in classes]  # type: ignore
+    logger.info(f"Created {len(endpoints)} endpoints in {time.perf_counter() - start:.1f}s")
+
+    budget = parsed.memory_budget_mb * 1024 * 1024 if parsed.memory_budget_mb else None
+    ModelHost(endpoints, budget).run(parsed.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,50 @@
-from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+import copy
 from dataclasses import asdict
+import gc
 import json
-from typing import Callable, Dict
+import logging
+import itertools
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
-from flask import Flask, Request, Response, after_this_request, request, jsonify
+from flask import Flask, Request, Response, after_this_request, g, request, jsonify
 from allennlp.version import VERSION
-from allennlp.predictors.predictor import JsonDict
-from allennlp.interpret.saliency_interpreters import (
-    SaliencyInterpreter,
-    SimpleGradient,
-    SmoothGradient,
-    IntegratedGradient,
-)
-from allennlp.interpret.attackers import Attacker, Hotflip, InputReduction
+from allennlp.predictors.predictor import JsonDict, Predictor
+from allennlp.interpret.saliency_interpreters import SaliencyInterpreter, SimpleGradient
+from allennlp.interpret.attackers import Attacker
 
-from allennlp_demo.common import config
+from allennlp_demo.common import (
+    compression,
+    config,
+    health,
+    precision,
+    progress,
+    serialization,
+    snapshot,
+    timing,
+    weights,
+)
+from allennlp_demo.common.attackers import BudgetedInputReduction, LazyHotflip
+from allennlp_demo.common.batching import MicroBatcher
+from allennlp_demo.common.budget import Budget, current_budget
+from allennlp_demo.common.interpreters import BatchedIntegratedGradient, BatchedSmoothGradient
+from allennlp_demo.common.jobs import JobQueue, JobQueueFullError, backend_for_jobs
+from allennlp_demo.common.cache import ResultCache, backend_from_url, redact_url
 from allennlp_demo.common.logs import configure_logging
+from allennlp_demo.common.metrics import Counter, Gauge, configure_metrics
+from allennlp_demo.common.normalization import CacheKey
+from allennlp_demo.common.server import ServerOptions, limit_threads_before_fork, serve_prefork
+from allennlp_demo.common.singleflight import SingleFlight
+from allennlp_demo.common.timing import span
+
+
+logger = logging.getLogger(__name__)
 
 
 def no_cache(request: Request) -> bool:
@@ -27,26 +56,116 @@ def no_cache(request: Request) -> bool:
     return "no_cache" in request.args
 
 
-def with_cache_hit_response_headers(fn: Callable, *args):
+def custom_budget(request: Request) -> bool:
+    """
+    Returns True if the provided request asks for a budget other than the model's default, in
+    which case it shouldn't share the results of identical requests that are in progress.
+    """
+    return "deadline_ms" in request.args or "max_passes" in request.args
+
+
+def server_sent_events(request: Request) -> bool:
+    """
+    Returns True if the provided request asks for a stream of Server-Sent Events, rather than
+    newline-delimited JSON.
+    """
+    return (
+        request.args.get("format") == "sse" or request.accept_mimetypes.best == "text/event-stream"
+    )
+
+
+def stream_events(events: Iterator[JsonDict], sse: bool = False) -> Response:
+    """
+    Returns a response that sends each of the events as soon as it's produced, either as a line
+    of JSON or, if `sse` is True, as a Server-Sent Event named after the event's `event` field.
+    """
+
+    def encode() -> Iterator[str]:
+        for event in events:
+            if sse:
+                yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+            else:
+                yield json.dumps(event) + "\n"
+
+    resp = Response(encode(), mimetype="text/event-stream" if sse else "application/x-ndjson")
+    resp.headers["Cache-Control"] = "no-cache"
+    # Tell NGINX not to buffer the response, so that each event reaches the client right away.
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+
+def parse_json_body(request: Request) -> Any:
+    """
+    Parses the body of the provided request as JSON, regardless of its content type. The result
+    is stored on the request, so that the body is only ever parsed once.
+
+    A `json.JSONDecodeError` is raised if the body isn't valid JSON.
+    """
+    if "parsed_json" not in request.environ:
+        request.environ["parsed_json"] = json.loads(request.get_data())
+    return request.environ["parsed_json"]
+
+
+def add_cache_hit_header() -> None:
+    """
+    Marks the response to the current request as having been served from a cache.
+    """
+
+    @after_this_request
+    def add_header(resp: Response) -> Response:
+        resp.headers["X-Cache-Hit"] = "1"
+        return resp
+
+
+def add_coalesced_header() -> None:
+    """
+    Marks the response to the current request as having been produced by an identical request
+    that was already in progress.
     """
-    Calls the provided function with the given arguments and returns the results. If the results
-    are produced by a cache a HTTP header is added to the response.
 
-    The provided function must be memoized using the functools.lru_cache decorator.
+    @after_this_request
+    def add_header(resp: Response) -> Response:
+        resp.headers["X-Coalesced"] = "1"
+        return resp
+
+
+def respond(value: Any) -> Response:
+    """
+    Returns a response with the given value, as JSON or, if the client prefers it, MessagePack
+    (see `serialization.negotiate()`). Results that are already serialized, like those read from
+    a cache, are returned as-is. Serializing the value is timed as the `serialize` span.
     """
-    # This allows us to determine if the response we're serving was cached. It's safe to
-    # do because we use a single-threaded server.
-    pre_hits = fn.cache_info().hits  # type: ignore
-    r = fn(*args)
+    with span("serialize"):
+        resp = serialization.serialize(value, serialization.negotiate(request))
+    resp.vary.add("Accept")
+    return resp
+
 
-    # If it was a cache hit add a HTTP header to the response
-    if fn.cache_info().hits - pre_hits == 1:  # type: ignore
+def with_cache_hit_response_headers(
+    cache: ResultCache, *args, inflight: Optional[SingleFlight] = None
+):
+    """
+    Calls the provided cache with the given arguments and returns the results, as a
+    `serialization.Serialized`. If the results are produced by the cache a HTTP header is added
+    to the response.
 
-        @after_this_request
-        def add_header(resp: Response) -> Response:
-            resp.headers["X-Cache-Hit"] = "1"
-            return resp
+    The cache reports whether each lookup was a hit, which means this is correct even when
+    requests are handled concurrently.
 
+    If `inflight` is provided, concurrent calls with the same arguments wait for the first one
+    to finish and share its results, rather than each of them missing the cache and computing
+    the results again. Those responses get a HTTP header too.
+    """
+    if inflight is None:
+        r, hit = cache.lookup_serialized(*args)
+    else:
+        (r, hit), coalesced = inflight.do((cache, *args), lambda: cache.lookup_serialized(*args))
+        if coalesced:
+            add_coalesced_header()
+    if hit:
+        add_cache_hit_header()
+    # Cached results are likely to be sent again, so their compressed form is cached too.
+    compression.cache_compressed()
     return r
 
 
@@ -54,6 +173,10 @@ class NotFoundError(RuntimeError):
     pass
 
 
+class InvalidInputError(ValueError):
+    pass
+
+
 class UnknownInterpreterError(NotFoundError):
     def __init__(self, interpreter_id: str):
         super().__init__(f"No interpreter with id '{interpreter_id}'")
@@ -74,6 +197,23 @@ class InvalidAttackerError(NotFoundError):
         super().__init__(f"Attacker with id '{attacker_id}' is not supported for this model")
 
 
+_lazy_load_wait_s: ContextVar[Optional[float]] = ContextVar("lazy_load_wait_s", default=None)
+
+
+@contextmanager
+def lazy_loading(wait_s: float = 30.0) -> Iterator[None]:
+    """
+    Endpoints that are created in the block don't load their model until a request needs it.
+    That request waits up to `wait_s` seconds for the model to load, after which it gets a 503,
+    like requests that arrive while any other endpoint is loading.
+    """
+    token = _lazy_load_wait_s.set(wait_s)
+    try:
+        yield
+    finally:
+        _lazy_load_wait_s.reset(token)
+
+
 class ModelEndpoint:
     """
     Class capturing a single model endpoint which provides a HTTP API suitable for use by
@@ -85,47 +225,297 @@ class ModelEndpoint:
     def __init__(self, model: config.Model, log_payloads: bool = False):
         self.model = model
         self.app = Flask(model.id)
+        # Responses are compressed by the last hook that runs, which is the first one registered.
+        self.configure_compression()
         self.configure_logging(log_payloads)
-        self.predictor = model.load_predictor()
-        self.interpreters = self.load_interpreters()
-        self.attackers = self.load_attackers()
+
+        # The interpreters and attackers temporarily register hooks on the model and toggle
+        # whether its parameters require gradients. This lock makes sure that work doesn't
+        # interleave with predictions made by other request threads.
+        self.model_lock = threading.RLock()
+
+        # Loading a model can take minutes, so it happens in a background thread. In the meantime
+        # the server reports that it isn't ready and turns away requests that need the model.
+        self.predictor: Optional[Predictor] = None
+        self.inference_predictor: Optional[Predictor] = None
+        """
+        The predictor `/predict` uses, which runs the model at the model's `precision`. The
+        interpreters and attackers use `predictor`, which is always 32 bit.
+        """
+        self.batcher: Optional[MicroBatcher] = None
+        self.interpreters: Dict[str, SaliencyInterpreter] = {}
+        self.attackers: Dict[str, Attacker] = {}
+        self.ready = threading.Event()
+        self.loading = False
+        self._loader: Optional[threading.Thread] = None
+        self.load_error: Optional[BaseException] = None
+        self.load_seconds: Optional[float] = None
+        self.lazy_load_wait_s = _lazy_load_wait_s.get()
+        self.load_listeners: List[Callable[["ModelEndpoint"], None]] = []
+        """
+        Functions that are called when the model starts loading, and once it's loaded, before
+        it's used.
+        """
+
+        # Requests, jobs and streams that use the model count as users, and the model isn't
+        # unloaded while it has any.
+        self._usage_lock = threading.Lock()
+        self.users = 0
+        self.last_used = time.time()
+        self.model_bytes = 0
+        """
+        The size of the model's state, as of when it was last loaded.
+        """
+
         self.configure_error_handling()
+        self.configure_metrics()
+        timing.configure_server_timing(self.app)
+        self.configure_health_checks()
 
-        # By creating the LRU caches when the class is instantiated, we can
-        # be sure that the caches are specific to the instance, and not the class,
-        # i.e. every instance will have its own set of caches.
+        # By creating the caches when the class is instantiated, we can be sure that the caches
+        # are specific to the instance, and not the class, i.e. every instance will have its own
+        # set of caches. When the backend is shared (i.e. a file or Redis), the entries of each
+        # cache are namespaced by the model's fingerprint, so that results from a different
+        # version of the model are never served.
+        cache_url = os.getenv("CACHE_URL", model.cache_url)
+        fingerprint = model.fingerprint()
 
-        @lru_cache(maxsize=1024)
-        def predict_with_cache(inputs: str) -> JsonDict:
-            return self.predict(json.loads(inputs))
+        def predict_with_cache(inputs: CacheKey) -> JsonDict:
+            return self.predict(inputs.inputs)
 
-        @lru_cache(maxsize=1024)
-        def interpret_with_cache(interpreter_id: str, inputs: str) -> JsonDict:
-            return self.interpret(interpreter_id, json.loads(inputs))
+        def interpret_with_cache(interpreter_id: str, inputs: CacheKey) -> JsonDict:
+            return self.interpret(interpreter_id, inputs.inputs)
 
-        @lru_cache(maxsize=1024)
-        def attack_with_cache(attacker_id: str, attack: str) -> JsonDict:
-            return self.attack(attacker_id, json.loads(attack))
+        def attack_with_cache(attacker_id: str, attack: CacheKey) -> JsonDict:
+            return self.attack(attacker_id, attack.inputs)
 
-        self.predict_with_cache = predict_with_cache
-        self.interpret_with_cache = interpret_with_cache
-        self.attack_with_cache = attack_with_cache
+        # Partial results, from requests that ran out of budget, aren't cached.
+        def complete(result: JsonDict) -> bool:
+            return not result.get("truncated", False)
+
+        # Predictions at a reduced precision differ slightly from those at 32 bits.
+        predict_namespace = f"{fingerprint}:predict"
+        if model.inference_precision() != precision.FP32:
+            predict_namespace = f"{fingerprint}:predict:{model.inference_precision()}"
+        self.predict_with_cache = ResultCache(
+            predict_with_cache, backend_from_url(cache_url, predict_namespace, 1024)
+        )
+        # Interpretations also depend on the interpreters' options (i.e. the number of samples).
+        interpret_options = CacheKey(model.interpreter_options).digest[:8]
+        self.interpret_with_cache = ResultCache(
+            interpret_with_cache,
+            backend_from_url(cache_url, f"{fingerprint}:interpret:{interpret_options}", 1024),
+            cacheable=complete,
+        )
+        self.attack_with_cache = ResultCache(
+            attack_with_cache,
+            backend_from_url(cache_url, f"{fingerprint}:attack", 1024),
+            cacheable=complete,
+        )
+
+        # Identical requests that arrive while the first one is being handled wait for its
+        # results, rather than computing them again.
+        self.inflight = SingleFlight()
+
+        # Jobs are kept alongside the cached results, so that with a shared backend any worker
+        # can report on them.
+        self.jobs = JobQueue(
+            backend_for_jobs(cache_url, f"{fingerprint}:jobs", 1024, model.job_ttl_s),
+            workers=model.job_workers,
+            max_queued=model.max_queued_jobs,
+            ttl_s=model.job_ttl_s,
+            name=f"{model.id}-jobs",
+        )
 
         self.setup_routes()
 
+        if self.lazy_load_wait_s is None:
+            if ServerOptions.from_model(model).workers > 1:
+                # `run()` forks the workers from this process once the model is loaded.
+                limit_threads_before_fork()
+            self.start_loading()
+
+    def load(self) -> None:
+        """
+        Loads the predictor, interpreters and attackers, and then warms the model up by sending
+        each of the model's `warmup_inputs` through `predict()`.
+
+        This runs in a background thread that's started when the endpoint is created. Override
+        this method to load other things the endpoint needs before it's ready.
+        """
+        start = time.perf_counter()
+        self.predictor = self.model.load_predictor()
+        if self.model.shares_weights():
+            # Gradients are computed for parameters that other models may share.
+            self.model_lock = weights.pool.model_lock
+        # Gradients can't be computed through quantized layers, so only predictions are made at
+        # a reduced precision. The two predictors are instrumented separately.
+        self.inference_predictor = precision.reduce_precision(
+            self.predictor, self.model.inference_precision()
+        )
+        timing.instrument_predictor(self.predictor)
+        if self.inference_predictor is not self.predictor:
+            timing.instrument_predictor(self.inference_predictor)
+
+        # Concurrent `/predict` requests are grouped together and sent to the predictor in
+        # a single batch, if the model is configured to do so.
+        if self.model.max_batch_size > 1:
+            self.batcher = MicroBatcher(
+                self._predict_batch_json,
+                self.model.max_batch_size,
+                self.model.max_batch_wait_ms,
+                name=f"{self.model.id}-batcher",
+            )
+
+        # The interpreters and attackers only read the model, so they're loaded side by side.
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            interpreters = pool.submit(self.load_interpreters)
+            attackers = pool.submit(self.load_attackers)
+            self.interpreters = interpreters.result()
+            self.attackers = attackers.result()
+        logger.info(f"Loaded {self.model.id} in {time.perf_counter() - start:.1f}s")
+
+        for inputs in self.model.warmup_inputs:
+            start = time.perf_counter()
+            try:
+                self.predict(self.normalize_inputs(copy.deepcopy(inputs)))
+            except Exception:
+                # A broken warm-up input shouldn't keep an otherwise healthy model out of service.
+                logger.exception(f"Warm-up prediction failed for {self.model.id}")
+                continue
+            logger.info(f"Warm-up prediction took {(time.perf_counter() - start) * 1000:.0f}ms")
+
+    def start_loading(self) -> None:
+        """
+        Starts loading the model in the background, unless it's already loaded or loading.
+        """
+        with self._usage_lock:
+            if self.ready.is_set() or self.loading:
+                return
+            self.loading = True
+            self.load_error = None
+        self._notify_load_listeners()
+        self._loader = threading.Thread(
+            target=self._load, name=f"{self.model.id}-loader", daemon=True
+        )
+        self._loader.start()
+
+    def _load(self) -> None:
+        start = time.perf_counter()
+        try:
+            self.load()
+            self.model_bytes = self.measure_model_bytes()
+        except BaseException as err:
+            logger.exception(f"Failed to load {self.model.id}")
+            self.load_error = err
+        else:
+            self.load_seconds = time.perf_counter() - start
+            # Listeners hear about the model before requests can use it, so that i.e. a host can
+            # make room for it first.
+            self._notify_load_listeners()
+            self.ready.set()
+        finally:
+            self.loading = False
+
+    def _notify_load_listeners(self) -> None:
+        for listener in self.load_listeners:
+            try:
+                listener(self)
+            except Exception:
+                logger.exception(f"Load listener of {self.model.id} failed")
+
+    def measure_model_bytes(self) -> int:
+        """
+        Returns the size of the loaded model's state, including that of the model `/predict`
+        uses if it has a reduced precision, in bytes.
+        """
+        models = {id(p._model): p._model for p in (self.predictor, self.inference_predictor)}
+        return precision.model_bytes(*models.values())
+
+    def unload(self) -> bool:
+        """
+        Releases the model, so that the memory it uses can be used for something else. The next
+        request that needs it loads it again. Models that are in use aren't unloaded. Returns
+        whether the model was unloaded.
+
+        Override this method to release anything else that `load()` loads.
+        """
+        with self._usage_lock:
+            if self.users > 0 or not self.ready.is_set():
+                return False
+            self.ready.clear()
+            batcher = self.batcher
+            self.predictor = None
+            self.inference_predictor = None
+            self.batcher = None
+            self.interpreters = {}
+            self.attackers = {}
+        if batcher is not None:
+            batcher.close()
+        gc.collect()
+        logger.info(f"Unloaded {self.model.id}")
+        return True
+
+    def _acquire(self) -> None:
+        with self._usage_lock:
+            self.users += 1
+            self.last_used = time.time()
+
+    def _release(self) -> None:
+        with self._usage_lock:
+            self.users -= 1
+
+    def status(self) -> str:
+        """
+        Returns whether the endpoint is still loading, is ready for requests or failed to load.
+        """
+        if self.load_error is not None:
+            return health.FAILED
+        if self.ready.is_set():
+            return health.READY
+        return health.LOADING if self.loading else health.UNLOADED
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> None:
+        """
+        Blocks until the model is loaded and warmed up. A `RuntimeError` is raised if loading
+        failed, or if it takes longer than the `timeout` (in seconds).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.ready.wait(0.1):
+            if self.load_error is not None:
+                raise RuntimeError(f"Failed to load {self.model.id}") from self.load_error
+            if deadline is not None and time.monotonic() > deadline:
+                raise RuntimeError(f"Timed out waiting for {self.model.id} to load")
+
+    def _wait_until_loaded(self) -> None:
+        # The workers are forked once this returns, so the thread that loaded the model has to
+        # have exited, rather than just have set `ready`. `load()` already waits for the threads
+        # that load the interpreters and attackers.
+        self.wait_until_ready()
+        if self._loader is not None:
+            self._loader.join()
+
     def load_interpreters(self) -> Dict[str, SaliencyInterpreter]:
         """
         Returns a mapping of interpreters keyed by a unique identifier. Requests to
         `/interpret/:id` will invoke the interpreter with the provided `:id`. Override this method
         to add or remove interpreters.
+
+        The smooth and integrated gradient interpreters send all of their samples through the
+        model in one batch, and are configured by the model's `interpreter_options`.
         """
         interpreters: Dict[str, SaliencyInterpreter] = {}
+        options = self.model.interpreter_options
         if "simple_gradient" in self.model.interpreters:
             interpreters["simple_gradient"] = SimpleGradient(self.predictor)
         if "smooth_gradient" in self.model.interpreters:
-            interpreters["smooth_gradient"] = SmoothGradient(self.predictor)
+            interpreters["smooth_gradient"] = BatchedSmoothGradient(
+                self.predictor, **options.get("smooth_gradient", {})
+            )
         if "integrated_gradient" in self.model.interpreters:
-            interpreters["integrated_gradient"] = IntegratedGradient(self.predictor)
+            interpreters["integrated_gradient"] = BatchedIntegratedGradient(
+                self.predictor, **options.get("integrated_gradient", {})
+            )
         return interpreters
 
     def load_attackers(self) -> Dict[str, Attacker]:
@@ -136,51 +526,269 @@ class ModelEndpoint:
         """
         attackers: Dict[str, Attacker] = {}
         if "hotflip" in self.model.attackers:
-            hotflip = Hotflip(self.predictor)
-            hotflip.initialize()
-            attackers["hotflip"] = hotflip
+            attackers["hotflip"] = LazyHotflip(
+                self.predictor, cache_dir=snapshot.snapshot_path(self.model)
+            )
         if "input_reduction" in self.model.attackers:
-            attackers["input_reduction"] = InputReduction(self.predictor)
+            attackers["input_reduction"] = BudgetedInputReduction(self.predictor)
         return attackers
 
     def info(self) -> str:
         """
-        Returns basic information about the model and the version of AllenNLP.
+        Returns basic information about the model and the version of AllenNLP. The cache URL's
+        password, if it has one, is masked.
+        """
+        info = {**asdict(self.model), "cache_url": redact_url(self.model.cache_url)}
+        return jsonify({**info, "allennlp": VERSION})
+
+    def normalize_inputs(self, inputs: JsonDict) -> JsonDict:
+        """
+        Normalizes the inputs of a request before they're used to look up cached results and
+        passed to the model. By default the inputs are returned as-is. Override this method to
+        remove differences that don't affect predictions (like insignificant whitespace), so that
+        such requests share cache entries.
+        """
+        return inputs
+
+    def read_inputs(self) -> CacheKey:
+        """
+        Parses and normalizes the body of a `/predict` or `/interpret` request, and returns it
+        paired with the key used to cache its results.
+        """
+        with span("parse"):
+            return CacheKey(self.normalize_inputs(parse_json_body(request)))
+
+    def read_batch_inputs(self) -> List[CacheKey]:
+        """
+        Parses and normalizes the body of a `/predict_batch` request, which should be a list of
+        at most `max_batch_items` inputs.
+        """
+        with span("parse"):
+            inputs = parse_json_body(request)
+            if not isinstance(inputs, list):
+                raise InvalidInputError("Expected a JSON list of inputs")
+            if len(inputs) > self.model.max_batch_items:
+                raise InvalidInputError(
+                    f"Expected at most {self.model.max_batch_items} inputs, got {len(inputs)}"
+                )
+            return [CacheKey(self.normalize_inputs(i)) for i in inputs]
+
+    def read_attack(self) -> CacheKey:
+        """
+        Parses the body of an `/attack` request, normalizing the model inputs it contains.
+        """
+        with span("parse"):
+            attack = parse_json_body(request)
+            if isinstance(attack, dict) and isinstance(attack.get("inputs"), dict):
+                attack["inputs"] = self.normalize_inputs(attack["inputs"])
+            return CacheKey(attack)
+
+    def read_budget(self, job: bool = False) -> Budget:
+        """
+        Returns the budget for an `/interpret` or `/attack` request. It's the model's default,
+        unless the request asks for a different one with the `deadline_ms` or `max_passes` query
+        string arguments. Deadlines are capped at the model's `max_deadline_ms`, and requests may
+        only lower `max_passes`.
+
+        If `job` is True, the budget is for a job, whose deadline defaults to and is capped at the
+        model's `job_deadline_ms` instead.
         """
-        return jsonify({**asdict(self.model), "allennlp": VERSION})
+        max_deadline_ms = self.model.job_deadline_ms if job else self.model.max_deadline_ms
+        deadline_ms = self.model.job_deadline_ms if job else self.model.deadline_ms
+        max_passes = self.model.max_passes
+        try:
+            if "deadline_ms" in request.args:
+                deadline_ms = float(request.args["deadline_ms"])
+            if "max_passes" in request.args:
+                max_passes = int(request.args["max_passes"])
+        except ValueError as err:
+            raise InvalidInputError(str(err))
+        if deadline_ms is not None and deadline_ms <= 0:
+            raise InvalidInputError("deadline_ms must be positive")
+        if max_passes is not None and max_passes < 1:
+            raise InvalidInputError("max_passes must be at least 1")
+        if max_deadline_ms is not None and (deadline_ms is None or deadline_ms > max_deadline_ms):
+            deadline_ms = max_deadline_ms
+        if max_passes is not None and self.model.max_passes is not None:
+            max_passes = min(max_passes, self.model.max_passes)
+        return Budget(deadline_ms=deadline_ms, max_passes=max_passes)
 
     def predict(self, inputs: JsonDict) -> JsonDict:
         """
         Returns predictions.
+
+        If batching is enabled the inputs are queued up and sent to the predictor together
+        with those of other concurrent requests.
+        """
+        with span("predict"):
+            if self.batcher is not None:
+                return self.batcher.submit(inputs)
+            with self.locked_model():
+                return self.inference_predictor.predict_json(inputs)
+
+    def predict_batch(self, inputs: List[JsonDict]) -> List[JsonDict]:
+        """
+        Returns predictions for several inputs, which are sent to the predictor in a single batch.
+
+        Endpoints that override `predict` to modify the inputs or outputs should override this
+        method too, so that the same modifications apply to each input of a batch.
+        """
+        return self._predict_batch_json(inputs)
+
+    def predict_batch_with_cache(self, inputs: List[CacheKey]) -> Tuple[List[JsonDict], List[bool]]:
+        """
+        Returns predictions for several inputs, and whether each one came from the cache.
+
+        Each input is looked up in `predict_with_cache`. Only those that aren't cached are sent
+        through `predict_batch()`, after which their results are added to the cache.
+        """
+        results: List[Optional[JsonDict]] = []
+        cache_hits: List[bool] = []
+        misses: Dict[CacheKey, List[int]] = {}
+        for idx, item in enumerate(inputs):
+            hit, result = self.predict_with_cache.peek(item)
+            results.append(result)
+            cache_hits.append(hit)
+            if not hit:
+                # Identical inputs in the same batch are only predicted once.
+                misses.setdefault(item, []).append(idx)
+
+        if misses:
+            start = time.perf_counter()
+            predictions = self.predict_batch([item.inputs for item in misses])
+            cost = (time.perf_counter() - start) * 1000 / len(misses)
+            for (item, indices), prediction in zip(misses.items(), predictions):
+                self.predict_with_cache.put((item,), prediction, cost)
+                for idx in indices:
+                    results[idx] = prediction
+
+        return results, cache_hits
+
+    def _predict_batch_json(self, inputs: List[JsonDict]) -> List[JsonDict]:
+        with span("predict"), self.locked_model():
+            return self.inference_predictor.predict_batch_json(inputs)
+
+    @contextmanager
+    def locked_model(self) -> Iterator[None]:
         """
-        return self.predictor.predict_json(inputs)
+        Holds the `model_lock`. The time spent waiting for it is timed as the `lock` span.
+        """
+        with span("lock"):
+            self.model_lock.acquire()
+        try:
+            yield
+        finally:
+            self.model_lock.release()
 
     def interpret(self, interpreter_id: str, inputs: JsonDict) -> JsonDict:
         """
         Interprets the output of a predictor and assigns sailency scores to each, as to find
         inputs that would change the model's prediction some desired manner.
+
+        The interpreter stops early if the current budget (see `read_budget()`) is exhausted, in
+        which case the result is marked as `truncated`.
+        """
+        interp = self.get_interpreter(interpreter_id)
+        with self.locked_model(), span("interpret"):
+            result = interp.saliency_interpret_from_json(inputs)
+        if current_budget().truncated:
+            result["truncated"] = True
+        return result
+
+    def get_interpreter(self, interpreter_id: str) -> SaliencyInterpreter:
+        """
+        Returns the interpreter with the given id, or raises a `NotFoundError` if there isn't one.
         """
         if interpreter_id not in config.VALID_INTERPRETERS:
             raise UnknownInterpreterError(interpreter_id)
         interp = self.interpreters.get(interpreter_id)
         if interp is None:
             raise InvalidInterpreterError(interpreter_id)
-        return interp.saliency_interpret_from_json(inputs)
+        return interp
 
     def attack(self, attacker_id: str, attack: JsonDict) -> JsonDict:
         """
         Modifies the input (e.g. by adding or removing tokens) to try to change the model's prediction
         in some desired manner.
+
+        The attacker stops early if the current budget (see `read_budget()`) is exhausted, in
+        which case the result is marked as `truncated`.
+        """
+        attacker = self.get_attacker(attacker_id)
+        with self.locked_model(), span("attack"):
+            result = attacker.attack_from_json(**attack)
+        if current_budget().truncated:
+            result["truncated"] = True
+        return result
+
+    def get_attacker(self, attacker_id: str) -> Attacker:
+        """
+        Returns the attacker with the given id, or raises a `NotFoundError` if there isn't one.
         """
         if attacker_id not in config.VALID_ATTACKERS:
             raise UnknownAttackerError(attacker_id)
         attacker = self.attackers.get(attacker_id)
         if attacker is None:
             raise InvalidAttackerError(attacker_id)
-        return attacker.attack_from_json(**attack)
+        return attacker
+
+    def stream_attack(
+        self, attacker_id: str, attack: CacheKey, budget: Budget, use_cache: bool = True
+    ) -> Iterator[JsonDict]:
+        """
+        Runs an attack in the background and yields an event for each of its intermediate steps
+        (i.e. each token that's flipped or removed), followed by one with the result or an error.
+        Unless `use_cache` is False, the result is cached like it is for `/attack`.
+
+        If the consumer stops before the attack is done (i.e. because the client disconnected),
+        the attack's budget is cancelled, so that it stops too.
+        """
+        events: queue.Queue = queue.Queue()
+        steps = itertools.count(1)
+
+        def add_step(step: JsonDict) -> None:
+            events.put({"event": "step", "step": next(steps), **step})
+
+        def run() -> None:
+            with budget.activate(), progress.listen(add_step):
+                try:
+                    if use_cache:
+                        result, hit = self.attack_with_cache.lookup(attacker_id, attack)
+                    else:
+                        result, hit = self.attack(attacker_id, attack.inputs), False
+                except Exception as err:
+                    logger.exception(f"Attack with {attacker_id} failed")
+                    events.put({"event": "error", "error": str(err)})
+                else:
+                    events.put({"event": "result", "result": result, "cached": hit})
+                finally:
+                    self._release()
+
+        # The attack outlives the request that started it, so it's a user of the model itself.
+        self._acquire()
+        if not self.ready.is_set():
+            # The model was unloaded after the request was accepted.
+            self._release()
+            yield {"event": "error", "error": f"{self.model.id} isn't ready"}
+            return
+        threading.Thread(target=run, name=f"{attacker_id}-stream", daemon=True).start()
+        try:
+            while True:
+                event = events.get()
+                yield event
+                if event["event"] != "step":
+                    return
+        finally:
+            budget.cancel()
+
+    def configure_compression(self) -> None:
+        """
+        Compresses large responses with gzip or Brotli, for clients that accept it.
+        """
+        self.compressor = compression.configure_compression(self.app)
 
     def configure_logging(self, log_payloads: bool = False) -> None:
-        configure_logging(self.app, log_payloads=log_payloads)
+        self.log_stats = configure_logging(self.app, log_payloads=log_payloads)
 
     def configure_error_handling(self) -> None:
         def handle_invalid_json(err: json.JSONDecodeError):
@@ -188,11 +796,134 @@ class ModelEndpoint:
 
         self.app.register_error_handler(json.JSONDecodeError, handle_invalid_json)
 
+        def handle_invalid_input(err: InvalidInputError):
+            return jsonify({"error": str(err)}), 400
+
+        self.app.register_error_handler(InvalidInputError, handle_invalid_input)
+
         def handle_404(err: NotFoundError):
             return jsonify({"error": str(err)}), 404
 
         self.app.register_error_handler(NotFoundError, handle_404)
 
+        def handle_full_job_queue(err: JobQueueFullError):
+            return jsonify({"error": str(err)}), 503
+
+        self.app.register_error_handler(JobQueueFullError, handle_full_job_queue)
+
+    def configure_metrics(self) -> None:
+        """
+        Adds the `/metrics` route, which reports the latency of requests, the state of the caches
+        and queues, how long the model took to load and how much memory the process uses, in the
+        format Prometheus scrapes. Each worker process reports its own metrics.
+        """
+        self.metrics = configure_metrics(self.app)
+
+        def caches() -> Dict[str, ResultCache]:
+            return {
+                "predict": self.predict_with_cache,
+                "interpret": self.interpret_with_cache,
+                "attack": self.attack_with_cache,
+            }
+
+        def cache_metric(name: str, help: str, value: Callable[[ResultCache], float]) -> None:
+            self.metrics.register(
+                (Counter if name.endswith("_total") else Gauge)(
+                    f"allennlp_demo_cache_{name}",
+                    help,
+                    ["cache"],
+                    lambda: {(cache_id,): value(c) for cache_id, c in caches().items()},
+                )
+            )
+
+        cache_metric("hits_total", "Results served from the cache.", lambda c: c.cache_info().hits)
+        cache_metric(
+            "misses_total", "Results that weren't cached.", lambda c: c.cache_info().misses
+        )
+        cache_metric(
+            "evictions_total",
+            "Results evicted from the cache to make room for others.",
+            lambda c: c.backend.stats().get("evictions", 0),
+        )
+        cache_metric("entries", "Results in the cache.", lambda c: c.cache_info().currsize)
+
+        self.metrics.gauge(
+            "allennlp_demo_queue_depth",
+            "Work that's waiting to be processed, by queue.",
+            ["queue"],
+            lambda: {
+                ("batcher",): len(self.batcher) if self.batcher is not None else 0,
+                ("jobs",): len(self.jobs),
+            },
+        )
+        self.metrics.counter(
+            "allennlp_demo_log_records_dropped_total",
+            "Log records that were dropped because too many were waiting to be written.",
+            callback=lambda: {(): self.log_stats.dropped},
+        )
+        self.metrics.counter(
+            "allennlp_demo_log_payloads_truncated_total",
+            "Request or response bodies that were too big to log.",
+            callback=lambda: {(): self.log_stats.truncated},
+        )
+        self.metrics.counter(
+            "allennlp_demo_compressed_responses_total",
+            "Responses that were compressed, by encoding.",
+            ["encoding"],
+            lambda: {(e,): n for e, n in dict(self.compressor.responses).items()},
+        )
+        self.metrics.counter(
+            "allennlp_demo_compression_saved_bytes_total",
+            "How many fewer bytes were sent by compressing responses.",
+            callback=lambda: {(): self.compressor.saved_bytes},
+        )
+        self.metrics.gauge(
+            "allennlp_demo_model_load_seconds",
+            "How long the model took to load and warm up, in seconds.",
+            callback=lambda: {(): self.load_seconds} if self.load_seconds is not None else {},
+        )
+
+    def configure_health_checks(self) -> None:
+        """
+        Adds the `/ready` and `/live` routes, and answers requests that need the model with a 503
+        until it's loaded. Requests for the model's info, the state of jobs and the health checks
+        are always served.
+
+        If the endpoint loads its model lazily (see `lazy_loading()`), the first request that
+        needs the model starts loading it, and waits a while for it to load.
+        """
+        health.configure_health_checks(self.app, self.status)
+
+        always_available = {
+            "info_handler",
+            "noop",
+            "ready",
+            "live",
+            "metrics",
+            "static",
+            "job_handler",
+        }
+
+        @self.app.before_request
+        def reject_until_ready():
+            if request.endpoint in always_available:
+                return None
+            # The request counts as a user of the model from now on, so that it isn't unloaded.
+            self._acquire()
+            g.uses_model = True
+            if self.ready.is_set():
+                return None
+            if self.lazy_load_wait_s is not None:
+                self.start_loading()
+                if self.ready.wait(self.lazy_load_wait_s):
+                    return None
+            return jsonify({"error": f"{self.model.id} isn't ready", "status": self.status()}), 503
+
+        @self.app.teardown_request
+        def release_model(err: Optional[BaseException]) -> None:
+            if g.pop("uses_model", False):
+                self._release()
+
     def setup_routes(self) -> None:
         """
         Binds HTTP paths to verbs supported by a standard model endpoint. You can override this
@@ -210,30 +941,141 @@ class ModelEndpoint:
 
         @self.app.route("/predict", methods=["POST"])
         def predict_handler():
+            inputs = self.read_inputs()
             if no_cache(request):
-                return jsonify(self.predict(request.get_json()))
-            return jsonify(with_cache_hit_response_headers(self.predict_with_cache, request.data))
+                return respond(self.predict(inputs.inputs))
+            return respond(
+                with_cache_hit_response_headers(
+                    self.predict_with_cache, inputs, inflight=self.inflight
+                )
+            )
+
+        @self.app.route("/predict_batch", methods=["POST"])
+        def predict_batch_handler():
+            inputs = self.read_batch_inputs()
+            if no_cache(request):
+                return respond(
+                    {
+                        "results": self.predict_batch([i.inputs for i in inputs]),
+                        "cache_hits": [False] * len(inputs),
+                    }
+                )
+
+            results, cache_hits = self.predict_batch_with_cache(inputs)
+            if inputs and all(cache_hits):
+                add_cache_hit_header()
+
+            return respond({"results": results, "cache_hits": cache_hits})
 
         @self.app.route("/interpret/<string:interpreter_id>", methods=["POST"])
         def interpet_handler(interpreter_id: str):
-            if no_cache(request):
-                return jsonify(self.interpret(interpreter_id, request.get_json()))
-            return jsonify(
-                with_cache_hit_response_headers(
-                    self.interpret_with_cache, interpreter_id, request.data
+            inputs = self.read_inputs()
+            with self.read_budget().activate():
+                if no_cache(request):
+                    return respond(self.interpret(interpreter_id, inputs.inputs))
+                return respond(
+                    with_cache_hit_response_headers(
+                        self.interpret_with_cache,
+                        interpreter_id,
+                        inputs,
+                        inflight=self.inflight if not custom_budget(request) else None,
+                    )
                 )
-            )
 
         @self.app.route("/attack/<string:attacker_id>", methods=["POST"])
         def attack_handler(attacker_id: str):
-            if no_cache(request):
-                return jsonify(self.attack(attacker_id, request.get_json()))
-            return jsonify(
-                with_cache_hit_response_headers(self.attack_with_cache, attacker_id, request.data)
+            attack = self.read_attack()
+            with self.read_budget().activate():
+                if no_cache(request):
+                    return respond(self.attack(attacker_id, attack.inputs))
+                return respond(
+                    with_cache_hit_response_headers(
+                        self.attack_with_cache,
+                        attacker_id,
+                        attack,
+                        inflight=self.inflight if not custom_budget(request) else None,
+                    )
+                )
+
+        @self.app.route("/attack/<string:attacker_id>/stream", methods=["POST"])
+        def attack_stream_handler(attacker_id: str):
+            # Check the attacker before the stream starts, so that unknown ones get a 404.
+            self.get_attacker(attacker_id)
+            attack = self.read_attack()
+            events = self.stream_attack(
+                attacker_id, attack, self.read_budget(), use_cache=not no_cache(request)
             )
+            return stream_events(events, server_sent_events(request))
+
+        @self.app.route("/jobs/predict", methods=["POST"])
+        def predict_job_handler():
+            inputs = self.read_inputs()
+            return self.submit_job("predict", lambda: self.predict_with_cache(inputs))
+
+        @self.app.route("/jobs/interpret/<string:interpreter_id>", methods=["POST"])
+        def interpret_job_handler(interpreter_id: str):
+            self.get_interpreter(interpreter_id)
+            inputs = self.read_inputs()
+            limits = self.read_budget(job=True)
+
+            def interpret_job() -> JsonDict:
+                # The deadline starts when the job does, rather than when it's queued.
+                with Budget(limits.deadline_ms, limits.max_passes).activate():
+                    return self.interpret_with_cache(interpreter_id, inputs)
+
+            return self.submit_job("interpret", interpret_job)
+
+        @self.app.route("/jobs/attack/<string:attacker_id>", methods=["POST"])
+        def attack_job_handler(attacker_id: str):
+            self.get_attacker(attacker_id)
+            attack = self.read_attack()
+            limits = self.read_budget(job=True)
+
+            def attack_job() -> JsonDict:
+                with Budget(limits.deadline_ms, limits.max_passes).activate():
+                    return self.attack_with_cache(attacker_id, attack)
+
+            return self.submit_job("attack", attack_job)
+
+        @self.app.route("/jobs/<string:job_id>", methods=["GET"])
+        def job_handler(job_id: str):
+            job = self.jobs.get(job_id)
+            if job is None:
+                raise NotFoundError(f"No job with id '{job_id}'")
+            return jsonify(job)
+
+    def submit_job(self, kind: str, fn: Callable[[], JsonDict]) -> Response:
+        """
+        Queues a job and returns a `202` response with its state. Clients poll `/jobs/<id>` for
+        the result, which is cached like the results of the equivalent synchronous route.
+        """
+        # The job is a user of the model until it's done.
+        def run() -> JsonDict:
+            try:
+                return fn()
+            finally:
+                self._release()
+
+        self._acquire()
+        try:
+            job = self.jobs.submit(kind, run)
+        except JobQueueFullError:
+            self._release()
+            raise
+        resp = jsonify(job)
+        resp.status_code = 202
+        return resp
 
     def run(self, port: int = 8000) -> None:
-        # For simplicity, we use Flask's built in server. This isn't recommended, per:
+        options = ServerOptions.from_model(self.model)
+        if options.workers > 1:
+            # In production we load the model once and fork several workers that share it. The
+            # socket is bound right away, but the workers are only forked once the model is
+            # loaded, as otherwise each of them would load it again.
+            serve_prefork(self.app, "0.0.0.0", port, options, before_fork=self._wait_until_loaded)
+            return
+
+        # With a single worker we use Flask's built in server. This isn't recommended, per:
         # https://flask.palletsprojects.com/en/1.1.x/tutorial/deploy/#run-with-a-production-server
         #
         # That said we think this is preferable because:
@@ -242,4 +1084,7 @@ class ModelEndpoint:
         #   - Our workload is CPU bound, so event loop based WSGI servers don't get us much.
         #   - We use Kubernetes to scale horizontally, and run an NGINX proxy at the front-door,
         #     which adds the resiliency and other things we need for production.
-        self.app.run(host="0.0.0.0", port=port)
+        #
+        # Requests are handled in separate threads, which is what allows concurrent `/predict`
+        # requests to be batched together.
+        self.app.run(host="0.0.0.0", port=port, threaded=True)
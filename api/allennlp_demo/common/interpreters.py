@@ -0,0 +1,199 @@
+import math
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy
+import torch
+from allennlp.data import Batch, Instance
+from allennlp.data.fields import TextField
+from allennlp.interpret.saliency_interpreters import IntegratedGradient, SmoothGradient
+from allennlp.nn import util
+from allennlp.predictors import Predictor
+
+from allennlp_demo.common.budget import current_budget
+
+
+def _chunks(n: int, instance: Instance, max_batch_tokens: int) -> Iterator[List[int]]:
+    """
+    Splits `n` copies of the instance into batches of at most `max_batch_tokens` tokens, and
+    yields the indices of the copies in each batch.
+
+    The indices are interleaved (i.e. `[0, 2, 4]` and `[1, 3]`), so that if the current budget
+    runs out and only some of the batches are used, they're spread evenly over the samples.
+    Batches are only yielded while the budget lasts, but there's always at least one.
+    """
+    num_tokens = sum(len(f.tokens) for f in instance.fields.values() if isinstance(f, TextField))
+    batch_size = max(1, max_batch_tokens // max(1, num_tokens))
+    num_batches = -(-n // batch_size)
+    budget = current_budget()
+    for start in range(num_batches):
+        if start > 0 and budget.stop():
+            return
+        yield list(range(start, n, num_batches))
+        budget.spend()
+
+
+def _loss_is_summed(predictor: Predictor, instance: Instance) -> bool:
+    """
+    Returns whether the predictor's model adds up the loss of each instance in a batch, like a
+    CRF tagger does, rather than averaging it. This is found by comparing the loss of a batch
+    with two copies of the instance with that of a batch with one.
+    """
+    predictor._dataset_reader.apply_token_indexers(instance)
+    losses = []
+    with torch.no_grad():
+        for n in (1, 2):
+            batch = Batch([instance] * n)
+            batch.index_instances(predictor._model.vocab)
+            tensors = util.move_to_device(batch.as_tensor_dict(), predictor.cuda_device)
+            losses.append(float(predictor._model.forward(**tensors)["loss"]))
+    return losses[0] != 0 and math.isclose(losses[1], 2 * losses[0], rel_tol=1e-3)
+
+
+def _add_grads(
+    total: Dict[str, Any], grads: Dict[str, numpy.ndarray], row_weight: float
+) -> Dict[str, Any]:
+    # Add up the gradients of each row, but keep the batch dimension like
+    # `Predictor.get_gradients()` does for a single instance. Each row's gradient is multiplied
+    # by `row_weight`, which makes it the same as that of the row on its own.
+    for key, grad in grads.items():
+        grad = grad.sum(axis=0, keepdims=True) * row_weight
+        total[key] = grad if key not in total else total[key] + grad
+    return total
+
+
+class _BatchedGradients:
+    """
+    Weighs the gradients of each row of a batch of copies of an instance, so that they're the
+    same as those of the copy on its own, however the model reduces its loss.
+    """
+
+    predictor: Predictor
+    _summed: Optional[bool] = None
+
+    def _row_weight(self, instance: Instance, batch_size: int) -> int:
+        if batch_size == 1:
+            return 1
+        # This runs the model, so it has to be called before any hooks are registered.
+        if self._summed is None:
+            self._summed = _loss_is_summed(self.predictor, instance)
+        # An averaged loss scales the gradient of each row by one over the batch's size.
+        return 1 if self._summed else batch_size
+
+
+class BatchedSmoothGradient(_BatchedGradients, SmoothGradient):
+    """
+    `SmoothGradient`, but each noisy copy of the input is a row in a batch, rather than a
+    separate forward and backward pass through the model. Batches are limited to
+    `max_batch_tokens` tokens, so long inputs are split across several passes. If the current
+    budget runs out, the gradients are averaged over the samples computed so far.
+
+    The gradients of each copy are the same as they would be on its own, whether the model
+    averages its loss over a batch or adds it up.
+    """
+
+    def __init__(
+        self,
+        predictor: Predictor,
+        num_samples: int = 10,
+        stdev: float = 0.01,
+        max_batch_tokens: int = 4096,
+    ) -> None:
+        super().__init__(predictor)
+        self.num_samples = num_samples
+        self.stdev = stdev
+        self.max_batch_tokens = max_batch_tokens
+
+    def _smooth_grads(self, instance: Instance) -> Dict[str, numpy.ndarray]:
+        total_gradients: Dict[str, Any] = {}
+        num_samples = 0
+        for samples in _chunks(self.num_samples, instance, self.max_batch_tokens):
+            row_weight = self._row_weight(instance, len(samples))
+            # The hook draws different noise for each row of the batch.
+            handle = self._register_forward_hook(self.stdev)
+            try:
+                grads = self.predictor.get_gradients([instance] * len(samples))[0]
+            finally:
+                handle.remove()
+            _add_grads(total_gradients, grads, row_weight)
+            num_samples += len(samples)
+
+        for key in total_gradients.keys():
+            total_gradients[key] /= num_samples
+        return total_gradients
+
+
+class BatchedIntegratedGradient(_BatchedGradients, IntegratedGradient):
+    """
+    `IntegratedGradient`, but the copies of the input that are scaled by each `alpha` are rows
+    in a batch, rather than separate forward and backward passes through the model. Batches are
+    limited to `max_batch_tokens` tokens, so long inputs are split across several passes. If the
+    current budget runs out, the integral is approximated with the steps computed so far.
+
+    The gradients of each copy are the same as they would be on its own, whether the model
+    averages its loss over a batch or adds it up.
+    """
+
+    def __init__(self, predictor: Predictor, steps: int = 10, max_batch_tokens: int = 4096) -> None:
+        super().__init__(predictor)
+        self.steps = steps
+        self.max_batch_tokens = max_batch_tokens
+
+    def _register_batch_hooks(
+        self, alphas: torch.Tensor, embeddings_list: List, token_offsets: List
+    ) -> List:
+        def forward_hook(module, inputs, output):
+            # Save the unscaled input of the first row for later use, if it's the first batch.
+            if alphas[0] == 0:
+                embeddings_list.append(output[0].clone().detach())
+            # Scale each row of the batch by its own alpha.
+            output.mul_(alphas.to(output.device).view(-1, *([1] * (output.dim() - 1))))
+
+        def get_token_offsets(module, inputs, outputs):
+            if alphas[0] != 0:
+                return
+            offsets = util.get_token_offsets_from_text_field_inputs(inputs)
+            if offsets is not None:
+                token_offsets.append(offsets[:1])
+
+        embedding_layer = self.predictor.get_interpretable_layer()
+        text_field_embedder = self.predictor.get_interpretable_text_field_embedder()
+        return [
+            embedding_layer.register_forward_hook(forward_hook),
+            text_field_embedder.register_forward_hook(get_token_offsets),
+        ]
+
+    def _integrate_gradients(self, instance: Instance) -> Dict[str, numpy.ndarray]:
+        ig_grads: Dict[str, Any] = {}
+        embeddings_list: List[torch.Tensor] = []
+        token_offsets: List[torch.Tensor] = []
+
+        # Exclude the endpoint because we do a left point integral approximation.
+        all_alphas = torch.linspace(0, 1.0, steps=self.steps + 1)[:-1]
+        steps = 0
+        for indices in _chunks(self.steps, instance, self.max_batch_tokens):
+            # The first batch always starts with an alpha of 0, which is when the unscaled
+            # embeddings are saved.
+            alphas = all_alphas[indices]
+            row_weight = self._row_weight(instance, len(indices))
+            handles = self._register_batch_hooks(alphas, embeddings_list, token_offsets)
+            try:
+                grads = self.predictor.get_gradients([instance] * len(indices))[0]
+            finally:
+                for handle in handles:
+                    handle.remove()
+            _add_grads(ig_grads, grads, row_weight)
+            steps += len(indices)
+
+        for key in ig_grads.keys():
+            ig_grads[key] /= steps
+
+        # Gradients come back in the reverse order that they were sent into the network.
+        embeddings_list.reverse()
+        token_offsets.reverse()
+        embeddings_list = self._aggregate_token_embeddings(embeddings_list, token_offsets)
+
+        # Element-wise multiply average gradient by the input.
+        for idx, input_embedding in enumerate(embeddings_list):
+            key = "grad_input_" + str(idx + 1)
+            ig_grads[key] *= input_embedding
+        return ig_grads
@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from allennlp_demo.common.cache import DEFAULT_CACHE_URL, CacheBackend, backend_from_url
+
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueueFullError(RuntimeError):
+    pass
+
+
+class MemoryJobStore(CacheBackend):
+    """
+    Keeps job records in the memory of the current process. Unlike `MemoryCacheBackend`, which
+    only admits values that are worth more than those they'd evict, every record is stored, since
+    a client that was told about a job must be able to poll for it. Records expire `ttl_s` seconds
+    after they're written, and if there are more than `maxsize` of them those that expire soonest
+    are evicted first.
+    """
+
+    def __init__(self, namespace: str, maxsize: int, ttl_s: float):
+        super().__init__(namespace, maxsize)
+        self.ttl_s = ttl_s
+        # Ordered by when each record expires, which is the order they were last written in.
+        self._entries: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self, now: float) -> None:
+        while self._entries:
+            _, expires_at = next(iter(self._entries.values()))
+            if expires_at >= now and len(self._entries) <= self.maxsize:
+                return
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.time():
+                return None
+            return entry[0]
+
+    def set(self, key: str, value: bytes, cost: float = 0.0) -> None:
+        now = time.time()
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, now + self.ttl_s)
+            self._evict(now)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._evict(time.time())
+            return len(self._entries)
+
+
+def backend_for_jobs(
+    url: Optional[str], namespace: str, maxsize: int, ttl_s: float
+) -> CacheBackend:
+    """
+    Creates the backend that job records are stored in from a cache URL (see
+    `allennlp_demo.common.cache.backend_from_url()`). Records are stored alongside the cached
+    results, except that those kept in memory are stored in a `MemoryJobStore`.
+    """
+    if urlparse(url if url is not None else DEFAULT_CACHE_URL).scheme == "memory":
+        return MemoryJobStore(namespace, maxsize, ttl_s)
+    return backend_from_url(url, namespace, maxsize)
+
+
+class JobQueue:
+    """
+    Runs jobs (functions that return JSON serializable results) in the background, on a fixed
+    number of worker threads, so that clients can submit expensive work and poll for the result
+    rather than waiting for it.
+
+    At most `max_queued` jobs wait for a worker, after which `submit()` raises a
+    `JobQueueFullError`. The state of each job, and its result once it's done, is stored as JSON
+    in the given backend, so that any process that shares the backend (i.e. Redis) can report on
+    it. Jobs are forgotten `ttl_s` seconds after they're submitted or finished.
+    """
+
+    def __init__(
+        self,
+        backend: CacheBackend,
+        workers: int = 1,
+        max_queued: int = 32,
+        ttl_s: float = 3600,
+        name: str = "jobs",
+    ):
+        assert workers >= 1, "workers must be at least 1"
+        assert max_queued >= 1, "max_queued must be at least 1"
+        self.backend = backend
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl_s = ttl_s
+        self.name = name
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+
+    def _start(self) -> None:
+        # Threads don't survive a fork, so the workers are started by the first job that's
+        # submitted in each process.
+        self._queue: "queue.Queue[Tuple[dict, Callable[[], Any]]]" = queue.Queue(self.max_queued)
+        self._threads: List[threading.Thread] = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._pid = os.getpid()
+
+    def submit(self, kind: str, fn: Callable[[], Any]) -> dict:
+        """
+        Queues a call to `fn` and returns the new job, which has an `id` that can be passed to
+        `get()`.
+        """
+        now = time.time()
+        job = {"id": uuid.uuid4().hex, "kind": kind, "status": QUEUED, "created_at": now}
+        with self._lock:
+            if self._pid != os.getpid():
+                self._start()
+            if self._queue.full():
+                raise JobQueueFullError(f"There are already {self.max_queued} queued jobs")
+            # The job is saved before it's queued, so that a worker can't pick it up and save
+            # a newer state first.
+            self._save(job)
+            self._queue.put_nowait((job, fn))
+        return job
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """
+        Returns the job with the given id, or `None` if there isn't one or it has expired.
+        """
+        raw = self.backend.get(job_id)
+        if raw is None:
+            return None
+        job = json.loads(raw)
+        if job["expires_at"] < time.time():
+            return None
+        return job
+
+    def __len__(self) -> int:
+        """
+        Returns the number of jobs that are waiting for a worker.
+        """
+        return self._queue.qsize() if self._pid == os.getpid() else 0
+
+    def _save(self, job: dict, cost: float = 0.0) -> None:
+        job["expires_at"] = time.time() + self.ttl_s
+        self.backend.set(job["id"], json.dumps(job).encode(), cost)
+
+    def _run(self) -> None:
+        while True:
+            job, fn = self._queue.get()
+            job.update(status=RUNNING, started_at=time.time())
+            self._save(job)
+            try:
+                result = fn()
+            except Exception as err:
+                logger.exception(f"Job {job['id']} failed")
+                job.update(status=FAILED, error=str(err))
+            else:
+                job.update(status=DONE, result=result)
+            job["finished_at"] = time.time()
+            # Results that took long to compute are the last ones a cost-aware backend evicts.
+            self._save(job, cost=(job["finished_at"] - job["started_at"]) * 1000)
@@ -2,13 +2,19 @@ import os
 import sys
 import json
 import logging
+import queue
+import random
+import threading
 import time
-from typing import Mapping
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, List, Mapping
 
 from flask import Flask, request, Response, g
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, fields, is_dataclass
 from typing import Optional
 
+from allennlp_demo.common import timing
+
 
 @dataclass(frozen=True)
 class RequestLogEntry:
@@ -16,12 +22,108 @@ class RequestLogEntry:
     method: str
     path: str
     query: dict
-    request_data: Optional[dict]
-    response_data: Optional[dict]
+    request_data: Optional[Any]
+    response_data: Optional[Any]
     ip: str
     forwarded_for: Optional[str]
     latency_ms: float
     cached: bool
+    coalesced: bool
+    timings: Dict[str, float]
+    timestamp: float
+    """
+    When the request was received, in seconds since the epoch.
+    """
+
+
+class LogStats:
+    """
+    Counts the log records that were dropped because the queue of records waiting to be written
+    was full, and the payloads that were left out of request logs because they were too big.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.dropped = 0
+        self.truncated = 0
+
+    def drop(self) -> None:
+        with self._lock:
+            self.dropped += 1
+
+    def truncate(self) -> None:
+        with self._lock:
+            self.truncated += 1
+
+
+stats = LogStats()
+
+
+@dataclass(frozen=True)
+class PayloadOptions:
+    """
+    Controls which request and response bodies are logged, when payload logging is enabled.
+    """
+
+    sample_rate: float = 1.0
+    """
+    The fraction of requests whose payloads are logged.
+    """
+
+    max_bytes: int = 16384
+    """
+    Payloads that are bigger than this, once serialized, are replaced by a note of their size.
+    """
+
+    fields: Optional[List[str]] = None
+    """
+    If given, only these fields of each payload (or of each item, if the payload is a list) are
+    logged.
+    """
+
+
+class Payload:
+    """
+    The body of a request or response, which is only parsed, filtered and truncated when the log
+    record it's part of is written, which happens in the background.
+    """
+
+    def __init__(self, raw: bytes, options: PayloadOptions):
+        self.raw = raw
+        self.options = options
+
+    @classmethod
+    def capture(cls, raw: bytes, options: PayloadOptions) -> Any:
+        if not raw:
+            return None
+        if options.fields is None and len(raw) > options.max_bytes:
+            # Don't hold on to big payloads when there's no way they'll fit.
+            stats.truncate()
+            return {"truncated": True, "bytes": len(raw)}
+        return cls(raw, options)
+
+    def _filter(self, value: Any) -> Any:
+        if isinstance(value, list):
+            return [self._filter(v) for v in value]
+        if isinstance(value, dict) and self.options.fields is not None:
+            return {k: v for k, v in value.items() if k in self.options.fields}
+        return value
+
+    def to_json(self) -> Any:
+        try:
+            value = self._filter(json.loads(self.raw))
+        except ValueError:
+            return None
+        if len(json.dumps(value)) > self.options.max_bytes:
+            stats.truncate()
+            return {"truncated": True, "bytes": len(self.raw)}
+        return value
+
+
+def _to_json(value: Any) -> Any:
+    if isinstance(value, Payload):
+        return value.to_json()
+    raise TypeError(f"{type(value).__name__} isn't JSON serializable")
 
 
 class JsonLogFormatter(logging.Formatter):
@@ -48,17 +150,90 @@ class JsonLogFormatter(logging.Formatter):
                     "stack": self.formatStack(r.stack_info),
                 }
             )
-        if isinstance(r.msg, Mapping):
-            return json.dumps({"logname": r.name, "severity": r.levelname, **r.msg})
+        msg = r.msg
+        if is_dataclass(msg):
+            msg = {f.name: getattr(msg, f.name) for f in fields(msg)}
+        if isinstance(msg, Mapping):
+            return json.dumps({"logname": r.name, "severity": r.levelname, **msg}, default=_to_json)
         else:
             m = r.getMessage() % r.__dict__
             return json.dumps({"logname": r.name, "severity": r.levelname, "message": m})
 
 
-def configure_logging(app: Flask, log_payloads: bool = False):
+class _Listener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # Wait for there to be room, rather than failing to stop when the queue is full.
+        self.queue.put(self._sentinel)
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Hands log records to a thread that formats and writes them with the given handler, so that
+    logging doesn't slow down the thread that logs. At most `maxsize` records wait to be written.
+    When the queue is full further records are dropped, and counted in `stats.dropped`.
+    """
+
+    def __init__(self, handler: logging.Handler, maxsize: int = 10000):
+        super().__init__(queue.Queue(maxsize))
+        self.handler = handler
+        self.maxsize = maxsize
+        self._listener: Optional[_Listener] = None
+        self._pid: Optional[int] = None
+        self._start_lock = threading.Lock()
+
+    def _start(self) -> None:
+        # Threads don't survive a fork, so forked worker processes start their own, with a new
+        # queue rather than the copy of the parent's.
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.maxsize)
+            self._listener = _Listener(self.queue, self.handler, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The record is formatted by the listener's thread, rather than the one that logged it.
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            stats.drop()
+
+    def close(self) -> None:
+        # Write the records that are still queued, i.e. when the process exits.
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+        super().close()
+
+
+def configure_logging(
+    app: Flask,
+    log_payloads: bool = False,
+    payload_options: Optional[PayloadOptions] = None,
+) -> LogStats:
     """
     Setup logging in a way that makes sense for demo API endpoints.
+
+    Records are written by a background thread. If `log_payloads` is True, the request and response
+    bodies of a sample of the requests are logged too, as configured by `payload_options`. By
+    default the options are read from the `LOG_PAYLOAD_SAMPLE_RATE`, `LOG_PAYLOAD_MAX_BYTES` and
+    `LOG_PAYLOAD_FIELDS` (a comma separated list) environment variables.
+
+    Returns the counters of dropped records and truncated payloads.
     """
+    if payload_options is None:
+        payload_fields = os.getenv("LOG_PAYLOAD_FIELDS")
+        payload_options = PayloadOptions(
+            sample_rate=float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", 1.0)),
+            max_bytes=int(os.getenv("LOG_PAYLOAD_MAX_BYTES", 16384)),
+            fields=payload_fields.split(",") if payload_fields else None,
+        )
 
     # Reduce chatter from AllenNLP
     logging.getLogger("allennlp").setLevel(logging.WARN)
@@ -66,7 +241,8 @@ def configure_logging(app: Flask, log_payloads: bool = False):
     # Output logs as JSON
     handler = logging.StreamHandler(sys.stdout)
     handler.setFormatter(JsonLogFormatter())
-    logging.basicConfig(level=os.getenv("LOG_LEVEL", logging.INFO), handlers=[handler])
+    background = BackgroundHandler(handler, int(os.getenv("LOG_QUEUE_SIZE", 10000)))
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", logging.INFO), handlers=[background])
 
     # Disable the default request log, as we add our own
     logging.getLogger("werkzeug").setLevel(logging.WARN)
@@ -80,17 +256,28 @@ def configure_logging(app: Flask, log_payloads: bool = False):
     @app.after_request
     def log_request(r: Response) -> Response:
         latency_ms = (time.perf_counter() - g.start) * 1000
+        request_data = response_data = None
+        if log_payloads and random.random() < payload_options.sample_rate:
+            request_data = Payload.capture(request.get_data(), payload_options)
+            # Streamed responses can only be read once, by the client.
+            if r.is_json and not r.is_streamed:
+                response_data = Payload.capture(r.get_data(), payload_options)
         rl = RequestLogEntry(
             r.status_code,
             request.method,
-            request.path,
+            request.script_root + request.path,
             request.args,
-            None if not log_payloads else request.get_json(silent=True),
-            None if not log_payloads else r.get_json(silent=True),
+            request_data,
+            response_data,
             request.remote_addr,
             request.headers.get("X-Forwarded-For"),
             latency_ms,
             r.headers.get("X-Cache-Hit", "0") == "1",
+            r.headers.get("X-Coalesced", "0") == "1",
+            timing.timings(),
+            time.time() - latency_ms / 1000,
         )
-        logging.getLogger("request").info(asdict(rl))
+        logging.getLogger("request").info(rl)
         return r
+
+    return stats
@@ -0,0 +1,259 @@
+import bisect
+import os
+import resource
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from flask import Flask, Response, g, request
+
+from allennlp_demo.common.config import VALID_ATTACKERS, VALID_INTERPRETERS
+
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+"""
+The upper bounds (in seconds) of the buckets of latency histograms.
+"""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """
+    A named metric with zero or more labels, which is rendered in the Prometheus text format.
+
+    The values of a metric are either recorded as things happen, or, if a `callback` is given,
+    read when the metrics are rendered. The callback returns the value for each combination of
+    label values, which is useful for things that are already counted elsewhere (i.e. cache hits).
+    """
+
+    type = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        callback: Optional[Callable[[], Dict[LabelValues, float]]] = None,
+    ):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.callback = callback
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} has labels {self.labels}, not {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labels)
+
+    def samples(self) -> Iterator[Tuple[str, LabelValues, float]]:
+        values = self.callback() if self.callback is not None else dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, key, value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for name, key, value in self.samples():
+            lines.append(f"{name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            counts = {k: list(v) for k, v in self._counts.items()}
+            sums = dict(self._sums)
+        for key in sorted(counts):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts[key]):
+                cumulative += count
+                labels = _format_labels(self.labels + ("le",), key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(sums[key])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    A collection of metrics, which is served by the `/metrics` route that's added by
+    `configure_metrics()`.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"There's already a metric called {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = (), callback=None) -> Counter:
+        return self.register(Counter(name, help, labels, callback))  # type: ignore
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = (), callback=None) -> Gauge:
+        return self.register(Gauge(name, help, labels, callback))  # type: ignore
+
+    def histogram(
+        self, name: str, help: str, labels: Sequence[str] = (), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))  # type: ignore
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def resident_memory_bytes() -> float:
+    """
+    Returns the resident set size of the process. Where `/proc` isn't available the peak resident
+    set size is returned instead.
+    """
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes.
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _target(args: Dict[str, str]) -> str:
+    # The ids come from the URL, so anything but a known interpreter or attacker is reported as
+    # `unknown`. Otherwise each made-up id would add a series.
+    for key, valid in (("interpreter_id", VALID_INTERPRETERS), ("attacker_id", VALID_ATTACKERS)):
+        if key in args:
+            return args[key] if args[key] in valid else "unknown"
+    return ""
+
+
+def configure_metrics(app: Flask, registry: Optional[Registry] = None) -> Registry:
+    """
+    Adds a `/metrics` route that serves the metrics in the registry in the Prometheus text format,
+    and records the latency of each request and the number of requests in progress. The latency
+    histogram is labeled with the route (i.e. `/interpret/<string:interpreter_id>`) and, for
+    routes that have one, the interpreter or attacker.
+
+    Returns the registry, so that the caller can add its own metrics.
+    """
+    registry = registry if registry is not None else Registry()
+    latency = registry.histogram(
+        "allennlp_demo_request_duration_seconds",
+        "How long requests took to handle, in seconds.",
+        ["route", "method", "status", "target"],
+    )
+    in_flight = registry.gauge(
+        "allennlp_demo_requests_in_flight", "The number of requests being handled."
+    )
+    registry.gauge(
+        "allennlp_demo_process_resident_memory_bytes",
+        "The resident memory of the process, in bytes.",
+        callback=lambda: {(): resident_memory_bytes()},
+    )
+    started = time.time()
+    registry.gauge(
+        "allennlp_demo_process_start_time_seconds",
+        "When the process started, in seconds since the epoch.",
+        callback=lambda: {(): started},
+    )
+
+    @app.before_request
+    def start_timer() -> None:
+        g.metrics_start = time.perf_counter()
+        in_flight.inc()
+
+    @app.teardown_request
+    def finish(err: Optional[BaseException]) -> None:
+        if "metrics_start" in g:
+            in_flight.dec()
+
+    @app.after_request
+    def record_latency(r: Response) -> Response:
+        if "metrics_start" not in g:
+            return r
+        # Use the rule rather than the path, so that the number of label values is bounded.
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        latency.observe(
+            time.perf_counter() - g.metrics_start,
+            route=route,
+            method=request.method,
+            status=str(r.status_code),
+            target=_target(request.view_args or {}),
+        )
+        return r
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+    return registry
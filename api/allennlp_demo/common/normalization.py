@@ -0,0 +1,39 @@
+import hashlib
+import json
+from typing import Any
+
+
+def canonical_json(value: Any) -> bytes:
+    """
+    Serializes the value as JSON in a canonical form, with sorted keys and no insignificant
+    whitespace, such that logically identical values always produce the same bytes.
+    """
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+class CacheKey:
+    """
+    Parsed (and normalized) request inputs, paired with a hash of their canonical JSON form.
+
+    Keys compare and hash by the digest alone, so two payloads that only differ in key order or
+    whitespace share a cache entry. They carry the parsed inputs so that a cache miss doesn't
+    have to parse the request body again.
+    """
+
+    __slots__ = ("inputs", "digest")
+
+    def __init__(self, inputs: Any):
+        self.inputs = inputs
+        self.digest = hashlib.sha256(canonical_json(inputs)).hexdigest()
+
+    def __hash__(self) -> int:
+        return hash(self.digest)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, CacheKey) and self.digest == other.digest
+
+    def __str__(self) -> str:
+        return self.digest
+
+    def __repr__(self) -> str:
+        return f"CacheKey({self.digest})"
@@ -0,0 +1,259 @@
+"""
+Makes predictions at a lower precision than the 32 bit floats models are trained with, which is
+a lot cheaper on CPUs for models that spend most of their time in large matrix multiplications,
+like transformers.
+
+- `int8-dynamic` replaces the model's linear layers with ones whose weights are quantized to 8 bit
+  integers, and whose activations are quantized on the fly. The rest of the model is unchanged,
+  and its parameters are shared with the original model.
+- `bf16` runs the model's forward pass under CPU autocast, so that matrix multiplications use
+  bfloat16. The weights are unchanged. This requires a version of torch that supports autocast
+  on CPUs (1.10 or later).
+
+Gradients can't be computed through quantized layers, and are unreliable in bfloat16, so the
+interpreters and attackers always use the original, 32 bit predictor.
+
+To compare the latency, size and outputs of each precision with 32 bit floats, using the
+demos' `warmup_inputs`, run:
+
+    python -m allennlp_demo.common.precision transformer_qa coref --precision int8-dynamic bf16
+"""
+import argparse
+import copy
+import functools
+import itertools
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from allennlp.predictors.predictor import JsonDict, Predictor
+
+
+FP32 = "fp32"
+INT8_DYNAMIC = "int8-dynamic"
+BF16 = "bf16"
+
+
+def _shallow_model_copy(model: torch.nn.Module) -> torch.nn.Module:
+    """
+    Returns a copy of the model that has its own modules, but shares their parameters, buffers and
+    the model's vocabulary with the original.
+    """
+    memo: Dict[int, Any] = {id(t): t for t in itertools.chain(model.parameters(), model.buffers())}
+    vocab = getattr(model, "vocab", None)
+    if vocab is not None:
+        memo[id(vocab)] = vocab
+    return copy.deepcopy(model, memo)
+
+
+def _quantize_dynamic(model: torch.nn.Module) -> torch.nn.Module:
+    quantized = _shallow_model_copy(model)
+    torch.quantization.quantize_dynamic(
+        quantized, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+    return quantized
+
+
+def _autocast_bf16(model: torch.nn.Module) -> torch.nn.Module:
+    if not hasattr(torch, "autocast"):
+        raise RuntimeError(f"bf16 requires torch 1.10 or later, not {torch.__version__}")
+    autocast = copy.copy(model)
+    forward = model.forward
+
+    @functools.wraps(forward)
+    def forward_bf16(*args, **kwargs):
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            outputs = forward(*args, **kwargs)
+        # The outputs are turned into numpy arrays, which can't be bfloat16.
+        if isinstance(outputs, dict):
+            outputs = {
+                k: v.float() if isinstance(v, torch.Tensor) and v.dtype == torch.bfloat16 else v
+                for k, v in outputs.items()
+            }
+        return outputs
+
+    # `forward_on_instances()` calls the copy's `forward()`, whereas the model's is unchanged.
+    autocast.forward = forward_bf16  # type: ignore
+    return autocast
+
+
+def reduce_precision(predictor: Predictor, precision: str) -> Predictor:
+    """
+    Returns a predictor that makes the same predictions as the given one, at the given precision.
+    The given predictor is left as it is, and the two share the dataset reader and whatever
+    parameters aren't replaced. With `fp32` the predictor itself is returned.
+    """
+    if precision == FP32:
+        return predictor
+    if precision == INT8_DYNAMIC:
+        model = _quantize_dynamic(predictor._model)
+    elif precision == BF16:
+        model = _autocast_bf16(predictor._model)
+    else:
+        raise ValueError(f"invalid precision {precision}")
+    reduced = copy.copy(predictor)
+    reduced._model = model
+    return reduced
+
+
+def model_bytes(*models: torch.nn.Module) -> int:
+    """
+    Returns the size of the state of the given models, in bytes. Tensors that several of them
+    share are only counted once. Unlike the models' parameters, their state includes the weights
+    of quantized layers.
+    """
+    tensors: Dict[Tuple[int, torch.dtype], int] = {}
+
+    def add(value: Any) -> None:
+        if isinstance(value, torch.Tensor):
+            tensors[(value.data_ptr(), value.dtype)] = value.numel() * value.element_size()
+        elif isinstance(value, (tuple, list)):
+            for v in value:
+                add(v)
+
+    for model in models:
+        for value in model.state_dict(keep_vars=True).values():
+            add(value)
+    return sum(tensors.values())
+
+
+def _numbers_differ(expected: Any, actual: Any) -> Optional[float]:
+    """
+    Returns the largest absolute difference between the numbers in the two outputs, or `None` if
+    anything other than the numbers differs, i.e. a label or a span.
+    """
+    if isinstance(expected, bool) or isinstance(actual, bool):
+        return 0.0 if expected == actual else None
+    if isinstance(expected, (int, float)) and isinstance(actual, (int, float)):
+        if isinstance(expected, int) and isinstance(actual, int):
+            # Integers are indices, like the start of a span, rather than scores.
+            return 0.0 if expected == actual else None
+        return abs(float(expected) - float(actual))
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        if expected.keys() != actual.keys():
+            return None
+        pairs = [(expected[k], actual[k]) for k in expected]
+    elif isinstance(expected, list) and isinstance(actual, list):
+        if len(expected) != len(actual):
+            return None
+        pairs = list(zip(expected, actual))
+    else:
+        return 0.0 if expected == actual else None
+    largest = 0.0
+    for e, a in pairs:
+        diff = _numbers_differ(e, a)
+        if diff is None:
+            return None
+        largest = max(largest, diff)
+    return largest
+
+
+def compare(expected: List[JsonDict], actual: List[JsonDict]) -> Dict[str, Any]:
+    """
+    Compares the outputs of a predictor at a reduced precision with those at 32 bits. Outputs
+    agree if everything but their scores (i.e. their labels, spans and clusters) is the same.
+    """
+    diffs = [_numbers_differ(e, a) for e, a in zip(expected, actual)]
+    agreed = [d for d in diffs if d is not None]
+    return {
+        "agreement": len(agreed) / len(diffs) if diffs else 1.0,
+        "max_abs_diff": max(agreed, default=0.0),
+    }
+
+
+def _time_predictions(predictor: Predictor, inputs: List[JsonDict], repeat: int) -> List[float]:
+    latencies = []
+    for _ in range(repeat):
+        for i in inputs:
+            start = time.perf_counter()
+            predictor.predict_json(copy.deepcopy(i))
+            latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def evaluate(name: str, precisions: List[str], repeat: int = 5) -> List[Dict[str, Any]]:
+    """
+    Loads the model of the demo with the given name and runs its warm-up inputs through it at
+    32 bits and at each of the `precisions`. Returns the median latency, the size of the model
+    and how well its outputs agree with those at 32 bits, for each precision. Precisions that
+    can't be used have an `error` instead.
+    """
+    from allennlp_demo.common.host import demo_inputs
+
+    model, inputs = demo_inputs(name)
+    predictor = model.load_predictor()
+    fp32_bytes = model_bytes(predictor._model)
+    expected = [predictor.predict_json(copy.deepcopy(i)) for i in inputs]
+
+    rows: List[Dict[str, Any]] = []
+    baseline: Optional[float] = None
+    for precision in [FP32] + [p for p in precisions if p != FP32]:
+        try:
+            reduced = reduce_precision(predictor, precision)
+        except RuntimeError as err:
+            rows.append({"demo": name, "precision": precision, "error": str(err)})
+            continue
+        # The first predictions are slow, because of lazy initialization, so they aren't timed.
+        outputs = [reduced.predict_json(copy.deepcopy(i)) for i in inputs]
+        latency = statistics.median(_time_predictions(reduced, inputs, repeat))
+        if baseline is None:
+            baseline = latency
+        rows.append(
+            {
+                "demo": name,
+                "precision": precision,
+                "latency_ms": latency,
+                "speedup": baseline / latency,
+                "model_mb": model_bytes(reduced._model) / 2**20,
+                "extra_mb": (model_bytes(predictor._model, reduced._model) - fp32_bytes) / 2**20,
+                **compare(expected, outputs),
+            }
+        )
+    return rows
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    from allennlp_demo.common.config import VALID_PRECISIONS
+
+    parser = argparse.ArgumentParser(
+        description="Compares the latency, size and outputs of models at reduced precisions."
+    )
+    parser.add_argument("demos", nargs="+", help="the names of the demos to evaluate, i.e. bidaf")
+    parser.add_argument(
+        "--precision",
+        nargs="+",
+        choices=VALID_PRECISIONS,
+        default=[INT8_DYNAMIC, BF16],
+        help="the precisions to compare with fp32",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="how many times to time each input")
+    parsed = parser.parse_args(args)
+
+    columns = [
+        ("demo", "{}"),
+        ("precision", "{}"),
+        ("latency_ms", "{:.1f}"),
+        ("speedup", "{:.2f}x"),
+        ("model_mb", "{:.1f}"),
+        ("extra_mb", "{:.1f}"),
+        ("agreement", "{:.0%}"),
+        ("max_abs_diff", "{:.2g}"),
+    ]
+    print("\t".join(column for column, _ in columns))
+    for name in parsed.demos:
+        try:
+            rows = evaluate(name, parsed.precision, parsed.repeat)
+        except Exception as err:
+            print(f"{name}\tfailed: {err}", file=sys.stderr)
+            continue
+        for row in rows:
+            if "error" in row:
+                print(f"{row['demo']}\t{row['precision']}\t{row['error']}", flush=True)
+            else:
+                print("\t".join(fmt.format(row[c]) for c, fmt in columns), flush=True)
+
+
+if __name__ == "__main__":
+    main()
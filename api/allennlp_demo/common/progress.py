@@ -0,0 +1,35 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, List, Optional
+
+from allennlp.common.util import JsonDict, sanitize
+from allennlp.data import Token
+
+
+Listener = Callable[[JsonDict], None]
+
+_listener: ContextVar[Optional[Listener]] = ContextVar("progress_listener", default=None)
+
+
+@contextmanager
+def listen(listener: Listener) -> Iterator[None]:
+    """
+    Calls `listener` with each step that's reported by the attackers in
+    `allennlp_demo.common.attackers` within the context.
+    """
+    token = _listener.set(listener)
+    try:
+        yield
+    finally:
+        _listener.reset(token)
+
+
+def report_step(tokens: List[Token], outputs: JsonDict) -> None:
+    """
+    Reports an intermediate step of an attack, i.e. the tokens after a token was flipped or
+    removed, and the model's outputs for them. Nothing is done unless someone is listening.
+    """
+    listener = _listener.get()
+    if listener is None:
+        return
+    listener({"tokens": [str(t) for t in tokens], "outputs": sanitize(outputs)})
@@ -0,0 +1,164 @@
+import array
+import json
+import struct
+import sys
+from typing import Any, List
+
+from flask import Request, Response
+
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+
+MSGPACK_FLOAT_ARRAY = 1
+"""
+The MessagePack extension type of packed float arrays. The data is the array's length, as an
+unsigned 32 bit integer, followed by that many 64 bit floats, all little-endian.
+"""
+
+MIN_PACKED_FLOATS = 16
+"""
+Lists of floats shorter than this are encoded as regular MessagePack arrays.
+"""
+
+
+def _default(value: Any) -> Any:
+    # numpy arrays and scalars, and torch tensors, can all be converted to Python values.
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} isn't JSON serializable")
+
+
+_orjson: Any = None
+
+
+def _load_orjson() -> Any:
+    global _orjson
+    if _orjson is None:
+        try:
+            import orjson
+
+            _orjson = orjson
+        except ImportError:
+            _orjson = False
+    return _orjson
+
+
+def dumps_json(value: Any) -> bytes:
+    """
+    Serializes the value as JSON. numpy arrays and scalars and torch tensors are serialized like
+    the equivalent lists and numbers. `orjson` is used if it's installed, as it's a lot faster for
+    the long lists of floats in gradients, logits and the like.
+    """
+    orjson = _load_orjson()
+    if orjson:
+        return orjson.dumps(
+            value,
+            default=_default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+        )
+    return json.dumps(value, default=_default).encode()
+
+
+def loads_json(raw: bytes) -> Any:
+    orjson = _load_orjson()
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+
+_msgpack: Any = None
+
+
+def _load_msgpack() -> Any:
+    global _msgpack
+    if _msgpack is None:
+        try:
+            import msgpack
+
+            _msgpack = msgpack
+        except ImportError:
+            _msgpack = False
+    return _msgpack
+
+
+def _pack_floats(values: List[float]) -> Any:
+    packed = array.array("d", values)
+    if sys.byteorder != "little":
+        packed.byteswap()
+    return _load_msgpack().ExtType(
+        MSGPACK_FLOAT_ARRAY, struct.pack("<I", len(values)) + packed.tobytes()
+    )
+
+
+def _msgpack_default(value: Any) -> Any:
+    if hasattr(value, "tolist"):
+        return _with_packed_floats(value.tolist())
+    raise TypeError(f"{type(value).__name__} can't be serialized as MessagePack")
+
+
+def _with_packed_floats(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: _with_packed_floats(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        if len(value) >= MIN_PACKED_FLOATS and all(type(v) is float for v in value):
+            return _pack_floats(value)  # type: ignore
+        return [_with_packed_floats(v) for v in value]
+    return value
+
+
+def dumps_msgpack(value: Any) -> bytes:
+    """
+    Serializes the value as MessagePack. Long lists of floats are packed into a single extension
+    value (see `MSGPACK_FLOAT_ARRAY`), which is a lot smaller and faster to decode than an array
+    of individual floats. This requires the `msgpack` package.
+    """
+    msgpack = _load_msgpack()
+    if not msgpack:
+        raise RuntimeError("Serializing MessagePack requires the msgpack package")
+    return msgpack.packb(_with_packed_floats(value), default=_msgpack_default)
+
+
+class Serialized:
+    """
+    A value along with its JSON serialization, which is what the caches store. Cache hits are
+    returned as-is, without being parsed and serialized again. The value is only parsed if it's
+    needed, i.e. for a response in another format.
+    """
+
+    def __init__(self, raw: bytes, value: Any = None, parsed: bool = False):
+        self.raw = raw
+        self._value = value
+        self._parsed = parsed
+
+    @classmethod
+    def of(cls, value: Any) -> "Serialized":
+        return cls(dumps_json(value), value, parsed=True)
+
+    @property
+    def value(self) -> Any:
+        if not self._parsed:
+            self._value = loads_json(self.raw)
+            self._parsed = True
+        return self._value
+
+
+def negotiate(request: Request) -> str:
+    """
+    Returns the format of the response to the request, based on its `Accept` header. MessagePack
+    is only offered if the `msgpack` package is installed.
+    """
+    offered = [JSON, MSGPACK, "application/x-msgpack"] if _load_msgpack() else [JSON]
+    best = request.accept_mimetypes.best_match(offered, default=JSON)
+    return MSGPACK if best in (MSGPACK, "application/x-msgpack") else JSON
+
+
+def serialize(value: Any, mimetype: str = JSON) -> Response:
+    """
+    Returns a response with the value in the given format. The value may be `Serialized`, in
+    which case a JSON response uses its serialization as-is.
+    """
+    if mimetype == MSGPACK:
+        if isinstance(value, Serialized):
+            value = value.value
+        return Response(dumps_msgpack(value), mimetype=MSGPACK)
+    raw = value.raw if isinstance(value, Serialized) else dumps_json(value)
+    return Response(raw, mimetype=JSON)
@@ -0,0 +1,210 @@
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+from werkzeug.serving import make_server
+
+if TYPE_CHECKING:
+    from allennlp_demo.common import config
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ServerOptions:
+    """
+    Options for the production server. They come from the model's `model.json` and can be
+    overridden with environment variables of the same name, in upper case (i.e. `WORKERS`).
+    """
+
+    workers: int = 1
+    torch_threads: Optional[int] = None
+    torch_interop_threads: Optional[int] = None
+    pin_workers: bool = False
+
+    @classmethod
+    def from_model(cls, model: "config.Model") -> "ServerOptions":
+        def env(name: str, default):
+            value = os.getenv(name.upper())
+            if value is None or value == "":
+                return default
+            if isinstance(default, bool):
+                return value.lower() in ("1", "true", "yes")
+            return int(value)
+
+        return cls(
+            workers=env("workers", model.workers),
+            torch_threads=env("torch_threads", model.torch_threads),
+            torch_interop_threads=env("torch_interop_threads", model.torch_interop_threads),
+            pin_workers=env("pin_workers", model.pin_workers),
+        )
+
+
+def worker_cpus(worker: int, workers: int) -> List[int]:
+    """
+    Splits the CPUs this process may run on into `workers` contiguous groups, and returns the
+    group for the given worker.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    if len(cpus) < workers:
+        # There aren't enough to go around, so the workers share all of them.
+        return cpus
+    per_worker = len(cpus) // workers
+    return cpus[worker * per_worker : (worker + 1) * per_worker]
+
+
+def configure_worker(worker: int, options: ServerOptions) -> None:
+    """
+    Restricts a worker to its share of the CPUs, and configures the number of threads torch uses
+    accordingly.
+    """
+    cpus = worker_cpus(worker, options.workers)
+    if options.pin_workers and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+    torch_threads = options.torch_threads or len(cpus)
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(torch_threads)
+    if options.torch_interop_threads is not None:
+        try:
+            torch.set_num_interop_threads(options.torch_interop_threads)
+        except RuntimeError as err:
+            # This can only be set before any inter-op parallel work happens.
+            logger.warning(f"Unable to set the number of inter-op threads: {err}")
+    logger.info(f"Worker {worker} started with {torch_threads} torch threads on CPUs {cpus}")
+
+
+def limit_threads_before_fork() -> None:
+    """
+    Makes torch use a single thread in the main process, which the workers are forked from.
+
+    torch's thread pools don't survive a fork, and a worker that's forked after they were used
+    can deadlock the first time it runs an operation in parallel. So the model is loaded and
+    warmed up without them, and each worker sets up its own (see `configure_worker()`).
+    """
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(1)
+
+
+def serve_prefork(
+    app: Callable,
+    host: str,
+    port: int,
+    options: ServerOptions,
+    on_worker_start: Optional[Callable[[int], None]] = None,
+    before_fork: Optional[Callable[[], None]] = None,
+) -> None:
+    """
+    Serves the WSGI app with `options.workers` forked worker processes that accept connections
+    from a socket that's shared between them. Workers that exit unexpectedly are replaced.
+
+    Everything that's loaded before this is called, most importantly the model's weights, is
+    shared by the workers copy-on-write, rather than each worker having its own copy.
+
+    If `before_fork` is given the socket is bound first and the main process serves requests
+    (i.e. health checks) by itself until `before_fork` returns, after which the workers take over.
+    This is how the workers are made to wait for a model that's loaded in the background. The
+    requests the main process is handling at that point are finished before the workers are
+    forked, and `before_fork` should wait for any other threads that use the model to exit, since
+    a worker that's forked while another thread holds a lock would never see it released. See
+    `limit_threads_before_fork()` too.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+
+    if before_fork is not None:
+        server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+        # Keep track of the threads that handle requests, so that they can be waited for.
+        server.daemon_threads = False
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            before_fork()
+        finally:
+            server.shutdown()
+            thread.join()
+            # This waits for the requests that are still being handled, and closes the server's
+            # copy of the socket.
+            server.server_close()
+
+    # Move everything that exists now out of the garbage collector's view. Otherwise the
+    # collector touches every object in each worker, which copies the memory it lives in.
+    gc.freeze()
+
+    children: Dict[int, int] = {}
+    stopping = False
+
+    def spawn(worker: int) -> None:
+        pid = os.fork()
+        if pid != 0:
+            children[pid] = worker
+            return
+        code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            configure_worker(worker, options)
+            if on_worker_start is not None:
+                on_worker_start(worker)
+            server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+            server.serve_forever()
+        except BaseException:
+            logger.exception(f"Worker {worker} crashed")
+            code = 1
+        finally:
+            # Logs are written by a background thread, so let it catch up before exiting.
+            logging.shutdown()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    logger.info(f"Serving on {host}:{port} with {options.workers} workers")
+    for worker in range(options.workers):
+        spawn(worker)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        worker = children.pop(pid, None)
+        if worker is None:
+            continue
+        if not stopping:
+            logger.warning(f"Worker {worker} (pid {pid}) exited with status {status}, restarting")
+            # Don't spin if workers crash right away.
+            time.sleep(1)
+            spawn(worker)
+    sock.close()
@@ -0,0 +1,51 @@
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlight:
+    """
+    Makes sure that only one call for a given key is in progress at a time. Callers that ask for
+    a key while it's being computed wait for that computation, and share its result (or its
+    exception), rather than doing the same work again.
+
+    It's safe to use from several threads at once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Returns the result of calling `fn`, or of the call that's already in progress for the
+        `key`, and whether it was the latter.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = Future()
+                self._calls[key] = call
+
+        if not leader:
+            return call.result(), True
+
+        try:
+            result = fn()
+        except BaseException as err:
+            call.set_exception(err)
+            raise
+        else:
+            call.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def __len__(self) -> int:
+        """
+        Returns the number of calls in progress.
+        """
+        with self._lock:
+            return len(self._calls)
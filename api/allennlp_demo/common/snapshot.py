@@ -0,0 +1,298 @@
+"""
+Prepared, local copies of a model archive that load faster than the archive itself.
+
+Loading an archive means extracting a `.tar.gz` file to a temporary directory, reading the
+vocabulary line by line from one text file per namespace and unpickling `weights.th` into memory,
+only to copy each tensor into a model that was just randomly initialized. A snapshot stores:
+
+- `config.json`, the archive's configuration with its overrides already applied.
+- `vocabulary.json`, all of the vocabulary's namespaces in a single file.
+- `weights/`, a `.npy` file per tensor of the model's state, and an `index.json` that maps the
+  names in the state dict to them. numpy doesn't have bfloat16, so those tensors are stored as
+  16 bit integers, and their entry in the index records the dtype. The files are memory-mapped,
+  and the model's parameters point at the mapped memory rather than at a copy of it. That means
+  they're only read from disk as they're used, and are shared with every other process that
+  maps the same file.
+- Any other files that came with the archive, as some dataset readers and models refer to them.
+
+Snapshots are stored in a directory named after the model's fingerprint, so a snapshot of an
+older version of a model is never loaded. To create one, run:
+
+    python -m allennlp_demo.common.snapshot allennlp_demo/coref/model.json /snapshots
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from allennlp.predictors import Predictor
+
+if TYPE_CHECKING:
+    from allennlp_demo.common import config
+
+
+logger = logging.getLogger(__name__)
+
+CONFIG_NAME = "config.json"
+VOCABULARY_NAME = "vocabulary.json"
+WEIGHTS_DIR = "weights"
+WEIGHTS_INDEX_NAME = "index.json"
+
+# Token embedders (and poolers) that load pretrained weights from the Hugging Face hub when
+# they're constructed. The weights in a snapshot replace them anyway, so they're not loaded.
+_PRETRAINED_TRANSFORMERS = {"pretrained_transformer", "pretrained_transformer_mismatched"}
+
+
+def snapshot_path(model: "config.Model") -> Optional[str]:
+    """
+    Returns where the snapshot of the model is (or would be) stored, or `None` if the model
+    isn't configured to use snapshots.
+    """
+    root = os.getenv("MODEL_SNAPSHOT_DIR", model.snapshot_dir)
+    if not root:
+        return None
+    return os.path.join(root, model.fingerprint())
+
+
+def find_snapshot(model: "config.Model") -> Optional[str]:
+    """
+    Returns the path to the model's snapshot, if there is one.
+    """
+    path = snapshot_path(model)
+    if path is None or not os.path.isfile(os.path.join(path, WEIGHTS_DIR, WEIGHTS_INDEX_NAME)):
+        return None
+    return path
+
+
+def _skip_pretrained_weights(params: Any, in_token_embedders: bool = False) -> None:
+    if isinstance(params, dict):
+        kind = params.get("type")
+        if (in_token_embedders and kind in _PRETRAINED_TRANSFORMERS) or kind == "bert_pooler":
+            params["load_weights"] = False
+        for key, value in params.items():
+            _skip_pretrained_weights(value, in_token_embedders or key == "token_embedders")
+    elif isinstance(params, list):
+        for value in params:
+            _skip_pretrained_weights(value, in_token_embedders)
+
+
+def _write_vocabulary(vocab, path: str) -> None:
+    namespaces: Dict[str, List[str]] = {}
+    for namespace, mapping in vocab._index_to_token.items():
+        namespaces[namespace] = [mapping[i] for i in range(len(mapping))]
+    with open(path, "w") as fh:
+        json.dump(
+            {
+                "padding_token": vocab._padding_token,
+                "oov_token": vocab._oov_token,
+                "non_padded_namespaces": sorted(vocab._non_padded_namespaces),
+                "namespaces": namespaces,
+            },
+            fh,
+            ensure_ascii=False,
+        )
+
+
+def _read_vocabulary(path: str):
+    from allennlp.data import Vocabulary
+
+    with open(path) as fh:
+        raw = json.load(fh)
+    vocab = Vocabulary(
+        non_padded_namespaces=raw["non_padded_namespaces"],
+        padding_token=raw["padding_token"],
+        oov_token=raw["oov_token"],
+    )
+    for namespace, tokens in raw["namespaces"].items():
+        vocab._index_to_token[namespace] = dict(enumerate(tokens))
+        vocab._token_to_index[namespace] = {token: i for i, token in enumerate(tokens)}
+    return vocab
+
+
+def _write_weights(model, path: str) -> None:
+    import numpy
+    import torch
+
+    os.makedirs(path)
+    index: Dict[str, Any] = {}
+    # Tied weights (i.e. a language model's input and output embeddings) are stored once.
+    entries_by_tensor: Dict[Any, Any] = {}
+    for name, tensor in model.state_dict().items():
+        tensor = tensor.detach().cpu()
+        identity = (tensor.data_ptr(), tuple(tensor.shape), tuple(tensor.stride()), tensor.dtype)
+        entry = entries_by_tensor.get(identity)
+        if entry is None:
+            entry = f"{len(entries_by_tensor)}.npy"
+            tensor = tensor.contiguous()
+            if tensor.dtype == torch.bfloat16:
+                # numpy doesn't have bfloat16, so the bits are stored as 16 bit integers, and
+                # the index records the dtype they're viewed as when they're read.
+                numpy.save(os.path.join(path, entry), tensor.view(torch.int16).numpy())
+                entry = {"file": entry, "dtype": "bfloat16"}
+            else:
+                numpy.save(os.path.join(path, entry), tensor.numpy())
+            entries_by_tensor[identity] = entry
+        index[name] = entry
+    with open(os.path.join(path, WEIGHTS_INDEX_NAME), "w") as fh:
+        json.dump(index, fh)
+
+
+def _read_weights(model, path: str) -> None:
+    import numpy
+    import torch
+
+    with open(os.path.join(path, WEIGHTS_INDEX_NAME)) as fh:
+        index: Dict[str, Any] = json.load(fh)
+
+    state = model.state_dict(keep_vars=True)
+    missing = set(state) - set(index)
+    unexpected = set(index) - set(state)
+    if missing or unexpected:
+        raise RuntimeError(
+            f"Error loading snapshot for {model.__class__.__name__}\n\t"
+            f"Missing keys: {sorted(missing)}\n\t"
+            f"Unexpected keys: {sorted(unexpected)}"
+        )
+
+    tensors: Dict[str, torch.Tensor] = {}
+    with torch.no_grad():
+        for name, entry in index.items():
+            if isinstance(entry, str):
+                filename, dtype = entry, None
+            else:
+                filename, dtype = entry["file"], entry["dtype"]
+            if filename not in tensors:
+                # Copy-on-write, so that the (rare) in-place update of a parameter doesn't
+                # modify the snapshot.
+                tensors[filename] = torch.from_numpy(
+                    numpy.load(os.path.join(path, filename), mmap_mode="c")
+                )
+                if dtype is not None:
+                    tensors[filename] = tensors[filename].view(getattr(torch, dtype))
+            tensor = tensors[filename]
+            target = state[name]
+            if target.shape == tensor.shape and target.dtype == tensor.dtype:
+                target.data = tensor
+            else:
+                target.copy_(tensor)
+
+
+def create_snapshot(model: "config.Model", path: Optional[str] = None) -> str:
+    """
+    Loads the model's archive and writes a snapshot of it to `path`, which defaults to
+    `snapshot_path(model)`. Returns where the snapshot was written.
+
+    The snapshot is written to a temporary directory first and then moved into place, so that
+    a process loading the model never sees one that's partially written.
+    """
+    from allennlp.models.archival import extracted_archive, get_weights_path, load_archive
+    from allennlp.common.file_utils import cached_path
+
+    if path is None:
+        path = snapshot_path(model)
+    if path is None:
+        raise ValueError(f"No snapshot directory is configured for {model.id}")
+
+    overrides: Any = model.overrides
+    if model.use_old_load_method and overrides is not None:
+        overrides = json.dumps(overrides)
+    archive = load_archive(model.archive_file, overrides=overrides or "")
+
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix=".snapshot-")
+    try:
+        # Start with everything in the archive, except for what the snapshot replaces.
+        resolved = cached_path(model.archive_file)
+        if os.path.isdir(resolved):
+            shutil.copytree(resolved, tmp, dirs_exist_ok=True)
+        else:
+            with extracted_archive(resolved) as extracted:
+                shutil.copytree(extracted, tmp, dirs_exist_ok=True)
+        os.remove(get_weights_path(tmp))
+        shutil.rmtree(os.path.join(tmp, "vocabulary"), ignore_errors=True)
+
+        params = archive.config.as_dict(quiet=True)
+        _skip_pretrained_weights(params.get("model"))
+        with open(os.path.join(tmp, CONFIG_NAME), "w") as fh:
+            json.dump(params, fh, indent=2)
+        _write_vocabulary(archive.model.vocab, os.path.join(tmp, VOCABULARY_NAME))
+        _write_weights(archive.model, os.path.join(tmp, WEIGHTS_DIR))
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp, path)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    logger.info(f"Wrote a snapshot of {model.id} to {path}")
+    return path
+
+
+def load_predictor(path: str, predictor_name: Optional[str] = None) -> Predictor:
+    """
+    Loads a predictor from the snapshot at `path`.
+    """
+    from allennlp.common.params import Params, remove_keys_from_params
+    from allennlp.data import DatasetReader
+    from allennlp.models import Model
+    from allennlp.models.archival import Archive
+
+    params = Params.from_file(os.path.join(path, CONFIG_NAME))
+
+    # Like `load_archive()`, use the validation dataset reader if there is one.
+    reader_params = params.get("dataset_reader")
+    validation_reader_params = params.get("validation_dataset_reader", reader_params.duplicate())
+    dataset_reader = DatasetReader.from_params(reader_params.duplicate(), serialization_dir=path)
+    validation_dataset_reader = DatasetReader.from_params(
+        validation_reader_params.duplicate(), serialization_dir=path
+    )
+
+    vocab = _read_vocabulary(os.path.join(path, VOCABULARY_NAME))
+    model_params = params.duplicate().get("model")
+    remove_keys_from_params(model_params)
+    model = Model.from_params(vocab=vocab, params=model_params, serialization_dir=path)
+    model.cpu()
+    model.extend_embedder_vocab()
+    _read_weights(model, os.path.join(path, WEIGHTS_DIR))
+
+    archive = Archive(
+        model=model,
+        config=params,
+        dataset_reader=dataset_reader,
+        validation_dataset_reader=validation_dataset_reader,
+        meta=None,
+    )
+    return Predictor.from_archive(archive, predictor_name)
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Writes a fast-loading snapshot of a model.")
+    parser.add_argument("model_json", help="the path to the model's model.json file")
+    parser.add_argument("snapshot_dir", help="the directory snapshots are stored in")
+    parser.add_argument(
+        "--include-package",
+        action="append",
+        default=[],
+        help="additional packages to import, for models that aren't part of allennlp_models",
+    )
+    parsed = parser.parse_args(args)
+
+    from allennlp.common.util import import_module_and_submodules
+    from allennlp_demo.common import config
+
+    for package in parsed.include_package:
+        import_module_and_submodules(package)
+
+    model = config.Model.from_file(parsed.model_json)
+    path = os.path.join(parsed.snapshot_dir, model.fingerprint())
+    print(create_snapshot(model, path))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
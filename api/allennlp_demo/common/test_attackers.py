@@ -0,0 +1,80 @@
+import os
+
+import torch
+from allennlp.data import Vocabulary
+from allennlp.data.dataset_readers import TextClassificationJsonReader
+from allennlp.data.token_indexers import SingleIdTokenIndexer, TokenCharactersIndexer
+from allennlp.models import BasicClassifier
+from allennlp.modules.seq2vec_encoders import BagOfEmbeddingsEncoder, CnnEncoder
+from allennlp.modules.text_field_embedders import BasicTextFieldEmbedder
+from allennlp.modules.token_embedders import Embedding, TokenCharactersEncoder
+from allennlp.predictors import TextClassifierPredictor
+
+from allennlp_demo.common import attackers
+from allennlp_demo.common.attackers import LazyHotflip
+
+
+def char_cnn_predictor() -> TextClassifierPredictor:
+    """
+    A tiny classifier that embeds tokens with both an embedding matrix and a character-level
+    CNN, so that Hotflip has to run its embedder to build an embedding matrix.
+    """
+    vocab = Vocabulary()
+    vocab.add_tokens_to_namespace(["the", "cat", "sat", "."], "tokens")
+    vocab.add_tokens_to_namespace(list("thecasa."), "token_characters")
+    vocab.add_tokens_to_namespace(["positive", "negative"], "labels")
+
+    reader = TextClassificationJsonReader(
+        token_indexers={
+            "tokens": SingleIdTokenIndexer(),
+            "token_characters": TokenCharactersIndexer(min_padding_length=2),
+        }
+    )
+    embedder = BasicTextFieldEmbedder(
+        {
+            "tokens": Embedding(embedding_dim=4, vocab=vocab),
+            "token_characters": TokenCharactersEncoder(
+                Embedding(embedding_dim=3, vocab=vocab, vocab_namespace="token_characters"),
+                CnnEncoder(embedding_dim=3, num_filters=2, ngram_filter_sizes=(2,)),
+            ),
+        }
+    )
+    model = BasicClassifier(vocab, embedder, BagOfEmbeddingsEncoder(embedding_dim=6))
+    model.eval()
+    return TextClassifierPredictor(model, reader)
+
+
+def test_hotflip_is_initialized_lazily_and_saved(tmp_path):
+    predictor = char_cnn_predictor()
+    hotflip = LazyHotflip(predictor, cache_dir=str(tmp_path))
+    assert hotflip.embedding_matrix is None
+
+    hotflip.initialize()
+    assert hotflip.embedding_matrix is not None
+    assert not hotflip.embedding_matrix.requires_grad
+    assert os.listdir(tmp_path) == ["hotflip-tokens-5000-embeddings.npy"]
+
+    # Another process with the same model reads the matrix, rather than computing it again.
+    reloaded = LazyHotflip(predictor, cache_dir=str(tmp_path))
+    reloaded.initialize()
+    assert torch.allclose(reloaded.embedding_matrix, hotflip.embedding_matrix)
+    assert reloaded.embedding_layer is hotflip.embedding_layer
+    assert reloaded.invalid_replacement_indices == hotflip.invalid_replacement_indices
+
+
+def test_hotflip_cleans_up_when_the_matrix_cant_be_saved(tmp_path, monkeypatch):
+    def fail_partway(fh, array):
+        fh.write(b"\x93NUMPY")
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(attackers.numpy, "save", fail_partway)
+    hotflip = LazyHotflip(char_cnn_predictor(), cache_dir=str(tmp_path))
+    hotflip.initialize()
+    assert hotflip.embedding_matrix is not None
+    assert os.listdir(tmp_path) == []
+
+
+def test_hotflip_without_a_cache_dir():
+    hotflip = LazyHotflip(char_cnn_predictor())
+    hotflip.initialize()
+    assert hotflip.embedding_matrix.shape == (6, 6)
@@ -0,0 +1,53 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import pytest
+
+from allennlp_demo.common.batching import MicroBatcher
+
+
+def test_concurrent_items_are_batched_and_results_returned_in_order():
+    batch_sizes: List[int] = []
+
+    def double(items: List[int]) -> List[int]:
+        batch_sizes.append(len(items))
+        return [i * 2 for i in items]
+
+    batcher = MicroBatcher(double, max_batch_size=4, max_wait_ms=200)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(batcher.submit, range(8)))
+
+    assert results == [i * 2 for i in range(8)]
+    assert sum(batch_sizes) == 8
+    assert max(batch_sizes) <= 4
+    assert len(batch_sizes) < 8
+
+
+def test_a_bad_item_only_fails_its_own_request():
+    barrier = threading.Barrier(3)
+
+    def invert(items: List[int]) -> List[float]:
+        return [1 / i for i in items]
+
+    batcher = MicroBatcher(invert, max_batch_size=3, max_wait_ms=200)
+
+    def submit(i: int) -> float:
+        barrier.wait()
+        return batcher.submit(i)
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [pool.submit(submit, i) for i in [1, 0, 2]]
+
+    assert futures[0].result() == 1
+    with pytest.raises(ZeroDivisionError):
+        futures[1].result()
+    assert futures[2].result() == 0.5
+
+
+def test_close_stops_the_thread():
+    batcher = MicroBatcher(lambda items: items, max_batch_size=4, max_wait_ms=0)
+    assert batcher.submit(1) == 1
+    batcher.close()
+    batcher._thread.join(timeout=5)
+    assert not batcher._thread.is_alive()
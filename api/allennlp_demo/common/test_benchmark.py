@@ -0,0 +1,132 @@
+import json
+import math
+import threading
+import time
+
+import pytest
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+from allennlp_demo.common.benchmark import (
+    HttpTarget,
+    InProcessTarget,
+    Operation,
+    Workload,
+    regressions,
+    run,
+    summarize,
+)
+from allennlp_demo.common.benchmark.report import percentile
+
+
+def make_app(delay_s: float = 0.0) -> Flask:
+    app = Flask("benchmarked")
+    seen = set()
+    lock = threading.Lock()
+
+    @app.route("/predict", methods=["POST"])
+    def predict():
+        time.sleep(delay_s)
+        key = json.dumps(request.get_json(), sort_keys=True)
+        with lock:
+            hit = key in seen and "no_cache" not in request.args
+            seen.add(key)
+        resp = jsonify({"ok": True})
+        if hit:
+            resp.headers["X-Cache-Hit"] = "1"
+        return resp
+
+    @app.route("/fail", methods=["POST"])
+    def fail():
+        return jsonify({"error": "nope"}), 500
+
+    return app
+
+
+def test_percentile():
+    values = [float(v) for v in range(1, 101)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([3.0], 99) == 3
+    assert math.isnan(percentile([], 50))
+
+
+def test_workload_is_repeatable(tmp_path):
+    workload = Workload(
+        [Operation("predict", "/predict", {"x": 1}, 3), Operation("fail", "/fail", {}, 1)],
+        cold_fraction=0.25,
+        seed=7,
+    )
+    path = tmp_path / "workload.json"
+    path.write_text(json.dumps(workload.to_json()))
+    copy = Workload.from_file(str(path))
+
+    first = [workload.next() for _ in range(100)]
+    assert first == [copy.next() for _ in range(100)]
+    assert 60 <= sum(op.name == "predict" for op, _ in first) <= 90
+    assert 10 <= sum(no_cache for _, no_cache in first) <= 40
+
+
+def test_run_splits_cold_and_warm_requests():
+    workload = Workload(
+        [Operation("predict", "/predict", {"x": 1}, 4), Operation("fail", "/fail", {}, 1)],
+        cold_fraction=0.5,
+    )
+    result = run(InProcessTarget(make_app()), workload, requests=200, concurrency=4)
+    assert len(result.samples) == 200
+
+    summary = summarize(result)
+    assert summary["all"]["all"]["requests"] == 200
+    predict = summary["predict"]
+    assert predict["all"]["errors"] == 0
+    assert predict["cold"]["requests"] + predict["warm"]["requests"] == predict["all"]["requests"]
+    assert predict["cold"]["requests"] > 0 and predict["warm"]["requests"] > 0
+    assert summary["fail"]["all"]["errors"] == summary["fail"]["all"]["requests"] > 0
+    assert math.isnan(summary["fail"]["all"]["p50_ms"])
+    assert summary["all"]["all"]["errors"] == summary["fail"]["all"]["errors"]
+
+
+def test_run_at_a_fixed_rate():
+    workload = Workload([Operation("predict", "/predict", {"x": 1})])
+    result = run(InProcessTarget(make_app()), workload, requests=20, concurrency=2, rps=100)
+    assert len(result.samples) == 20
+    assert result.elapsed_s >= 0.19
+    assert [s.start_s for s in result.samples] == pytest.approx([i / 100 for i in range(20)])
+
+    # Requests that wait for a free thread include the wait in their latency.
+    slow = InProcessTarget(make_app(delay_s=0.02))
+    result = run(slow, workload, requests=5, concurrency=1, rps=1000)
+    assert result.samples[-1].latency_ms >= 90
+
+
+def test_run_for_a_duration():
+    workload = Workload([Operation("predict", "/predict", {"x": 1})])
+    result = run(InProcessTarget(make_app()), workload, duration_s=0.2, concurrency=2, rps=50)
+    assert len(result.samples) == 10
+
+
+def test_http_target():
+    server = make_server("127.0.0.1", 0, make_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        target = HttpTarget(f"http://127.0.0.1:{server.server_port}")
+        assert target.send("/predict", {"x": 1}) == (200, False)
+        assert target.send("/predict", {"x": 1}) == (200, True)
+        assert target.send("/predict", {"x": 1}, no_cache=True) == (200, False)
+        assert target.send("/fail", {}) == (500, False)
+    finally:
+        server.shutdown()
+
+
+def test_regressions():
+    def summary(p95_ms: float, throughput_rps: float):
+        group = {"requests": 100, "p95_ms": p95_ms, "throughput_rps": throughput_rps}
+        return {"predict": {"cold": group, "warm": {**group, "requests": 5}}}
+
+    assert regressions(summary(100, 10), summary(105, 10)) == []
+    found = regressions(summary(100, 10), summary(150, 8))
+    assert len(found) == 2
+    assert found[0].startswith("predict (cold): p95")
+    # Groups with few requests aren't compared.
+    assert not any("warm" in f for f in found)
@@ -0,0 +1,42 @@
+import time
+
+from allennlp_demo.common.budget import Budget, current_budget
+
+
+def test_budget_limits_passes():
+    budget = Budget(max_passes=2)
+    assert not budget.stop()
+    budget.spend()
+    assert not budget.stop()
+    budget.spend()
+    assert budget.stop()
+    assert budget.truncated
+
+
+def test_budget_limits_time():
+    budget = Budget(deadline_ms=10)
+    assert not budget.stop()
+    time.sleep(0.02)
+    assert budget.stop()
+    assert budget.truncated
+
+
+def test_cancelled_budget_stops():
+    budget = Budget()
+    assert not budget.stop()
+    budget.cancel()
+    assert budget.stop()
+    assert budget.truncated
+
+
+def test_current_budget():
+    assert current_budget().max_passes is None
+    assert not current_budget().stop()
+
+    budget = Budget(max_passes=1)
+    with budget.activate():
+        assert current_budget() is budget
+        current_budget().spend()
+        assert current_budget().stop()
+    assert current_budget() is not budget
+    assert budget.truncated
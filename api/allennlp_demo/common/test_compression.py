@@ -0,0 +1,85 @@
+import gzip
+import json
+
+import pytest
+from flask import Flask, Response, jsonify
+
+from allennlp_demo.common.compression import Compressor, cache_compressed, configure_compression
+
+
+def make_app(compressor: Compressor) -> Flask:
+    app = Flask(__name__)
+    configure_compression(app, compressor)
+
+    @app.route("/big")
+    def big():
+        resp = jsonify({"grads": [0.25] * 1000})
+        resp.set_etag("abc")
+        return resp
+
+    @app.route("/small")
+    def small():
+        return jsonify({"label": "pos"})
+
+    @app.route("/cached")
+    def cached():
+        cache_compressed()
+        return jsonify({"grads": [0.5] * 1000})
+
+    @app.route("/stream")
+    def stream():
+        return Response((b"x" * 1000 for _ in range(4)), mimetype="text/plain")
+
+    return app
+
+
+def test_compresses_large_responses():
+    compressor = Compressor(min_bytes=100)
+    client = make_app(compressor).test_client()
+
+    response = client.get("/big", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert response.headers["ETag"] == 'W/"abc"'
+    assert json.loads(gzip.decompress(response.data)) == {"grads": [0.25] * 1000}
+    assert compressor.responses == {"gzip": 1}
+    assert compressor.saved_bytes > 0
+
+
+def test_leaves_other_responses_alone():
+    client = make_app(Compressor(min_bytes=100)).test_client()
+
+    response = client.get("/big")
+    assert "Content-Encoding" not in response.headers
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert response.json == {"grads": [0.25] * 1000}
+
+    response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+
+    response = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    assert response.data == b"x" * 4000
+
+
+def test_caches_compressed_results():
+    compressor = Compressor(min_bytes=100)
+    client = make_app(compressor).test_client()
+
+    client.get("/big", headers={"Accept-Encoding": "gzip"})
+    assert len(compressor.cache) == 0
+
+    first = client.get("/cached", headers={"Accept-Encoding": "gzip"})
+    assert len(compressor.cache) == 1
+    second = client.get("/cached", headers={"Accept-Encoding": "gzip"})
+    assert second.data == first.data
+    assert len(compressor.cache) == 1
+
+
+def test_prefers_brotli():
+    brotli = pytest.importorskip("brotli")
+    client = make_app(Compressor(min_bytes=100)).test_client()
+
+    response = client.get("/big", headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["Content-Encoding"] == "br"
+    assert json.loads(brotli.decompress(response.data)) == {"grads": [0.25] * 1000}
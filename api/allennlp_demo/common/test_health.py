@@ -0,0 +1,21 @@
+from flask import Flask
+
+from allennlp_demo.common import health
+
+
+def test_health_checks_reflect_status():
+    status = health.LOADING
+    app = Flask("test")
+    health.configure_health_checks(app, lambda: status)
+    client = app.test_client()
+
+    assert client.get("/ready").status_code == 503
+    assert client.get("/live").status_code == 200
+
+    status = health.READY
+    assert client.get("/ready").status_code == 200
+    assert client.get("/live").json == {"status": "ready"}
+
+    status = health.FAILED
+    assert client.get("/ready").status_code == 503
+    assert client.get("/live").status_code == 500
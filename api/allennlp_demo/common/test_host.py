@@ -0,0 +1,84 @@
+from allennlp.predictors.predictor import JsonDict
+from werkzeug.test import Client
+
+from allennlp_demo.common import config, health
+from allennlp_demo.common.host import ModelHost, demo_inputs
+from allennlp_demo.common.http import ModelEndpoint, lazy_loading
+
+
+class FakeModelEndpoint(ModelEndpoint):
+    def __init__(self, model_id: str, size: int):
+        self.size = size
+        self.loads = 0
+        super().__init__(config.Model(id=model_id, archive_file="unused"))
+
+    def load(self) -> None:
+        self.loads += 1
+
+    def measure_model_bytes(self) -> int:
+        return self.size
+
+    def predict(self, inputs: JsonDict) -> JsonDict:
+        return {"model": self.model.id, **inputs}
+
+
+def make_host(memory_budget=None):
+    with lazy_loading(wait_s=5):
+        endpoints = [FakeModelEndpoint("a", 60), FakeModelEndpoint("b", 60)]
+    host = ModelHost(endpoints, memory_budget)
+    return host, Client(host.wsgi_app)
+
+
+def test_models_are_loaded_on_demand():
+    host, client = make_host()
+    a = host.endpoints["a"]
+    assert a.status() == health.UNLOADED
+    assert client.get("/a/").status_code == 200
+    assert a.loads == 0
+
+    response = client.post("/a/predict", json={"x": 1})
+    assert response.status_code == 200
+    assert response.json == {"model": "a", "x": 1}
+    assert a.status() == health.READY
+    assert host.endpoints["b"].status() == health.UNLOADED
+
+    response = client.get("/models")
+    assert response.json["models"]["a"]["status"] == health.READY
+    assert response.json["models"]["b"]["status"] == health.UNLOADED
+    assert response.json["resident_bytes"] == 60
+
+
+def test_least_recently_used_models_are_unloaded():
+    host, client = make_host(memory_budget=100)
+    a, b = host.endpoints["a"], host.endpoints["b"]
+
+    assert client.post("/a/predict", json={}).status_code == 200
+    assert client.post("/b/predict", json={}).status_code == 200
+    assert a.status() == health.UNLOADED
+    assert b.status() == health.READY
+    assert host.unloads == 1
+
+    # Loading a model again unloads the other one before it starts, as its size is known.
+    assert client.post("/a/predict", json={}).status_code == 200
+    assert a.loads == 2
+    assert b.status() == health.UNLOADED
+
+
+def test_models_in_use_are_not_unloaded():
+    host, client = make_host(memory_budget=100)
+    a = host.endpoints["a"]
+    assert client.post("/a/predict", json={}).status_code == 200
+
+    a._acquire()
+    assert client.post("/b/predict", json={}).status_code == 200
+    assert a.status() == health.READY
+    a._release()
+    assert a.unload()
+    assert a.status() == health.UNLOADED
+
+
+def test_demo_inputs_are_read_from_model_json():
+    model, inputs = demo_inputs("wikitables_parser")
+    assert model.id == "wikitables-parser"
+    assert inputs == model.warmup_inputs
+    assert inputs[0]["question"] == "What is the only season with the 1st position?"
@@ -0,0 +1,103 @@
+import numpy
+import pytest
+import torch
+from allennlp.data import Vocabulary
+from allennlp.data.dataset_readers import TextClassificationJsonReader
+from allennlp.data.tokenizers import WhitespaceTokenizer
+from allennlp.interpret.saliency_interpreters import IntegratedGradient
+from allennlp.models import BasicClassifier
+from allennlp.modules.seq2vec_encoders import BagOfEmbeddingsEncoder
+from allennlp.modules.text_field_embedders import BasicTextFieldEmbedder
+from allennlp.modules.token_embedders import Embedding
+from allennlp.predictors import TextClassifierPredictor
+
+from allennlp_demo.common.interpreters import (
+    BatchedIntegratedGradient,
+    BatchedSmoothGradient,
+    _add_grads,
+    _loss_is_summed,
+)
+
+
+INPUTS = {"sentence": "the cat sat ."}
+
+
+@pytest.fixture(params=["mean", "sum"])
+def predictor(request) -> TextClassifierPredictor:
+    vocab = Vocabulary()
+    vocab.add_tokens_to_namespace(["the", "cat", "sat", "."], "tokens")
+    vocab.add_tokens_to_namespace(["positive", "negative"], "labels")
+    reader = TextClassificationJsonReader(tokenizer=WhitespaceTokenizer())
+    embedder = BasicTextFieldEmbedder({"tokens": Embedding(embedding_dim=4, vocab=vocab)})
+    model = BasicClassifier(vocab, embedder, BagOfEmbeddingsEncoder(embedding_dim=4))
+    # Models either average their loss over a batch, or add it up like a CRF tagger does.
+    model._loss = torch.nn.CrossEntropyLoss(reduction=request.param)
+    model.eval()
+    return TextClassifierPredictor(model, reader)
+
+
+def count_batches(predictor: TextClassifierPredictor, monkeypatch) -> list:
+    batch_sizes = []
+    get_gradients = predictor.get_gradients
+
+    def counting_get_gradients(instances):
+        batch_sizes.append(len(instances))
+        return get_gradients(instances)
+
+    monkeypatch.setattr(predictor, "get_gradients", counting_get_gradients)
+    return batch_sizes
+
+
+@pytest.mark.parametrize(
+    "max_batch_tokens, expected_batch_sizes",
+    # All 10 steps go in a single batch, unless that'd be more than `max_batch_tokens`, in which
+    # case the batches may differ in size.
+    [(4096, [10]), (8, [2] * 5), (12, [3, 3, 2, 2])],
+)
+def test_batched_integrated_gradient_matches_sequential(
+    predictor: TextClassifierPredictor,
+    monkeypatch,
+    max_batch_tokens: int,
+    expected_batch_sizes: list,
+):
+    expected = IntegratedGradient(predictor).saliency_interpret_from_json(INPUTS)
+
+    batch_sizes = count_batches(predictor, monkeypatch)
+    interpreter = BatchedIntegratedGradient(predictor, max_batch_tokens=max_batch_tokens)
+    actual = interpreter.saliency_interpret_from_json(INPUTS)
+
+    numpy.testing.assert_allclose(
+        actual["instance_1"]["grad_input_1"], expected["instance_1"]["grad_input_1"], rtol=1e-4
+    )
+    assert batch_sizes == expected_batch_sizes
+
+
+def test_loss_reduction_is_detected(predictor: TextClassifierPredictor):
+    instance = predictor.json_to_labeled_instances(INPUTS)[0]
+    assert _loss_is_summed(predictor, instance) == (predictor._model._loss.reduction == "sum")
+
+
+def test_batched_smooth_gradient(predictor: TextClassifierPredictor, monkeypatch):
+    batch_sizes = count_batches(predictor, monkeypatch)
+    interpreter = BatchedSmoothGradient(predictor, num_samples=20, max_batch_tokens=48)
+    grads = interpreter.saliency_interpret_from_json(INPUTS)["instance_1"]["grad_input_1"]
+
+    assert batch_sizes == [12, 8]
+    assert len(grads) == 4
+    assert sum(grads) == pytest.approx(1.0)
+
+
+def test_batches_of_different_sizes_count_the_same():
+    def batch_grads(samples: list, reduction: str) -> dict:
+        # The gradients of each sample are its index, scaled by one over the batch's size if
+        # the loss is averaged over the batch.
+        grads = numpy.array(samples, dtype=float).reshape(-1, 1, 1)
+        return {"grad_input_1": grads / len(samples) if reduction == "mean" else grads}
+
+    for reduction in ["mean", "sum"]:
+        total: dict = {}
+        for samples in [[0, 2, 4], [1, 3]]:
+            weight = len(samples) if reduction == "mean" else 1
+            _add_grads(total, batch_grads(samples, reduction), weight)
+        assert total["grad_input_1"].shape == (1, 1, 1)
+        assert total["grad_input_1"].item() == pytest.approx(0 + 1 + 2 + 3 + 4)
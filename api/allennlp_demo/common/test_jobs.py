@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+
+from allennlp_demo.common.cache import MemoryCacheBackend
+from allennlp_demo.common.jobs import (
+    DONE,
+    FAILED,
+    QUEUED,
+    RUNNING,
+    JobQueue,
+    JobQueueFullError,
+    MemoryJobStore,
+    backend_for_jobs,
+)
+
+
+def wait_for(jobs: JobQueue, job_id: str) -> dict:
+    for _ in range(100):
+        job = jobs.get(job_id)
+        if job["status"] in (DONE, FAILED):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} didn't finish")
+
+
+def test_jobs_run_in_the_background():
+    jobs = JobQueue(MemoryCacheBackend("test", 16))
+    job = jobs.submit("square", lambda: 4 * 4)
+    assert job["status"] == QUEUED
+    job = wait_for(jobs, job["id"])
+    assert job["status"] == DONE
+    assert job["result"] == 16
+    assert jobs.get("unknown") is None
+
+
+def test_failed_jobs_report_the_error():
+    def fail():
+        raise ValueError("nope")
+
+    jobs = JobQueue(MemoryCacheBackend("test", 16))
+    job = wait_for(jobs, jobs.submit("fail", fail)["id"])
+    assert job["status"] == FAILED
+    assert job["error"] == "nope"
+
+
+def test_queue_is_bounded():
+    release = threading.Event()
+    jobs = JobQueue(MemoryCacheBackend("test", 16), workers=1, max_queued=1)
+    running = jobs.submit("block", release.wait)
+    while jobs.get(running["id"])["status"] == QUEUED:
+        time.sleep(0.01)
+    queued = jobs.submit("block", release.wait)
+    with pytest.raises(JobQueueFullError):
+        jobs.submit("block", release.wait)
+    release.set()
+    assert wait_for(jobs, running["id"])["status"] == DONE
+    assert wait_for(jobs, queued["id"])["status"] == DONE
+
+
+def test_jobs_expire():
+    jobs = JobQueue(MemoryCacheBackend("test", 16), ttl_s=0.05)
+    job = wait_for(jobs, jobs.submit("square", lambda: 4 * 4)["id"])
+    assert job["status"] == DONE
+    time.sleep(0.1)
+    assert jobs.get(job["id"]) is None
+
+
+def test_new_jobs_are_stored_when_the_store_is_full():
+    # The cost-aware cache would turn new, never-requested ids away once it's full of jobs that
+    # have been polled, and the client would get a 404 for a job it was told about.
+    for store in (MemoryJobStore("test", 4, ttl_s=60), backend_for_jobs(None, "test", 4, 60)):
+        jobs = JobQueue(store)
+        for _ in range(8):
+            job = wait_for(jobs, jobs.submit("square", lambda: 4 * 4)["id"])
+            for _ in range(10):
+                assert jobs.get(job["id"])["status"] == DONE
+        assert len(store) == 4
+        release = threading.Event()
+        job = jobs.submit("block", release.wait)
+        assert jobs.get(job["id"])["status"] in (QUEUED, RUNNING)
+        release.set()
+        assert wait_for(jobs, job["id"])["status"] == DONE
+
+
+def test_expired_jobs_are_evicted():
+    store = MemoryJobStore("test", 16, ttl_s=0.05)
+    store.set("a", b"{}")
+    assert len(store) == 1
+    time.sleep(0.1)
+    assert store.get("a") is None
+    assert len(store) == 0
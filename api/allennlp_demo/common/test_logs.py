@@ -0,0 +1,71 @@
+import json
+import logging
+import threading
+
+from flask import Flask
+
+from allennlp_demo.common import logs
+from allennlp_demo.common.logs import BackgroundHandler, Payload, PayloadOptions
+
+
+def test_payloads_are_filtered_and_truncated():
+    options = PayloadOptions(max_bytes=64, fields=["label"])
+    payload = Payload.capture(
+        json.dumps([{"label": "pos", "logits": [0.1] * 100}]).encode(), options
+    )
+    assert payload.to_json() == [{"label": "pos"}]
+
+    truncated = logs.stats.truncated
+    big = json.dumps({"logits": [0.1] * 100}).encode()
+    assert Payload.capture(big, PayloadOptions(max_bytes=64)) == {
+        "truncated": True,
+        "bytes": len(big),
+    }
+    assert logs.stats.truncated == truncated + 1
+    assert Payload.capture(b"", options) is None
+
+
+class BlockingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.unblock = threading.Event()
+        self.records = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.unblock.wait()
+        self.records.append(record)
+
+
+def test_background_handler_drops_records_when_full():
+    inner = BlockingHandler()
+    handler = BackgroundHandler(inner, maxsize=1)
+    logger = logging.getLogger("test_background_handler")
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        dropped = logs.stats.dropped
+        for i in range(10):
+            logger.warning("record %d", i)
+        # One record is being written, one is queued and the rest are dropped.
+        assert logs.stats.dropped >= dropped + 8
+        inner.unblock.set()
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+    assert 1 <= len(inner.records) <= 2
+
+
+def test_request_payloads_are_sampled(caplog):
+    app = Flask(__name__)
+    logs.configure_logging(app, log_payloads=True, payload_options=PayloadOptions(sample_rate=0))
+
+    @app.route("/", methods=["POST"])
+    def index():
+        return {"ok": True}
+
+    with caplog.at_level(logging.INFO, logger="request"):
+        app.test_client().post("/", json={"hello": "world"})
+    entry = [r.msg for r in caplog.records if r.name == "request"][0]
+    assert entry.status == 200
+    assert entry.request_data is None
+    assert entry.response_data is None
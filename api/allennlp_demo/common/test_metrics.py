@@ -0,0 +1,70 @@
+from flask import Flask
+
+from allennlp_demo.common.metrics import Registry, configure_metrics
+
+
+def test_registry_renders_the_prometheus_text_format():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests.", ["route"])
+    requests.inc(route="/predict")
+    requests.inc(2, route="/predict")
+    registry.gauge("answer", "The answer.", callback=lambda: {(): 42})
+    latency = registry.histogram("latency_seconds", "Latency.", buckets=[0.1, 1])
+    latency.observe(0.05)
+    latency.observe(0.5)
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{route="/predict"} 3',
+        "# HELP answer The answer.",
+        "# TYPE answer gauge",
+        "answer 42",
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 2',
+        "latency_seconds_sum 0.55",
+        "latency_seconds_count 2",
+    ]
+
+
+def test_configure_metrics_records_requests():
+    app = Flask(__name__)
+    configure_metrics(app)
+
+    @app.route("/hello/<string:name>")
+    def hello(name: str):
+        return f"Hello {name}"
+
+    client = app.test_client()
+    assert client.get("/hello/world").status_code == 200
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    metrics = resp.data.decode()
+    assert (
+        'allennlp_demo_request_duration_seconds_count{route="/hello/<string:name>",method="GET",'
+        'status="200",target=""} 1'
+    ) in metrics
+    assert "allennlp_demo_process_resident_memory_bytes" in metrics
+
+
+def test_unknown_interpreters_and_attackers_share_a_series():
+    app = Flask(__name__)
+    configure_metrics(app)
+
+    @app.route("/interpret/<string:interpreter_id>")
+    def interpret(interpreter_id: str):
+        if interpreter_id != "simple_gradient":
+            return "Not found", 404
+        return "ok"
+
+    client = app.test_client()
+    assert client.get("/interpret/simple_gradient").status_code == 200
+    for i in range(3):
+        assert client.get(f"/interpret/made-up-{i}").status_code == 404
+    metrics = client.get("/metrics").data.decode()
+    assert 'status="200",target="simple_gradient"} 1' in metrics
+    assert 'status="404",target="unknown"} 3' in metrics
+    assert "made-up" not in metrics
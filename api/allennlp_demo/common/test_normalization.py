@@ -0,0 +1,14 @@
+from allennlp_demo.common.normalization import CacheKey, canonical_json
+
+
+def test_canonical_json_ignores_key_order():
+    assert canonical_json({"b": 1, "a": [1, {"d": 2, "c": 3}]}) == b'{"a":[1,{"c":3,"d":2}],"b":1}'
+
+
+def test_cache_keys_compare_by_canonical_form():
+    first = CacheKey({"question": "Who?", "passage": "Me."})
+    second = CacheKey({"passage": "Me.", "question": "Who?"})
+    assert first == second
+    assert hash(first) == hash(second)
+    assert first.inputs is not second.inputs
+    assert CacheKey({"passage": "Me. ", "question": "Who?"}) != first
@@ -0,0 +1,93 @@
+import pytest
+import torch
+
+from allennlp_demo.common import precision
+
+
+class Tagger(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.embedding = torch.nn.Embedding(10, 32)
+        self.encoder = torch.nn.Linear(32, 32)
+        self.norm = torch.nn.LayerNorm(32)
+        self.head = torch.nn.Linear(32, 3)
+
+    def forward(self, tokens: torch.Tensor):
+        encoded = self.norm(torch.relu(self.encoder(self.embedding(tokens))))
+        return {"logits": self.head(encoded), "tokens": tokens}
+
+    def forward_on_instances(self, tokens: torch.Tensor):
+        # Like allennlp's models, which turn the outputs into numpy arrays.
+        with torch.no_grad():
+            return self(tokens)["logits"].numpy()
+
+
+class FakePredictor:
+    def __init__(self, model: torch.nn.Module):
+        self._model = model
+
+    def predict(self, tokens: torch.Tensor):
+        return self._model.forward_on_instances(tokens)
+
+
+@pytest.fixture
+def predictor() -> FakePredictor:
+    torch.manual_seed(0)
+    return FakePredictor(Tagger().eval())
+
+
+def test_fp32_returns_the_predictor(predictor):
+    assert precision.reduce_precision(predictor, precision.FP32) is predictor
+
+
+def test_invalid_precision(predictor):
+    with pytest.raises(ValueError):
+        precision.reduce_precision(predictor, "fp8")
+
+
+def test_int8_dynamic_quantizes_a_copy(predictor):
+    tokens = torch.randint(0, 10, (2, 5))
+    expected = predictor.predict(tokens)
+    reduced = precision.reduce_precision(predictor, precision.INT8_DYNAMIC)
+
+    assert reduced is not predictor
+    assert not isinstance(reduced._model.encoder, torch.nn.Linear)
+    # The original model is unchanged, so gradients can still be computed through it.
+    assert isinstance(predictor._model.encoder, torch.nn.Linear)
+    assert (predictor.predict(tokens) == expected).all()
+    # Layers that aren't quantized share their parameters with the original.
+    assert reduced._model.embedding.weight is predictor._model.embedding.weight
+    assert reduced._model.norm.weight is predictor._model.norm.weight
+    assert abs(reduced.predict(tokens) - expected).max() < 0.1
+
+    fp32_bytes = precision.model_bytes(predictor._model)
+    extra_bytes = precision.model_bytes(predictor._model, reduced._model) - fp32_bytes
+    # The quantized weights take a byte each, plus the biases and quantization parameters.
+    assert 0 < extra_bytes < (32 * 32 + 32 * 3) * 2
+
+
+@pytest.mark.skipif(not hasattr(torch, "autocast"), reason="requires CPU autocast")
+def test_bf16_shares_the_model(predictor):
+    tokens = torch.randint(0, 10, (2, 5))
+    expected = predictor.predict(tokens)
+    reduced = precision.reduce_precision(predictor, precision.BF16)
+
+    assert reduced._model.encoder is predictor._model.encoder
+    assert precision.model_bytes(predictor._model, reduced._model) == precision.model_bytes(
+        predictor._model
+    )
+    outputs = reduced.predict(tokens)
+    assert outputs.dtype == expected.dtype
+    assert abs(outputs - expected).max() < 0.1
+    assert (predictor.predict(tokens) == expected).all()
+
+
+def test_compare():
+    expected = [{"label": "a", "probs": [0.5, 0.5]}, {"label": "b", "probs": [0.2, 0.8]}]
+    actual = [{"label": "a", "probs": [0.52, 0.48]}, {"label": "a", "probs": [0.6, 0.4]}]
+    result = precision.compare(expected, actual)
+    assert result["agreement"] == 0.5
+    assert result["max_abs_diff"] == pytest.approx(0.02)
+
+    # Integers are indices, which have to be equal.
+    assert precision.compare([{"span": [1, 3]}], [{"span": [1, 4]}])["agreement"] == 0.0
@@ -0,0 +1,12 @@
+from allennlp.data import Token
+
+from allennlp_demo.common import progress
+
+
+def test_report_step_calls_the_listener():
+    steps = []
+    progress.report_step([Token("ignored")], {})
+    with progress.listen(steps.append):
+        progress.report_step([Token("a"), Token("b")], {"label": "x"})
+    progress.report_step([Token("ignored")], {})
+    assert steps == [{"tokens": ["a", "b"], "outputs": {"label": "x"}}]
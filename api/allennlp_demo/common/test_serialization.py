@@ -0,0 +1,63 @@
+import json
+import struct
+
+import numpy
+import pytest
+from flask import Flask
+
+from allennlp_demo.common import serialization
+from allennlp_demo.common.serialization import Serialized
+
+
+def test_dumps_json_handles_numpy():
+    raw = serialization.dumps_json({"probs": numpy.array([0.5, 0.25]), "label": numpy.int64(1)})
+    assert json.loads(raw) == {"probs": [0.5, 0.25], "label": 1}
+
+
+def test_dumps_json_without_orjson(monkeypatch):
+    monkeypatch.setattr(serialization, "_orjson", False)
+    raw = serialization.dumps_json({"probs": numpy.array([0.5, 0.25])})
+    assert json.loads(raw) == {"probs": [0.5, 0.25]}
+
+
+def test_serialized_value_is_parsed_lazily():
+    result = Serialized(b'{"label": "pos"}')
+    assert not result._parsed
+    assert result.value == {"label": "pos"}
+
+    result = Serialized.of({"label": "pos"})
+    assert json.loads(result.raw) == {"label": "pos"}
+
+
+def test_negotiate():
+    app = Flask(__name__)
+    with app.test_request_context() as ctx:
+        assert serialization.negotiate(ctx.request) == serialization.JSON
+    with app.test_request_context(headers={"Accept": "application/msgpack"}) as ctx:
+        expected = serialization.MSGPACK if serialization._load_msgpack() else serialization.JSON
+        assert serialization.negotiate(ctx.request) == expected
+
+
+def test_serialize_returns_serialized_json_as_is():
+    app = Flask(__name__)
+    with app.app_context():
+        resp = serialization.serialize(Serialized(b'{"label":"pos"}'))
+    assert resp.mimetype == serialization.JSON
+    assert resp.get_data() == b'{"label":"pos"}'
+
+
+def test_msgpack_packs_long_lists_of_floats():
+    msgpack = pytest.importorskip("msgpack")
+    grads = [0.5] * serialization.MIN_PACKED_FLOATS
+
+    def ext_hook(code, data):
+        assert code == serialization.MSGPACK_FLOAT_ARRAY
+        (length,) = struct.unpack_from("<I", data)
+        return list(struct.unpack_from(f"<{length}d", data, 4))
+
+    raw = serialization.dumps_msgpack({"grads": grads, "short": [0.5], "tokens": ["a"]})
+    assert msgpack.unpackb(raw, ext_hook=ext_hook) == {
+        "grads": grads,
+        "short": [0.5],
+        "tokens": ["a"],
+    }
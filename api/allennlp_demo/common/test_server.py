@@ -0,0 +1,239 @@
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import urllib.request
+
+import torch
+from allennlp.predictors.predictor import JsonDict
+from flask import Flask
+
+from allennlp_demo.common import config
+from allennlp_demo.common.http import ModelEndpoint
+from allennlp_demo.common.server import ServerOptions, serve_prefork, worker_cpus
+
+
+def test_cpus_are_split_between_workers(monkeypatch):
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: {0, 1, 2, 3}, raising=False)
+    assert worker_cpus(0, 2) == [0, 1]
+    assert worker_cpus(1, 2) == [2, 3]
+    assert worker_cpus(3, 8) == [0, 1, 2, 3]
+
+
+def test_serve_prefork():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    app = Flask("test")
+
+    @app.route("/")
+    def pid():
+        return str(os.getpid())
+
+    server = multiprocessing.get_context("fork").Process(
+        target=serve_prefork, args=(app, "127.0.0.1", port, ServerOptions(workers=2))
+    )
+    server.start()
+    try:
+        pids = []
+        deadline = time.monotonic() + 10
+        while len(pids) < 5 and time.monotonic() < deadline:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/") as resp:
+                    pids.append(int(resp.read()))
+            except OSError:
+                time.sleep(0.1)
+        assert len(pids) == 5
+        assert server.pid not in pids
+    finally:
+        os.kill(server.pid, signal.SIGTERM)
+        server.join(10)
+    assert server.exitcode == 0
+
+
+def test_serve_prefork_answers_from_main_process_until_workers_are_forked():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    app = Flask("test")
+
+    @app.route("/")
+    def pid():
+        return str(os.getpid())
+
+    ctx = multiprocessing.get_context("fork")
+    loaded = ctx.Event()
+    server = ctx.Process(
+        target=serve_prefork,
+        args=(app, "127.0.0.1", port, ServerOptions(workers=2)),
+        kwargs={"before_fork": loaded.wait},
+    )
+    server.start()
+
+    def get_pid() -> int:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/") as resp:
+                    return int(resp.read())
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    try:
+        assert get_pid() == server.pid
+        loaded.set()
+        deadline = time.monotonic() + 10
+        while get_pid() == server.pid:
+            assert time.monotonic() < deadline
+            time.sleep(0.1)
+    finally:
+        os.kill(server.pid, signal.SIGTERM)
+        server.join(10)
+    assert server.exitcode == 0
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def get(url: str, data: bytes = None) -> bytes:
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            with urllib.request.urlopen(url, data, timeout=10) as resp:
+                return resp.read()
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def test_requests_in_progress_finish_before_workers_are_forked():
+    port = free_port()
+    app = Flask("test")
+    lock = threading.Lock()
+    ctx = multiprocessing.get_context("fork")
+    holding = ctx.Event()
+    loaded = ctx.Event()
+
+    @app.route("/hold")
+    def hold():
+        with lock:
+            holding.set()
+            time.sleep(0.5)
+        return str(os.getpid())
+
+    @app.route("/")
+    def pid():
+        # A worker that's forked while the lock is held can never acquire it.
+        if not lock.acquire(timeout=5):
+            return "deadlocked", 500
+        lock.release()
+        return str(os.getpid())
+
+    server = ctx.Process(
+        target=serve_prefork,
+        args=(app, "127.0.0.1", port, ServerOptions(workers=2)),
+        kwargs={"before_fork": loaded.wait},
+    )
+    server.start()
+    try:
+        held = []
+        request = threading.Thread(target=lambda: held.append(get(f"http://127.0.0.1:{port}/hold")))
+        request.start()
+        assert holding.wait(10)
+        loaded.set()
+        request.join()
+        assert int(held[0]) == server.pid
+
+        deadline = time.monotonic() + 10
+        while int(get(f"http://127.0.0.1:{port}/")) == server.pid:
+            assert time.monotonic() < deadline
+            time.sleep(0.1)
+    finally:
+        os.kill(server.pid, signal.SIGTERM)
+        server.join(10)
+    assert server.exitcode == 0
+
+
+class LinearModelEndpoint(ModelEndpoint):
+    def __init__(self):
+        inputs = {"x": [0.5] * 256}
+        model = config.Model(
+            id="linear", archive_file="unused", workers=2, torch_threads=2, warmup_inputs=[inputs]
+        )
+        super().__init__(model)
+
+    def load(self) -> None:
+        torch.manual_seed(0)
+        self.linear = torch.nn.Linear(256, 256)
+        for inputs in self.model.warmup_inputs:
+            self.predict(inputs)
+
+    def measure_model_bytes(self) -> int:
+        return sum(p.numel() * p.element_size() for p in self.linear.parameters())
+
+    def predict(self, inputs: JsonDict) -> JsonDict:
+        # Large enough for torch to split the work between its threads.
+        x = torch.tensor(inputs["x"]).expand(512, -1)
+        with torch.no_grad():
+            y = self.linear(x)
+        return {"pid": os.getpid(), "threads": torch.get_num_threads(), "sum": float(y.sum())}
+
+
+def test_workers_serve_a_model_that_was_loaded_before_they_were_forked():
+    port = free_port()
+
+    def serve() -> None:
+        LinearModelEndpoint().run(port)
+
+    server = multiprocessing.get_context("fork").Process(target=serve)
+    server.start()
+    try:
+        assert get(f"http://127.0.0.1:{port}/ready") is not None
+        body = json.dumps({"x": [0.5] * 256}).encode()
+        pids = set()
+        deadline = time.monotonic() + 10
+        while not pids - {server.pid}:
+            assert time.monotonic() < deadline
+            result = json.loads(get(f"http://127.0.0.1:{port}/predict?no_cache", body))
+            pids.add(result["pid"])
+        assert result["threads"] == 2
+    finally:
+        os.kill(server.pid, signal.SIGTERM)
+        server.join(10)
+    assert server.exitcode == 0
+
+
+def test_workers_are_forked_once_the_loader_thread_has_exited():
+    class SlowLoaderEndpoint(ModelEndpoint):
+        def __init__(self):
+            super().__init__(config.Model(id="slow", archive_file="unused"))
+
+        def load(self) -> None:
+            # The loader thread keeps running for a while after the model is ready.
+            set_ready = self.ready.set
+
+            def set_and_linger() -> None:
+                set_ready()
+                time.sleep(0.5)
+
+            self.ready.set = set_and_linger
+
+        def measure_model_bytes(self) -> int:
+            return 0
+
+    endpoint = SlowLoaderEndpoint()
+    endpoint._wait_until_loaded()
+    assert endpoint.ready.is_set()
+    assert not endpoint._loader.is_alive()
+    assert not endpoint.loading
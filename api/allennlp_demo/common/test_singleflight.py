@@ -0,0 +1,63 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from allennlp_demo.common.singleflight import SingleFlight
+
+
+def test_concurrent_calls_with_the_same_key_are_coalesced():
+    inflight = SingleFlight()
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow(x: int) -> int:
+        calls.append(x)
+        started.set()
+        release.wait(5)
+        return x * x
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        futures = [pool.submit(inflight.do, "key", lambda: slow(3))]
+        started.wait(5)
+        futures += [pool.submit(inflight.do, "key", lambda: slow(3)) for _ in range(3)]
+        other = pool.submit(inflight.do, "other", lambda: slow(4))
+        # Give the other calls a moment to start waiting on the first one.
+        time.sleep(0.1)
+        release.set()
+        results = [f.result() for f in futures]
+
+    assert sorted(calls) == [3, 4]
+    assert other.result() == (16, False)
+    assert all(value == 9 for value, _ in results)
+    assert [coalesced for _, coalesced in results].count(False) == 1
+    assert len(inflight) == 0
+
+    # Once the call is done, the next one for the same key computes the result again.
+    assert inflight.do("key", lambda: slow(3)) == (9, False)
+    assert len(calls) == 3
+
+
+def test_exceptions_are_shared():
+    inflight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError("broken")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(inflight.do, "key", fail)
+        started.wait(5)
+        follower = pool.submit(inflight.do, "key", lambda: "never called")
+        time.sleep(0.1)
+        release.set()
+        with pytest.raises(ValueError):
+            leader.result()
+        with pytest.raises(ValueError):
+            follower.result()
+    assert len(inflight) == 0
@@ -0,0 +1,78 @@
+import os
+
+import torch
+from allennlp.data import Vocabulary
+
+from allennlp_demo.common import snapshot
+
+
+def test_vocabulary_round_trips(tmp_path):
+    vocab = Vocabulary(non_padded_namespaces=["labels"])
+    vocab.add_tokens_to_namespace(["the", "cat", "new\nline"], "tokens")
+    vocab.add_tokens_to_namespace(["positive", "negative"], "labels")
+
+    path = os.path.join(tmp_path, "vocabulary.json")
+    snapshot._write_vocabulary(vocab, path)
+    loaded = snapshot._read_vocabulary(path)
+
+    for namespace in ("tokens", "labels"):
+        expected = vocab.get_token_to_index_vocabulary(namespace)
+        assert loaded.get_token_to_index_vocabulary(namespace) == expected
+        assert loaded.is_padded(namespace) == vocab.is_padded(namespace)
+    assert loaded.get_token_index("new\nline") == vocab.get_token_index("new\nline")
+    assert loaded.get_token_index("unknown") == 1
+    assert loaded.get_token_from_index(1, "labels") == "negative"
+
+
+def test_weights_round_trip_and_stay_tied(tmp_path):
+    class TiedModel(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.embedding = torch.nn.Embedding(10, 4)
+            self.output = torch.nn.Linear(4, 10)
+            self.output.weight = self.embedding.weight
+
+    model = TiedModel()
+    path = os.path.join(tmp_path, "weights")
+    snapshot._write_weights(model, path)
+    # The tied weight is stored once, along with the output layer's bias.
+    assert len([f for f in os.listdir(path) if f.endswith(".npy")]) == 2
+
+    loaded = TiedModel()
+    snapshot._read_weights(loaded, path)
+    for name, tensor in model.state_dict().items():
+        assert torch.equal(loaded.state_dict()[name], tensor)
+    assert loaded.output.weight is loaded.embedding.weight
+
+
+def test_bfloat16_weights_round_trip(tmp_path):
+    model = torch.nn.Linear(4, 3).to(torch.bfloat16)
+    path = os.path.join(tmp_path, "weights")
+    snapshot._write_weights(model, path)
+
+    loaded = torch.nn.Linear(4, 3).to(torch.bfloat16)
+    snapshot._read_weights(loaded, path)
+    for name, tensor in model.state_dict().items():
+        assert loaded.state_dict()[name].dtype == torch.bfloat16
+        assert torch.equal(loaded.state_dict()[name], tensor)
+
+    # They can be read into a model with 32 bit weights too.
+    fp32 = torch.nn.Linear(4, 3)
+    snapshot._read_weights(fp32, path)
+    assert torch.equal(fp32.weight, model.weight.float())
+
+
+def test_pretrained_transformer_weights_are_skipped():
+    params = {
+        "type": "basic_classifier",
+        "text_field_embedder": {
+            "token_embedders": {
+                "tokens": {"type": "pretrained_transformer", "model_name": "roberta-base"}
+            }
+        },
+        "seq2vec_encoder": {"type": "bert_pooler", "pretrained_model": "roberta-base"},
+    }
+    snapshot._skip_pretrained_weights(params)
+    assert params["text_field_embedder"]["token_embedders"]["tokens"]["load_weights"] is False
+    assert params["seq2vec_encoder"]["load_weights"] is False
+    assert "load_weights" not in params
@@ -0,0 +1,51 @@
+import time
+
+from flask import Flask
+
+from allennlp_demo.common.batching import MicroBatcher
+from allennlp_demo.common.timing import configure_server_timing, span, timed, timings
+
+
+def test_spans_are_reported_in_the_server_timing_header():
+    app = Flask(__name__)
+    configure_server_timing(app)
+    slow = timed("slow", lambda: time.sleep(0.01))
+
+    @app.route("/")
+    def index():
+        with span("outer"):
+            slow()
+            slow()
+        assert set(timings()) == {"slow", "outer"}
+        assert timings()["slow"] >= 20
+        return "ok"
+
+    resp = app.test_client().get("/")
+    assert resp.status_code == 200
+    names = [m.split(";")[0] for m in resp.headers["Server-Timing"].split(", ")]
+    assert names == ["slow", "outer"]
+
+
+def test_spans_outside_of_requests_are_ignored():
+    with span("background"):
+        pass
+    assert timings() == {}
+
+
+def test_spans_of_batched_work_are_added_to_each_request():
+    app = Flask(__name__)
+    configure_server_timing(app)
+    model = timed("model", lambda items: time.sleep(0.01) or items)
+    batcher = MicroBatcher(model, max_batch_size=4, max_wait_ms=50)
+
+    @app.route("/<int:i>")
+    def index(i):
+        with span("predict"):
+            return str(batcher.submit(i))
+
+    client = app.test_client()
+    resp = client.get("/3")
+    assert resp.data == b"3"
+    names = [m.split(";")[0] for m in resp.headers["Server-Timing"].split(", ")]
+    assert names == ["model", "predict"]
+    batcher.close()
@@ -0,0 +1,166 @@
+import gzip
+import json
+import threading
+
+import pytest
+from flask import Flask, jsonify, request
+
+from allennlp_demo.common.benchmark import InProcessTarget
+from allennlp_demo.common.traffic import (
+    COST,
+    LRU,
+    analyze,
+    duplicate_rates,
+    heaviest_inputs,
+    lookups,
+    read_logs,
+    recorded_run,
+    replay,
+    simulate_cache,
+)
+
+
+def entry(path, body, latency_ms=100.0, cached=False, timestamp=0.0, **kwargs):
+    return {
+        "logname": "request",
+        "severity": "INFO",
+        "status": 200,
+        "method": "POST",
+        "path": path,
+        "query": {},
+        "request_data": body,
+        "response_data": {"answer": "x"},
+        "latency_ms": latency_ms,
+        "cached": cached,
+        "timestamp": timestamp,
+        **kwargs,
+    }
+
+
+def write_logs(path, entries):
+    path.write_text("\n".join(json.dumps(e) for e in entries) + "\n")
+    return str(path)
+
+
+def test_read_logs(tmp_path):
+    lines = [
+        json.dumps(entry("/bidaf/predict", {"q": "a"}, timestamp=2.0)),
+        "not json",
+        json.dumps({"logname": "allennlp_demo", "message": "Loaded"}),
+        json.dumps(
+            {
+                "timestamp": "1970-01-01T00:00:01Z",
+                "jsonPayload": {
+                    k: v
+                    for k, v in entry(
+                        "/bidaf/interpret/simple_gradient",
+                        {"truncated": True, "bytes": 50000},
+                        query={"no_cache": [""]},
+                    ).items()
+                    if k != "timestamp"
+                },
+            }
+        ),
+        json.dumps(entry("/bidaf/jobs/123", None, method="GET", timestamp=3.0)),
+    ]
+    path = tmp_path / "requests.log.gz"
+    with gzip.open(path, "wt") as fh:
+        fh.write("\n".join(lines))
+
+    requests = read_logs([str(path)])
+    assert [r.timestamp for r in requests] == [1.0, 2.0, 3.0]
+    assert [r.route for r in requests] == ["interpret/simple_gradient", "predict", None]
+    assert requests[0].body is None
+    assert requests[0].query == {"no_cache": ""}
+    assert requests[1].body == {"q": "a"}
+
+
+def test_duplicate_rates_and_batches(tmp_path):
+    requests = read_logs(
+        [
+            write_logs(
+                tmp_path / "requests.log",
+                [
+                    entry("/predict", {"q": "a", "p": "b"}),
+                    entry("/predict", {"q": "a", "p": "b"}, cached=True),
+                    entry("/predict", {"p": "b", "q": "a  "}),
+                    entry("/predict_batch", [{"q": "c"}, {"q": "a", "p": "b"}], latency_ms=200),
+                    entry("/jobs/attack/hotflip", {"q": "a"}),
+                    entry("/predict", {"q": "d"}, status=500),
+                ],
+            )
+        ]
+    )
+    items = list(lookups(requests))
+    assert [i.operation for i in items] == ["predict"] * 5 + ["attack/hotflip"]
+    assert items[3].latency_ms == 100
+
+    rates = duplicate_rates(items)
+    assert rates["predict"]["lookups"] == 5
+    # Reordered keys are the same exact input, extra whitespace only once normalized.
+    assert rates["predict"]["exact"] == 1 - 3 / 5
+    assert rates["predict"]["normalized"] == 1 - 2 / 5
+    assert rates["predict"]["recorded_hit_ratio"] == 1 / 5
+    assert rates["attack/hotflip"]["normalized"] == 0
+
+
+def test_simulated_caches(tmp_path):
+    # A cheap input that's requested all the time and expensive ones that are requested less
+    # often, but regularly, with one-off inputs between them.
+    entries = []
+    for i in range(200):
+        entries.append(entry("/predict", {"q": "cheap"}, latency_ms=1))
+        entries.append(entry("/predict", {"q": f"expensive {i % 3}"}, latency_ms=1000))
+        entries.append(entry("/predict", {"q": f"one-off {i}"}, latency_ms=10))
+    items = list(lookups(read_logs([write_logs(tmp_path / "requests.log", entries)])))
+
+    unbounded = simulate_cache(items, LRU, maxsize=1000)
+    assert unbounded["hit_ratio"] == pytest.approx(1 - 204 / 600)
+    lru = simulate_cache(items, LRU, maxsize=4)
+    cost = simulate_cache(items, COST, maxsize=4)
+    assert cost["saved_s"] > lru["saved_s"]
+    assert cost["saved_s"] <= unbounded["saved_s"]
+
+    heaviest = heaviest_inputs(items, top=2)
+    assert [h["inputs"] for h in heaviest] == ['{"q":"expensive 0"}', '{"q":"expensive 1"}']
+    assert heaviest[0]["requests"] == 67
+
+    analysis = analyze(read_logs([str(tmp_path / "requests.log")]), [3, 1000])
+    assert analysis["lookups"] == 600
+    assert [(c["policy"], c["maxsize"]) for c in analysis["caches"]] == [
+        (LRU, 3),
+        (LRU, 1000),
+        (COST, 3),
+        (COST, 1000),
+    ]
+
+
+def test_replay(tmp_path):
+    app = Flask("replayed")
+    received = []
+    lock = threading.Lock()
+
+    @app.route("/predict", methods=["POST"])
+    def predict():
+        with lock:
+            received.append((request.get_json(), dict(request.args)))
+        return jsonify({"ok": True})
+
+    requests = read_logs(
+        [
+            write_logs(
+                tmp_path / "requests.log",
+                [entry("/bidaf/predict", {"q": str(i)}, timestamp=100 + i / 10) for i in range(5)]
+                + [entry("/bidaf/predict", None, timestamp=101)],
+            )
+        ]
+    )
+    result = replay(requests, InProcessTarget(app), speed=2.0, no_cache=True)
+    assert sorted(body["q"] for body, _ in received) == ["0", "1", "2", "3", "4"]
+    assert all("no_cache" in args for _, args in received)
+    assert [s.start_s for s in result.samples] == pytest.approx([i / 20 for i in range(5)])
+    assert result.elapsed_s >= 0.2
+
+    recorded = recorded_run(requests)
+    assert len(recorded.samples) == 5
+    assert recorded.samples[-1].start_s == pytest.approx(0.4)
@@ -0,0 +1,49 @@
+import torch
+
+from allennlp_demo.common.weights import WeightPool
+
+
+class Classifier(torch.nn.Module):
+    def __init__(self, encoder: torch.nn.Embedding):
+        super().__init__()
+        self.encoder = encoder
+        self.head = torch.nn.Linear(4, 2)
+
+
+def test_equal_parameters_are_shared():
+    torch.manual_seed(0)
+    encoder = torch.nn.Embedding(10, 4)
+    first = Classifier(encoder)
+    second = Classifier(torch.nn.Embedding(10, 4))
+    second.encoder.load_state_dict(encoder.state_dict())
+
+    pool = WeightPool()
+    assert pool.deduplicate(first) == 0
+    saved = pool.deduplicate(second)
+
+    assert saved == 10 * 4 * 4
+    assert pool.deduplicated_bytes == saved
+    assert second.encoder.weight is first.encoder.weight
+    # The heads were initialized differently, so they stay separate.
+    assert second.head.weight is not first.head.weight
+    assert not torch.equal(second.head.weight, first.head.weight)
+
+
+def test_tied_parameters_are_all_replaced():
+    torch.manual_seed(0)
+    first = torch.nn.Linear(4, 4, bias=False)
+    second = torch.nn.Sequential(torch.nn.Linear(4, 4, bias=False), torch.nn.Linear(4, 4))
+    second[0].weight.data.copy_(first.weight.data)
+    second[1].weight = second[0].weight
+
+    pool = WeightPool()
+    pool.deduplicate(first)
+    pool.deduplicate(second)
+    assert second[0].weight is first.weight
+    assert second[1].weight is first.weight
+
+
+def test_parameters_are_forgotten_with_their_models():
+    pool = WeightPool()
+    pool.deduplicate(torch.nn.Linear(4, 4))
+    assert len(pool._params) == 0
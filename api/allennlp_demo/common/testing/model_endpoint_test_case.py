@@ -1,4 +1,6 @@
+import json
 import os
+import time
 from pathlib import Path
 from typing import Optional, Any, Dict, List
 
@@ -52,6 +54,9 @@ class ModelEndpointTestCase:
         pass
 
     def setup_method(self):
+        # The model is loaded in the background, so wait for it before sending any requests.
+        self.endpoint.wait_until_ready()
+
         # Clear the caches before each call.
         self.endpoint.predict_with_cache.cache_clear()
         self.endpoint.interpret_with_cache.cache_clear()
@@ -84,6 +89,74 @@ class ModelEndpointTestCase:
         self.check_response_okay(response, cache_hit=False)
         self.check_predict_result(response.json)
 
+    def test_predict_server_timing(self):
+        """
+        Ensure the time spent in the model is reported in the `Server-Timing` header, including
+        when predictions are batched.
+        """
+        response = self.client.post("/predict", json=self.predict_input)
+        self.check_response_okay(response, cache_hit=False)
+        assert "model;dur=" in response.headers["Server-Timing"]
+
+    def test_predict_cache_returns_results_as_serialized(self):
+        """
+        Ensure cached results are returned as they were serialized, without serializing them
+        again.
+        """
+        response = self.client.post("/predict", json=self.predict_input)
+        self.check_response_okay(response, cache_hit=False)
+        miss = response.data
+
+        response = self.client.post("/predict", json=self.predict_input)
+        self.check_response_okay(response, cache_hit=True)
+        assert response.data == miss
+
+    def test_predict_cache_ignores_key_order_and_whitespace(self):
+        """
+        Ensure payloads that only differ in key order or formatting share a cache entry.
+        """
+        response = self.client.post("/predict", json=self.predict_input)
+        self.check_response_okay(response, cache_hit=False)
+
+        reordered = dict(reversed(list(self.predict_input.items())))
+        response = self.client.post(
+            "/predict",
+            data=json.dumps(reordered, indent=4),
+            headers={"Content-Type": "application/json"},
+        )
+        self.check_response_okay(response, cache_hit=True)
+        self.check_predict_result(response.json)
+
+    def test_predict_batch(self):
+        """
+        Test the /predict_batch route.
+        """
+        inputs = [self.predict_input, self.predict_input]
+        response = self.client.post("/predict_batch", json=inputs)
+        self.check_response_okay(response, cache_hit=False)
+        assert response.json["cache_hits"] == [False, False]
+        assert len(response.json["results"]) == 2
+        for result in response.json["results"]:
+            self.check_predict_result(result)
+
+        response = self.client.post("/predict_batch", json=inputs)
+        self.check_response_okay(response, cache_hit=True)
+        assert response.json["cache_hits"] == [True, True]
+        for result in response.json["results"]:
+            self.check_predict_result(result)
+
+        response = self.client.post("/predict_batch", json=self.predict_input)
+        assert response.status_code == 400
+
+    def test_predict_batch_is_limited(self):
+        """
+        Ensure a 400 is returned when a /predict_batch request has too many inputs.
+        """
+        inputs = [self.predict_input] * (self.endpoint.model.max_batch_items + 1)
+        response = self.client.post("/predict_batch", json=inputs)
+        assert response.status_code == 400
+        assert "at most" in response.json["error"]
+
     def test_predict_invalid_input(self):
         """
         Ensure a 400 is returned when bad input is given to the /predict route.
@@ -100,6 +173,53 @@ class ModelEndpointTestCase:
         response = self.client.get("/")
         self.check_response_okay(response)
 
+    def test_health_checks(self):
+        """
+        Ensure the `/ready` and `/live` routes report that the model is loaded.
+        """
+        response = self.client.get("/ready")
+        self.check_response_okay(response)
+        assert response.json["status"] == "ready"
+
+        response = self.client.get("/live")
+        self.check_response_okay(response)
+        assert response.json["status"] == "ready"
+
+    def test_jobs(self):
+        """
+        Ensure predictions can be requested as jobs, whose results are cached.
+        """
+        response = self.client.post("/jobs/predict", json=self.predict_input)
+        assert response.status_code == 202
+        job_id = response.json["id"]
+
+        for _ in range(600):
+            response = self.client.get(f"/jobs/{job_id}")
+            self.check_response_okay(response)
+            if response.json["status"] in ("done", "failed"):
+                break
+            time.sleep(0.1)
+        assert response.json["status"] == "done"
+        self.check_predict_result(response.json["result"])
+
+        response = self.client.post("/predict", json=self.predict_input)
+        self.check_response_okay(response, cache_hit=True)
+
+        response = self.client.get("/jobs/unknown")
+        assert response.status_code == 404
+
+    def test_metrics(self):
+        """
+        Ensure the `/metrics` route reports on the requests that were made and the caches.
+        """
+        self.client.post("/predict", json=self.predict_input)
+        response = self.client.get("/metrics")
+        assert response.status_code == 200
+        metrics = response.data.decode()
+        assert 'allennlp_demo_request_duration_seconds_count{route="/predict"' in metrics
+        assert 'allennlp_demo_cache_misses_total{cache="predict"} 1' in metrics
+        assert "allennlp_demo_model_load_seconds" in metrics
+
     def check_response_okay(self, response: Response, cache_hit: bool = False) -> None:
         """
         Ensure the response from a route is okay.
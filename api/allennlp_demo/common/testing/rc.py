@@ -1,3 +1,5 @@
+import json
+
 from overrides import overrides
 
 from allennlp_demo.common.http import ModelEndpoint
@@ -62,3 +64,47 @@ class RcModelEndpointTestCase(ModelEndpointTestCase):
             assert resp.status_code == 200
             assert len(resp.json["final"]) > 0
             assert len(resp.json["original"]) > 0
+
+    def test_attack_budget(self):
+        data = {
+            "inputs": self.predict_input,
+            "input_field_to_attack": "question",
+            "grad_input_field": "grad_input_2",
+        }
+        for attacker_id in self.attacker_ids():
+            resp = self.client.post(
+                f"/attack/{attacker_id}", json=data, query_string={"max_passes": 1}
+            )
+            assert resp.status_code == 200
+            assert resp.json["truncated"]
+            assert len(resp.json["final"]) > 0
+
+            # Partial results aren't cached.
+            resp = self.client.post(
+                f"/attack/{attacker_id}", json=data, query_string={"max_passes": 1}
+            )
+            assert resp.status_code == 200
+            assert resp.headers.get("X-Cache-Hit") is None
+
+        resp = self.client.post("/attack/hotflip", json=data, query_string={"max_passes": "lots"})
+        assert resp.status_code == 400
+
+    def test_attack_stream(self):
+        data = {
+            "inputs": self.predict_input,
+            "input_field_to_attack": "question",
+            "grad_input_field": "grad_input_2",
+        }
+        for attacker_id in self.attacker_ids():
+            resp = self.client.post(
+                f"/attack/{attacker_id}/stream", json=data, query_string={"no_cache": True}
+            )
+            assert resp.status_code == 200
+            assert resp.mimetype == "application/x-ndjson"
+            events = [json.loads(line) for line in resp.data.decode().splitlines()]
+            for step, event in enumerate(events[:-1], 1):
+                assert event["event"] == "step"
+                assert event["step"] == step
+                assert len(event["tokens"]) > 0
+            assert events[-1]["event"] == "result"
+            assert len(events[-1]["result"]["final"]) > 0
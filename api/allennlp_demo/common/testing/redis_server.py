@@ -0,0 +1,87 @@
+import fnmatch
+import socketserver
+import threading
+from typing import Any, Dict, List, Optional
+
+
+class _RedisHandler(socketserver.StreamRequestHandler):
+    server: "StandInRedisServer"
+
+    def _read_command(self) -> Optional[List[bytes]]:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        assert line.startswith(b"*"), f"Unsupported request {line!r}"
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def _write(self, value: Any) -> None:
+        if value is None:
+            self.wfile.write(b"$-1\r\n")
+        elif isinstance(value, int):
+            self.wfile.write(b":%d\r\n" % value)
+        elif isinstance(value, str):
+            self.wfile.write(b"+%s\r\n" % value.encode())
+        elif isinstance(value, bytes):
+            self.wfile.write(b"$%d\r\n%s\r\n" % (len(value), value))
+        else:
+            self.wfile.write(b"*%d\r\n" % len(value))
+            for v in value:
+                self._write(v)
+
+    def handle(self) -> None:
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            name, args = args[0].upper(), args[1:]
+            data = self.server.data
+            with self.server.lock:
+                if name == b"GET":
+                    self._write(data.get(args[0]))
+                elif name == b"SET":
+                    data[args[0]] = args[1]
+                    self._write("OK")
+                elif name == b"DEL":
+                    self._write(sum(1 for k in args if data.pop(k, None) is not None))
+                elif name == b"SCAN":
+                    pattern = args[args.index(b"MATCH") + 1].decode() if b"MATCH" in args else "*"
+                    keys = [k for k in data if fnmatch.fnmatchcase(k.decode(), pattern)]
+                    self._write([b"0", keys])
+                elif name in (b"PING", b"AUTH", b"SELECT"):
+                    self._write("OK")
+                else:
+                    self.wfile.write(b"-ERR unknown command\r\n")
+
+
+class StandInRedisServer(socketserver.ThreadingTCPServer):
+    """
+    A tiny in-memory server that speaks enough of the Redis protocol to test
+    `allennlp_demo.common.cache.RedisCacheBackend` without a real Redis server.
+
+    Use it as a context manager. The server listens on a random free port on localhost.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _RedisHandler)
+        self.data: Dict[bytes, bytes] = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def __enter__(self) -> "StandInRedisServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.shutdown()
+        self.server_close()
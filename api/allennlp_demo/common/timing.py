@@ -0,0 +1,114 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator
+
+from flask import Flask, Response, g, has_request_context
+from allennlp.predictors.predictor import Predictor
+
+
+# The timings collected by `collect()`, for each thread that's collecting them.
+_collected = threading.local()
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """
+    Times the block and adds its duration to the timings of the current request, under `name`.
+    The durations of spans with the same name are added up, and spans may be nested (i.e. the
+    `model` span is part of the `predict` one).
+
+    Blocks that run outside of a request, like those run by background threads, are only timed
+    within `collect()`.
+    """
+    if has_request_context():
+        timings = g.setdefault("timings", {})
+    else:
+        timings = getattr(_collected, "timings", None)
+        if timings is None:
+            yield
+            return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+
+@contextmanager
+def collect() -> Iterator[Dict[str, float]]:
+    """
+    Collects the timings of the spans that the current thread runs outside of a request. This
+    lets background threads that do work on behalf of requests, like the one that processes
+    batches of predictions, time it and hand the timings to those requests, with `add()`.
+    """
+    collected: Dict[str, float] = {}
+    previous = getattr(_collected, "timings", None)
+    _collected.timings = collected
+    try:
+        yield collected
+    finally:
+        _collected.timings = previous
+
+
+def add(collected: Dict[str, float]) -> None:
+    """
+    Adds timings collected elsewhere, i.e. with `collect()`, to those of the current request.
+    """
+    if not has_request_context():
+        return
+    timings = g.setdefault("timings", {})
+    for name, ms in collected.items():
+        timings[name] = timings.get(name, 0.0) + ms
+
+
+def timed(name: str, fn: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Wraps `fn` so that each call is timed as a span with the given name.
+    """
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with span(name):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def timings() -> Dict[str, float]:
+    """
+    Returns the duration of each span of the current request, in milliseconds.
+    """
+    if not has_request_context():
+        return {}
+    return dict(g.get("timings", {}))
+
+
+def instrument_predictor(predictor: Predictor) -> None:
+    """
+    Times the stages of a prediction that happen within the predictor: turning the inputs into
+    instances (i.e. tokenization), as the `instance` span, and the model's forward pass, as the
+    `model` span. What's left of the `predict` span is mostly spent sanitizing the outputs.
+    """
+    for method in ("_json_to_instance", "_json_to_instances"):
+        if hasattr(predictor, method):
+            setattr(predictor, method, timed("instance", getattr(predictor, method)))
+    model = predictor._model
+    model.forward_on_instances = timed("model", model.forward_on_instances)
+
+
+def configure_server_timing(app: Flask) -> None:
+    """
+    Adds a `Server-Timing` header with the timings of each request's spans to its response, so
+    that they show up in the browser's developer tools.
+    """
+
+    @app.after_request
+    def add_server_timing_header(resp: Response) -> Response:
+        t = timings()
+        if t:
+            resp.headers["Server-Timing"] = ", ".join(
+                f"{name};dur={ms:.1f}" for name, ms in t.items()
+            )
+        return resp
@@ -0,0 +1,596 @@
+"""
+Tools for the request logs that endpoints write (see `allennlp_demo.common.logs`), to plan
+capacity and size caches from real traffic. Only requests whose bodies were logged, by endpoints
+created with `log_payloads=True`, can be analyzed or replayed.
+
+`analyze` reports how often the same inputs are requested again, the hit ratio that caches of
+different sizes and eviction policies would have had, and which inputs cost the most:
+
+    python -m allennlp_demo.common.traffic analyze requests.log --cache-sizes 100 1000 10000
+
+`replay` sends the logged requests to an endpoint, with the same spacing as they were received
+(or faster, with `--speed`), and compares the latency with that in the logs:
+
+    python -m allennlp_demo.common.traffic replay requests.log --demo bidaf --speed 2
+
+Logs are read as lines of JSON, either as the endpoints write them or as exported from Cloud
+Logging, where each line's `jsonPayload` is the record. Files ending in `.gz` are decompressed.
+"""
+import argparse
+import datetime
+import gzip
+import json
+import math
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import IO, Any, Dict, Iterator, List, Optional, Tuple
+
+from allennlp_demo.common.benchmark.report import format_summary, percentile, summarize, write
+from allennlp_demo.common.benchmark.runner import COLD, WARM, Run, Sample, send_requests
+from allennlp_demo.common.benchmark.targets import HttpTarget, InProcessTarget, Target
+from allennlp_demo.common.benchmark.workload import Operation
+from allennlp_demo.common.cache import MemoryCacheBackend
+from allennlp_demo.common.normalization import CacheKey, canonical_json
+
+
+# The routes whose results are cached, after the prefix an endpoint may be mounted under (i.e. by
+# `allennlp_demo.common.host`). Jobs and streams share the caches of the synchronous routes.
+_ROUTE = re.compile(
+    r"/(?P<route>(?:jobs/)?(?P<operation>predict_batch|predict|interpret/[^/]+|attack/[^/]+)"
+    r"(?:/stream)?)$"
+)
+
+LRU = "lru"
+COST = "cost"
+"""
+The policy of the endpoints' in-memory caches, which weighs how often a result is requested
+by how long it takes to compute (see `allennlp_demo.common.cache.MemoryCacheBackend`).
+"""
+
+
+@dataclass(frozen=True)
+class LoggedRequest:
+    """
+    A request, as it was logged.
+    """
+
+    timestamp: Optional[float]
+    """
+    When the request was received, in seconds since the epoch. Logs written before timestamps
+    were added to them don't have one.
+    """
+    method: str
+    path: str
+    query: Dict[str, str]
+    body: Optional[Any]
+    """
+    The request's body, or `None` if it wasn't logged.
+    """
+    response_bytes: Optional[int]
+    status: int
+    latency_ms: float
+    cached: bool
+
+    @property
+    def route(self) -> Optional[str]:
+        """
+        The route of the request relative to the endpoint, i.e. `predict` for `/bidaf/predict`,
+        or `None` if its results aren't cached.
+        """
+        match = _ROUTE.search(self.path)
+        return match.group("route") if match and self.method == "POST" else None
+
+
+def _parse_timestamp(value: Any) -> Optional[float]:
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+def _response_bytes(response: Any) -> Optional[int]:
+    if response is None:
+        return None
+    if isinstance(response, dict) and response.get("truncated") and "bytes" in response:
+        return response["bytes"]
+    return len(canonical_json(response))
+
+
+def _open(path: str) -> IO[str]:
+    if path == "-":
+        return sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt")
+    return open(path)
+
+
+def read_logs(paths: List[str]) -> List[LoggedRequest]:
+    """
+    Returns the requests in the given log files, ordered by when they were received. Lines that
+    aren't request logs are skipped.
+    """
+    requests = []
+    for path in paths:
+        with _open(path) as fh:
+            for line in fh:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(record, dict):
+                    continue
+                timestamp = record.get("timestamp")
+                if isinstance(record.get("jsonPayload"), dict):
+                    record = {"timestamp": timestamp, **record["jsonPayload"]}
+                if record.get("logname") != "request" or "path" not in record:
+                    continue
+                body = record.get("request_data")
+                if isinstance(body, dict) and body.get("truncated") and "bytes" in body:
+                    body = None
+                query = {
+                    k: v[0] if isinstance(v, list) else str(v)
+                    for k, v in (record.get("query") or {}).items()
+                }
+                requests.append(
+                    LoggedRequest(
+                        timestamp=_parse_timestamp(record.get("timestamp")),
+                        method=record.get("method", "POST"),
+                        path=record["path"],
+                        query=query,
+                        body=body,
+                        response_bytes=_response_bytes(record.get("response_data")),
+                        status=record.get("status", 200),
+                        latency_ms=record.get("latency_ms", 0.0),
+                        cached=record.get("cached", False),
+                    )
+                )
+    if all(r.timestamp is not None for r in requests):
+        requests.sort(key=lambda r: r.timestamp)  # type: ignore
+    return requests
+
+
+def _normalize(value: Any) -> Any:
+    # Like the endpoints do for some inputs, whitespace in strings is collapsed.
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    return value
+
+
+@dataclass(frozen=True)
+class Lookup:
+    """
+    A lookup in one of an endpoint's caches. A `/predict_batch` request makes one for each of its
+    inputs.
+    """
+
+    cache: str
+    """
+    `predict`, `interpret` or `attack`.
+    """
+    operation: str
+    """
+    I.e. `predict` or `interpret/simple_gradient`.
+    """
+    exact_key: str
+    """
+    Identifies the inputs as they were sent, other than whitespace between JSON tokens.
+    """
+    key: str
+    """
+    Identifies the inputs once they're normalized: regardless of the order of keys, and with
+    whitespace in strings collapsed.
+    """
+    latency_ms: float
+    cached: bool
+    size: Optional[int]
+    request: LoggedRequest
+
+
+def lookups(requests: List[LoggedRequest]) -> Iterator[Lookup]:
+    """
+    Yields the cache lookups made by the requests that succeeded and whose bodies were logged.
+    """
+    for r in requests:
+        match = _ROUTE.search(r.path)
+        if r.route is None or r.body is None or not 200 <= r.status < 300:
+            continue
+        operation = match.group("operation")  # type: ignore
+        if operation == "predict_batch":
+            if not isinstance(r.body, list) or not r.body:
+                continue
+            operation, bodies = "predict", r.body
+            latency_ms = r.latency_ms / len(bodies)
+            size = r.response_bytes // len(bodies) if r.response_bytes is not None else None
+        else:
+            bodies, latency_ms, size = [r.body], r.latency_ms, r.response_bytes
+        for body in bodies:
+            yield Lookup(
+                cache=operation.split("/")[0],
+                operation=operation,
+                exact_key=f"{operation}:{json.dumps(body, separators=(',', ':'))}",
+                key=f"{operation}:{CacheKey(_normalize(body)).digest}",
+                latency_ms=latency_ms,
+                cached=r.cached,
+                size=size,
+                request=r,
+            )
+
+
+def duplicate_rates(items: List[Lookup]) -> Dict[str, Dict[str, Any]]:
+    """
+    Returns the fraction of lookups of each operation, and of all of them, whose inputs were
+    looked up before, exactly and once they're normalized. That's the hit ratio a cache that
+    never evicts anything would have. The ratio of lookups that were actually cache hits is
+    included for comparison.
+    """
+    groups: Dict[str, List[Lookup]] = {"all": items}
+    for item in items:
+        groups.setdefault(item.operation, []).append(item)
+    return {
+        name: {
+            "lookups": len(group),
+            "exact": 1 - len({i.exact_key for i in group}) / len(group),
+            "normalized": 1 - len({i.key for i in group}) / len(group),
+            "recorded_hit_ratio": sum(i.cached for i in group) / len(group),
+        }
+        for name, group in groups.items()
+        if group
+    }
+
+
+def compute_costs(items: List[Lookup]) -> Dict[str, float]:
+    """
+    Returns how long computing the result of each normalized input takes, in milliseconds:
+    the mean latency of the lookups that missed the cache. Inputs that never missed are
+    assumed to cost the median of those of the same operation that did.
+    """
+    misses: Dict[str, List[float]] = {}
+    for item in items:
+        if not item.cached:
+            misses.setdefault(item.key, []).append(item.latency_ms)
+    costs = {key: sum(ls) / len(ls) for key, ls in misses.items()}
+    by_operation: Dict[str, List[float]] = {}
+    for item in items:
+        if item.key in costs:
+            by_operation.setdefault(item.operation, []).append(costs[item.key])
+    for item in items:
+        if item.key not in costs:
+            known = by_operation.get(item.operation)
+            costs[item.key] = percentile(known, 50) if known else item.latency_ms
+    return costs
+
+
+class _LruCache:
+    def __init__(self, maxsize: int, max_bytes: Optional[int] = None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[int]:
+        size = self._entries.get(key)
+        if size is not None:
+            self._entries.move_to_end(key)
+        return size
+
+    def set(self, key: str, size: int, cost: float = 0.0) -> None:
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        self._entries[key] = size
+        self.nbytes += size
+        while len(self._entries) > self.maxsize or (
+            self.max_bytes is not None and self.nbytes > self.max_bytes
+        ):
+            self.nbytes -= self._entries.popitem(last=False)[1]
+
+
+def simulate_cache(
+    items: List[Lookup],
+    policy: str,
+    maxsize: int,
+    max_bytes: Optional[int] = None,
+    costs: Optional[Dict[str, float]] = None,
+) -> Dict[str, Any]:
+    """
+    Replays the lookups against caches with the given policy (`lru` or `cost`) and size, one for
+    each of the `predict`, `interpret` and `attack` routes like an endpoint has. Returns the hit
+    ratio and how much time the hits would have saved, in seconds.
+    """
+    assert policy in (LRU, COST), f"invalid policy {policy}"
+    if costs is None:
+        costs = compute_costs(items)
+    known_sizes = [i.size for i in items if i.size is not None]
+    default_size = int(percentile(known_sizes, 50)) if known_sizes else 1024
+
+    caches: Dict[str, Any] = {}
+    hits = 0
+    saved_ms = 0.0
+    for item in items:
+        cache = caches.get(item.cache)
+        if cache is None:
+            if policy == LRU:
+                cache = _LruCache(maxsize, max_bytes)
+            else:
+                cache = MemoryCacheBackend(item.cache, maxsize, max_bytes=max_bytes)
+            caches[item.cache] = cache
+        size = item.size if item.size is not None else default_size
+        if cache.get(item.key) is not None:
+            hits += 1
+            saved_ms += costs[item.key]
+        elif policy == LRU:
+            cache.set(item.key, size, costs[item.key])
+        else:
+            # The cache only needs values of the right size.
+            cache.set(item.key, bytes(size), costs[item.key])
+    return {
+        "policy": policy,
+        "maxsize": maxsize,
+        "max_bytes": max_bytes,
+        "hit_ratio": hits / len(items) if items else 0.0,
+        "saved_s": saved_ms / 1000,
+    }
+
+
+def heaviest_inputs(
+    items: List[Lookup], costs: Optional[Dict[str, float]] = None, top: int = 10
+) -> List[Dict[str, Any]]:
+    """
+    Returns the inputs that took the most time in total, were none of their results cached,
+    along with how often they were requested and how long each computation takes.
+    """
+    if costs is None:
+        costs = compute_costs(items)
+    groups: Dict[str, List[Lookup]] = {}
+    for item in items:
+        groups.setdefault(item.key, []).append(item)
+    total_ms = sum(costs[i.key] for i in items) or 1.0
+    heaviest = sorted(groups.values(), key=lambda g: costs[g[0].key] * len(g), reverse=True)
+    return [
+        {
+            "operation": group[0].operation,
+            "requests": len(group),
+            "cost_ms": costs[group[0].key],
+            "total_s": costs[group[0].key] * len(group) / 1000,
+            "share": costs[group[0].key] * len(group) / total_ms,
+            "inputs": group[0].exact_key.split(":", 1)[1],
+        }
+        for group in heaviest[:top]
+    ]
+
+
+def analyze(
+    requests: List[LoggedRequest],
+    cache_sizes: List[int],
+    max_bytes: Optional[int] = None,
+    policies: Tuple[str, ...] = (LRU, COST),
+    top: int = 10,
+) -> Dict[str, Any]:
+    items = list(lookups(requests))
+    costs = compute_costs(items)
+    return {
+        "requests": len(requests),
+        "with_bodies": sum(r.body is not None for r in requests),
+        "lookups": len(items),
+        "duplicates": duplicate_rates(items),
+        "caches": [
+            simulate_cache(items, policy, size, max_bytes, costs)
+            for policy in policies
+            for size in cache_sizes
+        ],
+        "heaviest": heaviest_inputs(items, costs, top),
+    }
+
+
+def format_analysis(analysis: Dict[str, Any]) -> str:
+    lines = [
+        f"{analysis['requests']} requests, {analysis['with_bodies']} with bodies, "
+        f"{analysis['lookups']} cache lookups",
+        "",
+        "operation\tlookups\texact_dup\tnormalized_dup\trecorded_hits",
+    ]
+    for name, d in analysis["duplicates"].items():
+        lines.append(
+            f"{name}\t{d['lookups']}\t{d['exact']:.1%}\t{d['normalized']:.1%}\t"
+            f"{d['recorded_hit_ratio']:.1%}"
+        )
+    lines += ["", "policy\tentries\thit_ratio\tsaved_s"]
+    for c in analysis["caches"]:
+        lines.append(f"{c['policy']}\t{c['maxsize']}\t{c['hit_ratio']:.1%}\t{c['saved_s']:.1f}")
+    lines += ["", "operation\trequests\tcost_ms\ttotal_s\tshare\tinputs"]
+    for h in analysis["heaviest"]:
+        inputs = h["inputs"] if len(h["inputs"]) <= 80 else h["inputs"][:77] + "..."
+        lines.append(
+            f"{h['operation']}\t{h['requests']}\t{h['cost_ms']:.0f}\t{h['total_s']:.1f}\t"
+            f"{h['share']:.1%}\t{inputs}"
+        )
+    return "\n".join(lines)
+
+
+def replay(
+    requests: List[LoggedRequest],
+    target: Target,
+    speed: Optional[float] = 1.0,
+    concurrency: int = 8,
+    no_cache: bool = False,
+) -> Run:
+    """
+    Sends the logged requests whose bodies were logged to the target, in the order they were
+    received. With a `speed` they're sent with the same spacing as they were received, divided by
+    the speed, so that i.e. `2` sends them twice as fast. Without one, or if the logs don't have
+    timestamps, they're sent as fast as `concurrency` threads can send them.
+    """
+    replayable = [r for r in requests if r.route is not None and r.body is not None]
+    timed = speed is not None and all(r.timestamp is not None for r in replayable)
+    first = replayable[0].timestamp if replayable and timed else 0.0
+    start = time.perf_counter()
+    lock = threading.Lock()
+    remaining = iter(replayable)
+
+    def next_request() -> Optional[Tuple[Operation, bool, float]]:
+        with lock:
+            r = next(remaining, None)
+        if r is None:
+            return None
+        route = r.route
+        assert route is not None
+        query = {k: v for k, v in r.query.items() if k != "no_cache"}
+        op = Operation(route, f"/{route}", r.body, query=query or None)
+        if timed:
+            due = start + (r.timestamp - first) / speed  # type: ignore
+        else:
+            due = time.perf_counter()
+        return op, no_cache or "no_cache" in r.query, due
+
+    return send_requests(target, next_request, concurrency, start)
+
+
+def recorded_run(requests: List[LoggedRequest]) -> Run:
+    """
+    Returns the logged requests that can be replayed as a `Run`, so that they're summarized the
+    same way.
+    """
+    replayable = [r for r in requests if r.route is not None and r.body is not None]
+    timestamps = [r.timestamp for r in replayable if r.timestamp is not None]
+    first = min(timestamps, default=0.0)
+    elapsed = max(timestamps, default=0.0) - first
+    samples = [
+        Sample(
+            r.route,  # type: ignore
+            (r.timestamp or first) - first,
+            r.latency_ms,
+            r.status,
+            WARM if r.cached else COLD,
+        )
+        for r in replayable
+    ]
+    return Run(samples, elapsed if elapsed > 0 else math.inf)
+
+
+def format_comparison(recorded: Dict[str, Any], replayed: Dict[str, Any]) -> str:
+    """
+    Returns the latency of the replayed requests next to that in the logs, as a table.
+    """
+    columns = ["p50_ms", "p95_ms", "p99_ms"]
+    lines = [
+        "\t".join(
+            ["operation", "cache", "requests"]
+            + [f"{when}_{c}" for c in columns for when in ("recorded", "replayed")]
+        )
+    ]
+    for name, groups in replayed.items():
+        for cache, now in groups.items():
+            before = recorded.get(name, {}).get(cache)
+            if now["requests"] == 0 or before is None or before["requests"] == 0:
+                continue
+            values = [f"{s[c]:.1f}" for c in columns for s in (before, now)]
+            lines.append("\t".join([name, cache, str(now["requests"])] + values))
+    return "\n".join(lines)
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m allennlp_demo.common.traffic",
+        description="Analyzes and replays the request logs of model endpoints.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    analyze_parser = commands.add_parser("analyze", help="report duplicates and cache hit ratios")
+    analyze_parser.add_argument("logs", nargs="+", help="log files, or - for stdin")
+    analyze_parser.add_argument(
+        "--cache-sizes",
+        nargs="+",
+        type=int,
+        default=[128, 1024, 8192],
+        help="the numbers of entries of each cache to simulate",
+    )
+    analyze_parser.add_argument(
+        "--cache-mb", type=float, help="limit the simulated caches to this many MiB each"
+    )
+    analyze_parser.add_argument(
+        "--policy", nargs="+", choices=[LRU, COST], default=[LRU, COST], help="eviction policies"
+    )
+    analyze_parser.add_argument("--top", type=int, default=10, help="how many inputs to list")
+    analyze_parser.add_argument("--output", help="write the analysis to this JSON file")
+
+    replay_parser = commands.add_parser("replay", help="send the logged requests to an endpoint")
+    replay_parser.add_argument("logs", nargs="+", help="log files, or - for stdin")
+    target = replay_parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--demo", help="load this demo's endpoint in-process, i.e. bidaf")
+    target.add_argument("--url", help="send the requests to the endpoint at this URL")
+    replay_parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="how many times faster than they were received to send the requests, or 0 to send "
+        "them as fast as possible",
+    )
+    replay_parser.add_argument(
+        "--concurrency", type=int, default=8, help="how many requests may be in flight at once"
+    )
+    replay_parser.add_argument(
+        "--no-cache", action="store_true", help="send every request with no_cache"
+    )
+    replay_parser.add_argument("--output", help="write the results to this JSON file")
+
+    parsed = parser.parse_args(args)
+    requests = read_logs(parsed.logs)
+
+    if parsed.command == "analyze":
+        max_bytes = int(parsed.cache_mb * 2**20) if parsed.cache_mb else None
+        analysis = analyze(
+            requests, parsed.cache_sizes, max_bytes, tuple(parsed.policy), parsed.top
+        )
+        print(format_analysis(analysis))
+        if parsed.output is not None:
+            write(parsed.output, analysis)
+        return
+
+    replay_target: Target
+    if parsed.url is not None:
+        replay_target = HttpTarget(parsed.url)
+    else:
+        from allennlp_demo.common.host import endpoint_class
+
+        endpoint = endpoint_class(parsed.demo)()  # type: ignore
+        endpoint.wait_until_ready()
+        replay_target = InProcessTarget(endpoint.app)
+
+    result = replay(
+        requests,
+        replay_target,
+        speed=parsed.speed or None,
+        concurrency=parsed.concurrency,
+        no_cache=parsed.no_cache,
+    )
+    recorded = summarize(recorded_run(requests))
+    replayed = summarize(result)
+    print(format_summary(replayed))
+    print()
+    print(format_comparison(recorded, replayed))
+    if parsed.output is not None:
+        write(
+            parsed.output,
+            {
+                "target": replay_target.describe(),
+                "speed": parsed.speed,
+                "concurrency": parsed.concurrency,
+                "recorded": recorded,
+                "replayed": replayed,
+            },
+        )
+
+
+if __name__ == "__main__":
+    main()
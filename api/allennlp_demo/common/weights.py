@@ -0,0 +1,70 @@
+import hashlib
+import threading
+import weakref
+from typing import Dict, Tuple
+
+import torch
+
+
+def _digest(tensor: torch.Tensor) -> str:
+    data = tensor.detach().cpu().contiguous().reshape(-1)
+    if data.dtype == torch.bfloat16:
+        # numpy doesn't support bfloat16, but the bits are all that matter.
+        data = data.view(torch.int16)
+    return hashlib.blake2b(data.numpy().view("uint8"), digest_size=16).hexdigest()
+
+
+class WeightPool:
+    """
+    Lets models that are loaded in the same process share the parameters they have in common,
+    like those of a pretrained encoder that several models were fine-tuned from without updating
+    it. Parameters are identified by their type, shape and a hash of their contents, and are only
+    shared if they're equal. Shared parameters mustn't be modified.
+
+    The pool only holds weak references to the parameters, so parameters that no loaded model
+    uses anymore are freed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._params: "weakref.WeakValueDictionary[Tuple, torch.nn.Parameter]" = (
+            weakref.WeakValueDictionary()
+        )
+        self.deduplicated_bytes = 0
+        """
+        The number of bytes of parameters that were replaced by ones that were already loaded.
+        """
+        self.model_lock = threading.RLock()
+        """
+        A lock for the endpoints of models that share parameters to use instead of their own.
+        The interpreters and attackers toggle whether parameters require gradients, which would
+        affect every model that shares them.
+        """
+
+    def deduplicate(self, model: torch.nn.Module) -> int:
+        """
+        Replaces each parameter of the model that's equal to one of a model that was passed to
+        this method before with that one. Returns the number of bytes that were saved.
+        """
+        replacements: Dict[int, torch.nn.Parameter] = {}
+        saved = 0
+        with self._lock:
+            for param in model.parameters():
+                key = (param.dtype, tuple(param.shape), param.device.type, _digest(param))
+                shared = self._params.get(key)
+                if shared is None:
+                    self._params[key] = param
+                elif shared is not param and torch.equal(shared, param):
+                    replacements[id(param)] = shared
+                    saved += param.numel() * param.element_size()
+            self.deduplicated_bytes += saved
+
+        # A parameter may be used by several modules, i.e. when embeddings are tied.
+        for module in model.modules():
+            for name, param in module._parameters.items():
+                if param is not None and id(param) in replacements:
+                    module._parameters[name] = replacements[id(param)]
+        return saved
+
+
+pool = WeightPool()
@@ -1,9 +1,10 @@
 import os
 from typing import Dict
 
-from allennlp.interpret.attackers import Attacker, Hotflip
+from allennlp.interpret.attackers import Attacker
 
-from allennlp_demo.common import config, http
+from allennlp_demo.common import config, http, snapshot
+from allennlp_demo.common.attackers import LazyHotflip
 
 
 class MaskedLmModelEndpoint(http.ModelEndpoint):
@@ -12,8 +13,7 @@ class MaskedLmModelEndpoint(http.ModelEndpoint):
         super().__init__(c)
 
     def load_attackers(self) -> Dict[str, Attacker]:
-        hotflip = Hotflip(self.predictor, "bert")
-        hotflip.initialize()
+        hotflip = LazyHotflip(self.predictor, "bert", cache_dir=snapshot.snapshot_path(self.model))
         return {"hotflip": hotflip}
 
 
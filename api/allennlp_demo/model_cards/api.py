@@ -3,28 +3,53 @@ import flask
 
 from typing import Dict
 
+from allennlp_demo.common.compression import configure_compression
+from allennlp_demo.common.documents import Document
+from allennlp_demo.common.health import configure_health_checks
 from allennlp_demo.common.logs import configure_logging
+from allennlp_demo.common.metrics import configure_metrics
 from allennlp_models.pretrained import get_pretrained_models
 
 
 logger = logging.getLogger(__name__)
 
+SUMMARY_FIELDS = ("display_name", "task_id", "short_description")
+"""
+The fields of each model card that are included in the summary.
+"""
+
 
 class ModelCardsService(flask.Flask):
     def __init__(self, name: str = "model-cards"):
         super().__init__(name)
+        configure_compression(self)
         configure_logging(self)
+        configure_metrics(self)
+        configure_health_checks(self)
 
-        # We call this once and cache the results. It takes a little memory (~4 MB) but makes
-        # everything a lot faster.
+        # We call this once and cache the results, serialized. It takes a little memory (~4 MB)
+        # but makes everything a lot faster.
         self.cards_by_id = get_pretrained_models()
+        cards: Dict[str, Dict] = {id: card.to_dict() for id, card in self.cards_by_id.items()}
+        self.all_cards = Document(cards)
+        self.summary = Document(
+            {id: {k: card[k] for k in SUMMARY_FIELDS if k in card} for id, card in cards.items()}
+        )
+        self.cards = {id: Document(card) for id, card in cards.items()}
 
         @self.route("/", methods=["GET"])
         def all_model_cards():
-            cards: Dict[str, Dict] = {}
-            for id, card in self.cards_by_id.items():
-                cards[id] = card.to_dict()
-            return flask.jsonify(cards)
+            return self.all_cards.response()
+
+        @self.route("/summary", methods=["GET"])
+        def model_card_summary():
+            return self.summary.response()
+
+        @self.route("/<string:model_id>", methods=["GET"])
+        def model_card(model_id: str):
+            if model_id not in self.cards:
+                return flask.jsonify({"error": f"No model card for '{model_id}'"}), 404
+            return self.cards[model_id].response()
 
 
 if __name__ == "__main__":
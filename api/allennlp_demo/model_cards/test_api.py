@@ -11,3 +11,32 @@ def test_model_cards():
     assert bidaf is not None
     assert bidaf.get("display_name") == "BiDAF"
     assert bidaf.get("contact") == "allennlp-contact@allenai.org"
+
+
+def test_model_card_routes():
+    app = ModelCardsService()
+    client = app.test_client()
+
+    response = client.get("/rc-bidaf")
+    assert response.status_code == 200
+    assert response.json.get("display_name") == "BiDAF"
+    assert client.get("/nope").status_code == 404
+
+    response = client.get("/summary")
+    assert response.status_code == 200
+    assert response.json["rc-bidaf"] == {
+        "display_name": "BiDAF",
+        "task_id": "rc",
+        "short_description": "BiDAF model with GloVe embeddings.",
+    }
+
+
+def test_model_cards_etag():
+    app = ModelCardsService()
+    client = app.test_client()
+    response = client.get("/")
+    etag = response.headers["ETag"]
+
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
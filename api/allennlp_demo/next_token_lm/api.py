@@ -1,12 +1,14 @@
 import os
 import re
-from typing import Dict, Any
+from typing import Dict, Any, List
 
-from allennlp.interpret.attackers import Attacker, Hotflip
+from allennlp.interpret.attackers import Attacker
 from allennlp.predictors.predictor import JsonDict
 from overrides import overrides
 
-from allennlp_demo.common import config, http
+from allennlp_demo.common import config, http, snapshot
+from allennlp_demo.common.attackers import LazyHotflip
+from allennlp_demo.common.timing import span
 
 
 class NextTokenLmModelEndpoint(http.ModelEndpoint):
@@ -19,28 +21,41 @@ class NextTokenLmModelEndpoint(http.ModelEndpoint):
 
     @overrides
     def load_attackers(self) -> Dict[str, Attacker]:
-        hotflip = Hotflip(self.predictor, "gpt2")
-        hotflip.initialize()
+        hotflip = LazyHotflip(self.predictor, "gpt2", cache_dir=snapshot.snapshot_path(self.model))
         return {"hotflip": hotflip}
 
     @overrides
-    def predict(self, inputs: JsonDict) -> JsonDict:
+    def normalize_inputs(self, inputs: JsonDict) -> JsonDict:
         # We override this to do a little extra sanitization on the inputs.
         # In particular, we strip any trailing whitespace (except for newlines,
         # which are most likely intentional) and remove any double spaces, since
-        # these things result in poor predictions.
-        inputs["sentence"] = self._sanitize_input_text(inputs["sentence"])
-        outputs = self.predictor.predict_json(inputs)
-        # We also do some final sanitization on the outputs to remove the '<endoftext>' token
+        # these things result in poor predictions. Doing this here rather than in
+        # `predict()` means that inputs that only differ in these ways share cache entries.
+        if "sentence" in inputs:
+            inputs["sentence"] = self._sanitize_input_text(inputs["sentence"])
+        return inputs
+
+    @overrides
+    def predict(self, inputs: JsonDict) -> JsonDict:
+        outputs = super().predict(inputs)
+        # We do some final sanitization on the outputs to remove the '<endoftext>' token
         # and filter out any predicted sequences that are empty, i.e. just equal to the
         # '<|endoftext|>' token repeated.
         return self._sanitize_outputs(outputs)
 
+    @overrides
+    def predict_batch(self, inputs: List[JsonDict]) -> List[JsonDict]:
+        return [self._sanitize_outputs(o) for o in super().predict_batch(inputs)]
+
     @staticmethod
     def _sanitize_input_text(sentence: str) -> str:
         return re.sub(r" +", " ", sentence.rstrip(" \t\r"))
 
     def _sanitize_outputs(self, output: Dict[str, Any]) -> Dict[str, Any]:
+        with span("sanitize"):
+            return self._filter_end_of_text(output)
+
+    def _filter_end_of_text(self, output: Dict[str, Any]) -> Dict[str, Any]:
         sanitized_top_tokens = []
         sanitized_top_indices = []
         sanitized_probabilities = []
@@ -8,6 +8,12 @@ class TestNextTokenLmModelEndpoint(ModelEndpointTestCase):
     endpoint = NextTokenLmModelEndpoint()
     predict_input = {"sentence": "AlleNLP is a"}
 
+    def test_sanitized_inputs_share_cache_entries(self):
+        response = self.client.post("/predict", json={"sentence": "AlleNLP  is a "})
+        self.check_response_okay(response, cache_hit=False)
+        response = self.client.post("/predict", json={"sentence": "AlleNLP is a"})
+        self.check_response_okay(response, cache_hit=True)
+
     @pytest.mark.parametrize(
         "input_text, result",
         [
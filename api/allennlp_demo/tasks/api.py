@@ -4,21 +4,52 @@ The tasks endpoint lists all demo tasks and some info about them.
 import logging
 import flask
 
+from dataclasses import asdict
+
+from allennlp_demo.common.compression import configure_compression
+from allennlp_demo.common.documents import Document
+from allennlp_demo.common.health import configure_health_checks
 from allennlp_demo.common.logs import configure_logging
+from allennlp_demo.common.metrics import configure_metrics
 from allennlp_models.pretrained import get_tasks
 
 logger = logging.getLogger(__name__)
 
+SUMMARY_FIELDS = ("name",)
+"""
+The fields of each task that are included in the summary.
+"""
+
 
 class TasksService(flask.Flask):
     def __init__(self, name: str = "tasks"):
         super().__init__(name)
+        configure_compression(self)
         configure_logging(self)
+        configure_metrics(self)
+        configure_health_checks(self)
+
+        # The task cards don't change, so they're read and serialized once.
+        tasks = {id: asdict(task) for id, task in get_tasks().items()}
+        self.all_tasks = Document(tasks)
+        self.summary = Document(
+            {id: {k: task[k] for k in SUMMARY_FIELDS} for id, task in tasks.items()}
+        )
+        self.tasks = {id: Document(task) for id, task in tasks.items()}
 
         @self.route("/", methods=["GET"])
-        def tasks():
-            tasks = get_tasks()
-            return flask.jsonify(tasks)
+        def all_tasks():
+            return self.all_tasks.response()
+
+        @self.route("/summary", methods=["GET"])
+        def task_summary():
+            return self.summary.response()
+
+        @self.route("/<string:task_id>", methods=["GET"])
+        def task(task_id: str):
+            if task_id not in self.tasks:
+                return flask.jsonify({"error": f"No task '{task_id}'"}), 404
+            return self.tasks[task_id].response()
 
 
 if __name__ == "__main__":
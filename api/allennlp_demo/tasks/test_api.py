@@ -7,3 +7,21 @@ def test_tasks():
     response = client.get("/")
     assert response.status_code == 200
     assert len(response.json.items()) > 0
+
+
+def test_task_routes():
+    app = TasksService()
+    client = app.test_client()
+
+    response = client.get("/rc")
+    assert response.status_code == 200
+    assert response.json["id"] == "rc"
+    assert client.get("/nope").status_code == 404
+
+    response = client.get("/summary")
+    assert response.status_code == 200
+    assert response.json["rc"] == {"name": "Reading Comprehension"}
+
+    etag = response.headers["ETag"]
+    response = client.get("/summary", headers={"If-None-Match": etag})
+    assert response.status_code == 304
@@ -1,4 +1,5 @@
 import os
+from typing import List
 
 from allennlp.common.util import JsonDict
 
@@ -11,10 +12,17 @@ class TransformerQaModelEndpoint(http.ModelEndpoint):
         super().__init__(c)
 
     def predict(self, inputs: JsonDict):
+        return super().predict(self._rename_passage(inputs))
+
+    def predict_batch(self, inputs: List[JsonDict]):
+        return super().predict_batch([self._rename_passage(i) for i in inputs])
+
+    @staticmethod
+    def _rename_passage(inputs: JsonDict) -> JsonDict:
         # For compatability with other RC models.
         if "passage" in inputs:
             inputs["context"] = inputs.pop("passage")
-        return super().predict(inputs)
+        return inputs
 
     def load_interpreters(self):
         # The interpreters don't work with this model right now.
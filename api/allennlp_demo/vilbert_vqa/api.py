@@ -2,6 +2,7 @@ import os
 
 import tempfile
 from base64 import standard_b64decode
+from typing import List
 
 from allennlp.common.util import JsonDict
 
@@ -40,6 +41,10 @@ class VilbertVqaModelEndpoint(http.ModelEndpoint):
         results.sort(key=lambda x: -x["confidence"])
         return results[:45]  # Jon only wants the first 45 results.
 
+    def predict_batch(self, inputs: List[JsonDict]):
+        # Each input might come with its own temporary image file, so we predict them one by one.
+        return [self.predict(i) for i in inputs]
+
     def load_interpreters(self):
         # The interpreters don't work with this model right now.
         return {}